@@ -16,31 +16,37 @@ class Validator {
 
     /**
      * Download files from Moodle to temporary location
-     * @param {Array} files - Array of file objects with fileUrl and fileName
+     *
+     * The Moodle RPC service downloads all files concurrently into the shared files directory;
+     * they are read from there and removed again. Files with their timemodified are served from
+     * the download cache of the service, unless they changed in Moodle.
+     *
+     * @param {Array} files - Array of file objects with fileUrl, fileName and timemodified (optional)
      * @param {Object} options - Moodle API options
      * @returns {Promise<Array>} - Array of temp file objects
      */
     async downloadFilesToTemp(files, options) {
-        const tempFiles = [];
-
-        for (const file of files) {
-            try {
-                const downloadedFiles = await this.server.rpcs["MoodleRPC"].downloadSubmissionsFromUrl({
-                    fileUrls: [file.fileUrl],
-                    options: options,
-                });
+        const summary = await this.server.rpcs["MoodleRPC"].downloadSubmissionsToFiles({
+            fileUrls: files.map((file) => file.timemodified ? {url: file.fileUrl, timemodified: file.timemodified} : file.fileUrl),
+            options: options,
+        });
 
-                // Create temp file object
-                const tempFile = {
-                    content: downloadedFiles[0], // Array of bytes
+        const tempFiles = [];
+        try {
+            for (const item of summary.items) {
+                const file = files[item.index];
+                if (!item.success) {
+                    throw new Error(`Failed to download file ${file.fileName}: ${item.message}`);
+                }
+                tempFiles.push({
+                    content: await fs.promises.readFile(path.join(UPLOAD_PATH, item.fileRef.path)), // Array of bytes
                     fileName: file.fileName,
                     fileType: file.fileType,
-                };
-
-                tempFiles.push(tempFile);
-            } catch (error) {
-                throw new Error(`Failed to download file ${file.fileName}: ${error.message}`);
+                });
             }
+        } finally {
+            await Promise.all(summary.items.filter((item) => item.success).map(
+                (item) => fs.promises.rm(path.join(UPLOAD_PATH, item.fileRef.path), {force: true})));
         }
 
         return tempFiles;
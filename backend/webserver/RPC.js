@@ -152,9 +152,10 @@ module.exports = class RPC {
      *
      * @param event
      * @param data
+     * @param timeout ms to wait for the acknowledgement (default: this.timeout)
      * @returns {Promise<Object>}
      */
-    async emit(event, data) {
+    async emit(event, data, timeout = this.timeout) {
         this.logger.info("Emitting event to RPC service...");
 
         if (!this.socket) {
@@ -167,7 +168,7 @@ module.exports = class RPC {
 
         try {
             return new Promise((resolve, reject) => {
-                this.socket.timeout(this.timeout).emit(event, data, (err, response) => {
+                this.socket.timeout(timeout).emit(event, data, (err, response) => {
                     if (err) {
                         this.logger.error(err);
                         reject(err);
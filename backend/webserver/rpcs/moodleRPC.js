@@ -1,5 +1,6 @@
 const RPC = require("../RPC.js");
 const {io: io_client} = require("socket.io-client");
+const crypto = require("crypto");
 
 /**
  * Connects to the Moodle RPC service
@@ -16,21 +17,36 @@ module.exports = class MoodleRPC extends RPC {
         super(server, url);
 
         this.timeout = 30000; //default timeout for connection
+        this.startTimeout = 10000; //time the service has to start a request before rejecting it as overloaded
+        this.overloadRetries = 3; //number of retries of a request rejected as overloaded
+        this.downloadFileTimeout = 10000; //additional time a download may take per file
 
     }
 
     /**
      * Send request to moodle RPC service
      *
+     * Requests rejected by the service as overloaded (no free slot before the deadline) are retried with a growing delay.
+     *
      * @param {Object} data - The data object
      * @param {String} eventName - The request name to send to the RPC service
+     * @param {number} [timeout] - ms to wait for the response (default: this.timeout)
      * @returns {Promise<Object>} - The response from the RPC service
      * @throws {Error} If the RPC service call fails or returns an unsuccessful response.
      */
-    async request(eventName, data) {
+    async request(eventName, data, timeout = this.timeout) {
         this.logger.info("Calling RPC service with request: " + eventName);
 
-        const response = await this.emit(eventName, data);
+        let response;
+        for (let attempt = 0; ; attempt++) {
+            response = await this.emit(eventName, {...data, deadline: Date.now() + this.startTimeout}, timeout);
+            if (!response['overloaded'] || attempt >= this.overloadRetries) {
+                break;
+            }
+            const delay = (response['retryAfter'] || 1) * 1000 * (attempt + 1);
+            this.logger.warn("RPC service overloaded on " + eventName + ", retrying in " + delay + "ms");
+            await new Promise(resolve => setTimeout(resolve, delay));
+        }
         if (!response['success']) {
             this.logger.error("Error in request " + eventName + ": " + response['message']);
             throw new Error(response['message']);
@@ -120,8 +136,10 @@ module.exports = class MoodleRPC extends RPC {
     /**
      * Downloads submissions from a user by their id.
      *
+     * All files are returned in the response at once; prefer downloadSubmissionsToFiles for many or large files.
+     *
      * @param {List<String>} data - Containing the urls of the submissions to download. The urls can be retrieved from the 'submissionURLs' field of the response from 'getSubmissionInfosFromAssignment'.
-     * @returns {Promise<Object>} The submission file data in binary format.
+     * @returns {Promise<Object>} The summary with an item ({index, success, message, file}) per file, in the order of the urls; a failed file has no file data.
      * @throws {Error} If the RPC service returns a failure response or an error occurs during the process.
      */
     async downloadSubmissionsFromUrl(data) {
@@ -132,6 +150,39 @@ module.exports = class MoodleRPC extends RPC {
         return response['data'];
     }
 
+    /**
+     * Downloads submission files into the files directory, which is shared with the Moodle RPC service
+     *
+     * The service downloads the files concurrently and streams them to disk, so they never cross the socket.
+     * Every finished file is sent as a downloadProgress event; failed files are reported there and in the summary
+     * without failing the others. The caller owns the downloaded files and has to remove them.
+     *
+     * @param {Object} data - The data object containing the urls of the submissions (fileUrls, each a url or {url, timemodified}
+     *  to reuse an unchanged file from the download cache of the service) and the Moodle options.
+     * @param {function(Object): void} [onProgress] - Called with every file ({index, done, total, success, message, fileRef}) as soon as it is done.
+     * @returns {Promise<Object>} - The summary with an item ({index, success, message, fileRef}) per file, in the order of the urls.
+     * @throws {Error} If the RPC service returns a failure response or an error occurs during the process.
+     */
+    async downloadSubmissionsToFiles(data, onProgress = undefined) {
+        if (!this.socket) {
+            throw new Error("RPC service not connected");
+        }
+        const downloadId = crypto.randomUUID();
+        const listener = (message) => {
+            if (message['downloadId'] === downloadId && onProgress) {
+                onProgress(message);
+            }
+        };
+        this.socket.on("downloadProgress", listener);
+        try {
+            const response = await this.request("downloadSubmissionsFromUrl", {...data, output: "fileRef", downloadId},
+                this.timeout + data.fileUrls.length * this.downloadFileTimeout);
+            return response['data'];
+        } finally {
+            this.socket.off("downloadProgress", listener);
+        }
+    }
+
     /**
      * Publishes the text feedback for an assignment to Moodle.
      *
@@ -144,7 +195,8 @@ module.exports = class MoodleRPC extends RPC {
      * @param {Array<Object>} data.feedback - An array of objects containing the uploaded users:
      * @param {number} data.feedback.extId - The ID of the user.
      * @param {string} data.feedback.feedback - The feedback text.
-     * @returns {Promise<Object>} - A promise that resolves when the passwords have been uploaded.
+     * @returns {Promise<Object>} - A promise that resolves when the passwords have been uploaded, with the result of every user ({extId, success, message}) as data.
+     * @throws {Error} If publishing failed for any user; the message names the users to send again.
      */
     async publishAssignmentTextFeedback(data) {
         return await this.request("publishAssignmentTextFeedback", data);
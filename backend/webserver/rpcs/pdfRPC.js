@@ -1,5 +1,11 @@
 const RPC = require("../RPC.js");
 const {io: io_client} = require("socket.io-client");
+const crypto = require("crypto");
+const fs = require("fs");
+const path = require("path");
+const {pipeline} = require("stream/promises");
+
+const UPLOAD_PATH = `${__dirname}/../../../files`;
 
 /**
  * PDFRPC - Handles PDF annotation operations via a remote RPC service
@@ -18,27 +24,214 @@ module.exports = class PDFRPC extends RPC {
         super(server, url);
 
         this.timeout = 30000; //default timeout for connection
+        this.startTimeout = 10000; //time the service has to start a request before rejecting it as overloaded
+        this.overloadRetries = 3; //number of retries of a request rejected as overloaded
+        this.chunkSize = 512 * 1024; //size of the chunks of uploads, below the max message size of the service
+        this.batchItemTimeout = 10000; //additional time a batch may take per document
 
     }
 
     /**
      * Send request to moodle RPC service
      *
+     * Requests rejected by the service as overloaded (no free slot before the deadline) are retried with a growing delay.
+     * The responseDeadline tells the service when this call stops waiting, so it can abandon the work after a timeout.
+     *
      * @param {Object} data - The data object
      * @param {String} eventName - The request name to send to the RPC service
+     * @param {number} [timeout] - ms to wait for the response (default: this.timeout)
      * @returns {Promise<Object>} - The response from the RPC service
      * @throws {Error} If the RPC service call fails or returns an unsuccessful response.
      */
-    async request(eventName, data) {
+    async request(eventName, data, timeout = this.timeout) {
         this.logger.info("Calling RPC service with request: " + eventName);
 
-        const response = await this.emit(eventName, data);
+        let response;
+        for (let attempt = 0; ; attempt++) {
+            const now = Date.now();
+            response = await this.emit(eventName, {
+                ...data,
+                deadline: now + this.startTimeout,
+                responseDeadline: now + timeout
+            }, timeout);
+            if (!response['overloaded'] || attempt >= this.overloadRetries) {
+                break;
+            }
+            const delay = (response['retryAfter'] || 1) * 1000 * (attempt + 1);
+            this.logger.warn("RPC service overloaded on " + eventName + ", retrying in " + delay + "ms");
+            await new Promise(resolve => setTimeout(resolve, delay));
+        }
         if (!response['success']) {
             this.logger.error("Error in request " + eventName + ": " + response['message']);
             throw new Error(response['message']);
         }
         return response;
     }
+
+    /**
+     * Restores the full PDF file from a response in incremental output mode
+     *
+     * In incremental mode, the RPC service only returns the update (changed objects and new xref)
+     * that has to be appended to the original file sent with the request.
+     *
+     * @param {Buffer} original - The PDF file sent with the request.
+     * @param {Buffer} buffer - The file or update returned by the RPC service.
+     * @param {Object} response - The response from the RPC service.
+     * @returns {Buffer} - The full PDF file.
+     * @throws {Error} If the update does not belong to the original file.
+     */
+    applyOutput(original, buffer, response) {
+        if (response['outputMode'] !== "incremental") {
+            return buffer;
+        }
+        const base = Buffer.from(original);
+        if (base.length !== response['baseSize']) {
+            throw new Error("Incremental update does not match the original file");
+        }
+        return Buffer.concat([base, Buffer.from(buffer)]);
+    }
+
+    /**
+     * Builds a reference to a file in the files directory, which is shared with the PDF RPC service
+     *
+     * Sending {fileRef} instead of {file} lets the service read the file from the shared volume;
+     * results of such requests are written next to it and returned as references of the same shape.
+     *
+     * @param {string} filePath - Path of the file inside the files directory.
+     * @returns {Promise<{path: string, hash: string}>} - The path relative to the files directory and the SHA-256 hash of the file.
+     */
+    async fileRef(filePath) {
+        const hash = crypto.createHash("sha256");
+        await pipeline(fs.createReadStream(filePath), hash);
+        return {path: path.relative(UPLOAD_PATH, filePath), hash: hash.digest("hex")};
+    }
+
+    /**
+     * Uploads a file to the PDF RPC service in chunks
+     *
+     * Other requests can then name the file by {uploadId} instead of sending it as {file}.
+     * If a chunk fails (e.g. after a reconnect), the upload resumes at the offset the service received.
+     *
+     * @param {string} filePath - Path of the file to upload.
+     * @param {string} [uploadId] - ID of an unfinished upload of the same file to resume.
+     * @returns {Promise<{uploadId: string, hash: string, size: number}>} - The committed upload.
+     * @throws {Error} If the upload fails repeatedly or the service rejects the file.
+     */
+    async upload(filePath, uploadId = undefined) {
+        const {size} = await fs.promises.stat(filePath);
+        const {hash} = await this.fileRef(filePath);
+        let begin = (await this.request("uploadBegin", {size, hash, uploadId}))['data'];
+        uploadId = begin['uploadId'];
+        let offset = begin['received'];
+
+        const handle = await fs.promises.open(filePath, "r");
+        try {
+            const buffer = Buffer.alloc(this.chunkSize);
+            let failures = 0;
+            while (offset < size) {
+                const {bytesRead} = await handle.read(buffer, 0, Math.min(this.chunkSize, size - offset), offset);
+                try {
+                    const response = await this.request("uploadChunk", {uploadId, offset, data: buffer.subarray(0, bytesRead)});
+                    offset = response['data']['received'];
+                } catch (err) {
+                    if (++failures > this.overloadRetries) {
+                        throw err;
+                    }
+                    this.logger.warn("Upload chunk failed, resuming upload " + uploadId + ": " + err.message);
+                    begin = (await this.request("uploadBegin", {size, hash, uploadId}))['data'];
+                    offset = begin['received'];
+                }
+            }
+        } finally {
+            await handle.close();
+        }
+        return (await this.request("uploadCommit", {uploadId}))['data'];
+    }
+
+    /**
+     * Fetches a committed upload or a result returned by {uploadId} from the PDF RPC service in chunks
+     *
+     * @param {string} uploadId - ID of the file.
+     * @param {string} filePath - Path the file is written to.
+     * @param {boolean} [remove=true] - Whether the file is deleted from the service afterwards.
+     * @returns {Promise<void>}
+     * @throws {Error} If a chunk cannot be fetched.
+     */
+    async download(uploadId, filePath, remove = true) {
+        const handle = await fs.promises.open(filePath, "w");
+        try {
+            let offset = 0;
+            for (;;) {
+                const chunk = (await this.request("uploadFetch", {uploadId, offset, length: this.chunkSize}))['data'];
+                await handle.write(chunk['data'], 0, chunk['data'].length, offset);
+                offset += chunk['data'].length;
+                if (chunk['eof']) {
+                    break;
+                }
+            }
+        } finally {
+            await handle.close();
+        }
+        if (remove) {
+            await this.request("uploadDelete", {uploadId});
+        }
+    }
+
+    /**
+     * Runs a batch event on the PDF RPC service, e.g. the import or export of a whole course as one scheduled job
+     *
+     * The service processes the documents in parallel and sends the result of every document as a batchProgress event
+     * as soon as it is done; failed documents are reported there and in the summary without failing the batch.
+     *
+     * @param {string} eventName - annotationsExtractBatch or embedAnnotationsBatch.
+     * @param {Array<Object>} items - The request data of every document: file, fileRef or uploadId, the annotations to embed and an optional id.
+     * @param {Object} [options] - Options for all documents (e.g. outputMode, highlightMode).
+     * @param {function(Object): void} [onProgress] - Called with the batchProgress message of every document ({index, id, done, total} and its response).
+     * @returns {Promise<Object>} - The summary of the batch with the success and message of every document.
+     * @throws {Error} If the batch cannot be run.
+     */
+    async batch(eventName, items, options = {}, onProgress = undefined) {
+        if (!this.socket) {
+            throw new Error("RPC service not connected");
+        }
+        const batchId = crypto.randomUUID();
+        const listener = (message) => {
+            if (message['batchId'] === batchId && onProgress) {
+                onProgress(message);
+            }
+        };
+        this.socket.on("batchProgress", listener);
+        try {
+            const response = await this.request(eventName, {...options, items, batchId},
+                this.timeout + items.length * this.batchItemTimeout);
+            return response['data'];
+        } finally {
+            this.socket.off("batchProgress", listener);
+        }
+    }
+
+    /**
+     * Retrieves the annotations of many PDF files via the PDF RPC service, see batch.
+     *
+     * @param {Array<Object>} items - The documents, each with file, fileRef or uploadId and an optional id.
+     * @param {function(Object): void} [onProgress] - Called with the annotations of every document as soon as they are extracted.
+     * @returns {Promise<Object>} - The summary of the batch.
+     */
+    async getAnnotationsBatch(items, onProgress = undefined) {
+        return this.batch("annotationsExtractBatch", items, {}, onProgress);
+    }
+
+    /**
+     * Embeds annotations into many PDF files via the PDF RPC service, see batch.
+     *
+     * @param {Array<Object>} items - The documents, each with file, fileRef or uploadId, its annotations and an optional id.
+     * @param {function(Object): void} [onProgress] - Called with every embedded file (or its fileRef/uploadId) as soon as it is done.
+     * @returns {Promise<Object>} - The summary of the batch.
+     */
+    async embeddAnnotationsBatch(items, onProgress = undefined) {
+        return this.batch("embedAnnotationsBatch", items, {outputMode: "full"}, onProgress);
+    }
+
      /**
      * Retrieves annotations from a PDF file via the PDF RPC service.
      *
@@ -74,13 +267,13 @@ module.exports = class PDFRPC extends RPC {
      */
     async embeddAnnotations(data) {
         try {
-            const response = await this.request("embedAnnotations", data);
+            const response = await this.request("embedAnnotations", {...data, outputMode: "incremental"});
             if (!response['success']) {
                 this.logger.error("Error in request " + eventName + ": " + response['message']);
                 throw new Error(response['message']);
             }
             this.logger.info("Response from RPC service: " + response['message']);
-            return response['data'];
+            return this.applyOutput(data.file, response['data'], response);
         } catch (err) {
             throw err;
         }
@@ -97,13 +290,13 @@ module.exports = class PDFRPC extends RPC {
      */
     async deleteAllAnnotations(data) {
         try {
-            const response = await this.request("deleteAllAnnotations", data);
+            const response = await this.request("deleteAllAnnotations", {...data, outputMode: "incremental"});
             if (!response['success']) {
                 this.logger.error("Error in request deleteAllAnnotations: " + response['message']);
                 throw new Error(response['message']);
             }
             this.logger.info("Response from RPC service: " + response['message']);
-            return response['data'];
+            return {...response['data'], file: this.applyOutput(data.file, response['data']['file'], response)};
         } catch (err) {
             throw err;
         }
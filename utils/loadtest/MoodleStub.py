@@ -0,0 +1,189 @@
+import argparse
+import json
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+ENDPOINT = "/webservice/rest/server.php"
+
+
+class MoodleStub:
+    """
+    Stand-in for the Moodle REST web service, so the moodleAPI service can be load tested offline.
+
+    Answers the wsfunctions used by Moodle.py with a synthetic course (users, assignments, submissions with files)
+    and serves the submission files under /pluginfile.php. Every request can be delayed to emulate a remote Moodle.
+    """
+
+    def __init__(self, users=30, assignments=3, files_per_submission=1, file_bytes=100 * 1024, latency=0.0,
+                 host="127.0.0.1", port=0):
+        """
+        Args:
+            users: Number of enrolled users, all of them with a submission.
+            assignments: Number of assignments of the course.
+            files_per_submission: Number of files of every submission.
+            file_bytes: Size of every submission file.
+            latency: Seconds every request is delayed.
+            host: Interface to listen on.
+            port: Port to listen on, 0 for a free port.
+        """
+        self.users = users
+        self.assignments = assignments
+        self.files_per_submission = files_per_submission
+        self.file_bytes = file_bytes
+        self.latency = latency
+        self.calls = Counter()
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self._handler_class())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        """
+        Serves in a background thread.
+        Returns:
+            The base URL of the stub, to be sent as apiUrl.
+        """
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self.url
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def get_stats(self):
+        with self.lock:
+            return dict(self.calls)
+
+    def _count(self, name):
+        with self.lock:
+            self.calls[name] += 1
+
+    def file_url(self, user_id, index=0):
+        return f"{self.url}/pluginfile.php/{user_id}/assignsubmission_file/submission_files/{index}/submission{index}.pdf"
+
+    def file_content(self, path):
+        # deterministic content of the requested size, different per file
+        seed = path.encode()
+        return (seed * (self.file_bytes // len(seed) + 1))[:self.file_bytes]
+
+    def _user(self, user_id):
+        return {
+            "id": user_id,
+            "firstname": f"First{user_id}",
+            "lastname": f"Last{user_id}",
+            "email": f"user{user_id}@example.org",
+            "roles": [{"name": "student" if user_id > 1 else "editingteacher"}],
+        }
+
+    def _submission(self, user_id):
+        files = [{
+            "filename": f"submission{i}.pdf",
+            "filepath": "/",
+            "filesize": self.file_bytes,
+            "fileurl": self.file_url(user_id, i),
+            "timemodified": 1700000000 + user_id,
+            "mimetype": "application/pdf",
+        } for i in range(self.files_per_submission)]
+        return {
+            "id": 1000 + user_id,
+            "userid": user_id,
+            "timemodified": 1700000000 + user_id,
+            "status": "submitted",
+            "plugins": [{"type": "file", "fileareas": [{"area": "submission_files", "files": files}]}],
+        }
+
+    def call(self, wsfunction, parameters):
+        """
+        Answers a wsfunction.
+        Args:
+            wsfunction: Name of the web service function.
+            parameters: Flattened request parameters (e.g. "courseids[0]").
+        Returns:
+            The JSON-serializable response, an exception dict for unknown functions.
+        """
+        user_ids = range(1, self.users + 1)
+        match wsfunction:
+            case "core_enrol_get_enrolled_users":
+                return [self._user(user_id) for user_id in user_ids]
+            case "mod_assign_get_assignments":
+                return {"courses": [{"id": int(parameters.get("courseids[0]", 1)), "assignments": [
+                    {"id": i, "cmid": 100 + i, "name": f"Assignment {i}"} for i in range(1, self.assignments + 1)
+                ]}]}
+            case "mod_assign_get_user_mappings":
+                return {"assignments": [{"assignmentid": int(parameters.get("assignmentids[0]", 1)), "mappings": [
+                    {"id": user_id, "userid": user_id} for user_id in user_ids
+                ]}]}
+            case "mod_assign_get_submissions":
+                return {"assignments": [{"assignmentid": int(parameters.get("assignmentids[0]", 1)), "submissions": [
+                    self._submission(user_id) for user_id in user_ids
+                ]}]}
+            case "mod_assign_save_grade" | "mod_assign_save_grades":
+                return None
+        return {"exception": "invalid_parameter_exception", "errorcode": "invalidparameter",
+                "message": f"Unknown function {wsfunction}"}
+
+    def _handler_class(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # headers and body are written separately, without this a kept-alive connection stalls on delayed ACKs
+            disable_nagle_algorithm = True
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, status, body, content_type):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                parameters = {key: values[-1] for key, values in parse_qs(self.rfile.read(length).decode()).items()}
+                if urlsplit(self.path).path != ENDPOINT:
+                    self._send(404, b"Not Found", "text/plain")
+                    return
+                wsfunction = parameters.get("wsfunction", "")
+                stub._count(wsfunction)
+                if stub.latency:
+                    time.sleep(stub.latency)
+                self._send(200, json.dumps(stub.call(wsfunction, parameters)).encode(), "application/json")
+
+            def do_GET(self):
+                path = urlsplit(self.path).path
+                if not path.startswith("/pluginfile.php/"):
+                    self._send(404, b"Not Found", "text/plain")
+                    return
+                stub._count("download")
+                if stub.latency:
+                    time.sleep(stub.latency)
+                self._send(200, stub.file_content(path), "application/pdf")
+
+        return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stand-in Moodle REST server for the moodleAPI RPC service.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--users", type=int, default=30)
+    parser.add_argument("--files", type=int, default=1, help="files per submission")
+    parser.add_argument("--file-bytes", type=int, default=100 * 1024)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    args = parser.parse_args()
+    stub = MoodleStub(args.users, files_per_submission=args.files, file_bytes=args.file_bytes,
+                      latency=args.latency_ms / 1000, host=args.host, port=args.port)
+    print(f"Moodle stub listening on {stub.url}")
+    stub.server.serve_forever()
@@ -0,0 +1,256 @@
+"""
+Load test of the RPC services: many concurrent Socket.IO clients send a weighted mix of events
+to the test, pdf and moodleAPI services and the throughput and latency percentiles are reported per event.
+
+The call event of the test service measures the Socket.IO transport overhead alone. The moodleAPI service
+is pointed at a local stand-in Moodle (see MoodleStub.py), so the whole run works offline.
+
+    python utils/loadtest/loadtest.py --mix test:call=1,pdf:annotationsExtract=2 --clients 20 --duration 30
+"""
+import argparse
+import json
+import math
+import os
+import random
+import sys
+import threading
+import time
+
+import socketio
+
+from MoodleStub import MoodleStub
+from payloads import EVENTS, Payloads
+
+# Defaults of the service URLs, as in the .env of the development setup
+DEFAULT_URLS = {
+    "test": "http://{}:{}".format(os.environ.get("RPC_TEST_HOST", "127.0.0.1"), os.environ.get("RPC_TEST_PORT", 3010)),
+    "moodle": "http://{}:{}".format(os.environ.get("RPC_MOODLE_HOST", "127.0.0.1"), os.environ.get("RPC_MOODLE_PORT", 3011)),
+    "pdf": "http://{}:{}".format(os.environ.get("RPC_PDF_HOST", "127.0.0.1"), os.environ.get("RPC_PDF_PORT", 3012)),
+}
+
+
+def parse_mix(text):
+    """
+    Parses an event mix like "test:call=1,pdf:annotationsExtract=3" into a list of (service, event, weight).
+    """
+    mix = []
+    for entry in text.split(","):
+        name, _, weight = entry.strip().partition("=")
+        service, _, event = name.partition(":")
+        if service not in EVENTS or event not in EVENTS[service]:
+            raise ValueError(f"Unknown event '{name}', known are: "
+                             + ", ".join(f"{s}:{e}" for s, events in EVENTS.items() for e in events))
+        mix.append((service, event, float(weight or 1)))
+    return mix
+
+
+def percentile(values, fraction):
+    """
+    Nearest-rank percentile of sorted values.
+    """
+    if not values:
+        return None
+    return values[max(1, math.ceil(fraction * len(values))) - 1]
+
+
+def outcome_of(response):
+    if isinstance(response, dict):
+        if response.get("overloaded"):
+            return "overloaded"
+        if response.get("success") is False:
+            return "error"
+    return "ok"
+
+
+class LoadTest:
+    """
+    Runs the clients of a load test and collects the latency of every request.
+    """
+
+    def __init__(self, mix, urls, payloads, clients=10, duration=30.0, warmup=5.0, think_time=0.0, timeout=120.0, transports=None):
+        """
+        Args:
+            mix: List of (service, event, weight), see parse_mix.
+            urls: Dict of service name to URL.
+            payloads: Payloads building the request data.
+            clients: Number of concurrent clients, each with its own connection to every service of the mix.
+            duration: Seconds of measured load.
+            warmup: Seconds of load before the measurement.
+            think_time: Seconds a client waits between its requests.
+            timeout: Seconds to wait for a response.
+            transports: Socket.IO transports, None to upgrade to websocket where possible.
+        """
+        self.mix = mix
+        self.urls = urls
+        self.payloads = payloads
+        self.clients = clients
+        self.duration = duration
+        self.warmup = warmup
+        self.think_time = think_time
+        self.timeout = timeout
+        self.transports = transports
+        self.records = []  # (service, event, start, seconds, outcome)
+        self.lock = threading.Lock()
+
+    def _connect(self):
+        connections = []
+        services = sorted({service for service, _, _ in self.mix})
+        for _ in range(self.clients):
+            connection = {}
+            for service in services:
+                client = socketio.Client()
+                client.connect(self.urls[service], transports=self.transports, wait_timeout=30)
+                connection[service] = client
+            connections.append(connection)
+        return connections
+
+    def _client(self, number, connection, start_at, stop_at):
+        rng = random.Random(number)
+        weights = [weight for _, _, weight in self.mix]
+        while time.monotonic() < start_at:
+            time.sleep(0.001)
+        while time.monotonic() < stop_at:
+            service, event, _ = rng.choices(self.mix, weights)[0]
+            data = self.payloads.build(service, event)
+            start = time.monotonic()
+            try:
+                outcome = outcome_of(connection[service].call(event, data, timeout=self.timeout))
+            except socketio.exceptions.TimeoutError:
+                outcome = "timeout"
+            except socketio.exceptions.SocketIOError:
+                outcome = "disconnected"
+            with self.lock:
+                self.records.append((service, event, start, time.monotonic() - start, outcome))
+            if outcome == "disconnected":
+                return
+            if self.think_time:
+                time.sleep(self.think_time)
+
+    def run(self):
+        """
+        Connects all clients, runs the load and disconnects.
+        Returns:
+            The report, see report.
+        """
+        for service, event, _ in self.mix:
+            # builds the documents once before the clients start
+            self.payloads.build(service, event)
+        connections = self._connect()
+        start_at = time.monotonic() + 0.5
+        stop_at = start_at + self.warmup + self.duration
+        threads = [threading.Thread(target=self._client, args=(i, connection, start_at, stop_at), daemon=True)
+                   for i, connection in enumerate(connections)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for connection in connections:
+            for client in connection.values():
+                client.disconnect()
+        return self.report(start_at + self.warmup)
+
+    def report(self, measure_from):
+        """
+        Summarizes the requests started after the warm-up.
+        Returns:
+            Dict with the statistics per "service:event" and in "total": requests, outcomes, throughput (requests per second)
+            and the p50/p95/p99/max latency of the successful requests in milliseconds.
+        """
+        groups = {}
+        for service, event, start, seconds, outcome in self.records:
+            if start >= measure_from:
+                groups.setdefault(f"{service}:{event}", []).append((seconds, outcome))
+                groups.setdefault("total", []).append((seconds, outcome))
+
+        report = {}
+        for name, records in groups.items():
+            latencies = sorted(seconds * 1000 for seconds, outcome in records if outcome == "ok")
+            outcomes = {}
+            for _, outcome in records:
+                outcomes[outcome] = outcomes.get(outcome, 0) + 1
+            report[name] = {
+                "requests": len(records),
+                "outcomes": outcomes,
+                "throughput": round(outcomes.get("ok", 0) / self.duration, 2),
+                "p50": _round(percentile(latencies, 0.50)),
+                "p95": _round(percentile(latencies, 0.95)),
+                "p99": _round(percentile(latencies, 0.99)),
+                "max": _round(latencies[-1] if latencies else None),
+            }
+        return report
+
+
+def _round(value):
+    return None if value is None else round(value, 2)
+
+
+def format_report(report):
+    lines = [f"{'event':<45} {'requests':>9} {'failed':>7} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}"]
+    for name in sorted(report, key=lambda name: (name == "total", name)):
+        stats = report[name]
+        failed = stats["requests"] - stats["outcomes"].get("ok", 0)
+        values = [stats[key] for key in ("throughput", "p50", "p95", "p99", "max")]
+        lines.append(f"{name:<45} {stats['requests']:>9} {failed:>7} "
+                     + " ".join(f"{'-' if value is None else value:>9}" for value in values))
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test of the RPC services with concurrent Socket.IO clients.")
+    parser.add_argument("--mix", default="test:call=1",
+                        help="weighted events, e.g. test:call=1,pdf:annotationsExtract=2,moodle:getUsersFromCourse=1")
+    parser.add_argument("--clients", type=int, default=10, help="concurrent clients")
+    parser.add_argument("--duration", type=float, default=30, help="seconds of measured load")
+    parser.add_argument("--warmup", type=float, default=5, help="seconds of load before the measurement")
+    parser.add_argument("--think-ms", type=float, default=0, help="pause of a client between its requests")
+    parser.add_argument("--timeout", type=float, default=120, help="seconds to wait for a response")
+    parser.add_argument("--polling", action="store_true", help="stay on HTTP long-polling instead of upgrading to websocket")
+    for service, url in DEFAULT_URLS.items():
+        parser.add_argument(f"--{service}-url", default=url, help=f"URL of the {service} service (default: {url})")
+    parser.add_argument("--call-bytes", type=int, default=16, help="size of the call payload")
+    parser.add_argument("--pdf-pages", type=int, default=5, help="pages of the PDF payloads")
+    parser.add_argument("--pdf-words", type=int, default=300, help="words per page of the PDF payloads")
+    parser.add_argument("--pdf-density", type=float, default=0.05, help="fraction of highlighted words of the PDF payloads")
+    parser.add_argument("--allow-cache", action="store_true", help="send identical PDFs, so the result cache of the service answers")
+    parser.add_argument("--moodle-api-url", help="Moodle the moodleAPI service calls, a local stub is started otherwise")
+    parser.add_argument("--stub-host", default="127.0.0.1", help="interface of the Moodle stub")
+    parser.add_argument("--stub-port", type=int, default=0, help="port of the Moodle stub (default: free port)")
+    parser.add_argument("--stub-advertise", help="URL of the stub as seen by the moodleAPI service (e.g. from a container)")
+    parser.add_argument("--stub-latency-ms", type=float, default=0, help="delay of every stub response")
+    parser.add_argument("--moodle-users", type=int, default=30, help="users (and submissions) of the stub course")
+    parser.add_argument("--moodle-files", type=int, default=5, help="file URLs per download request")
+    parser.add_argument("--moodle-file-bytes", type=int, default=100 * 1024, help="size of the stub submission files")
+    parser.add_argument("--feedback-entries", type=int, default=10, help="students per feedback request")
+    parser.add_argument("--output", help="file for the JSON report")
+    args = parser.parse_args()
+
+    mix = parse_mix(args.mix)
+    stub = None
+    moodle_url = args.moodle_api_url
+    if moodle_url is None and any(service == "moodle" for service, _, _ in mix):
+        stub = MoodleStub(args.moodle_users, files_per_submission=1, file_bytes=args.moodle_file_bytes,
+                          latency=args.stub_latency_ms / 1000, host=args.stub_host, port=args.stub_port)
+        stub.start()
+        moodle_url = args.stub_advertise or stub.url
+        print(f"Moodle stub at {stub.url}, advertised as {moodle_url}", file=sys.stderr)
+
+    payloads = Payloads(args.call_bytes, args.pdf_pages, args.pdf_words, args.pdf_density, not args.allow_cache,
+                        moodle_url, moodle_files=min(args.moodle_files, args.moodle_users), feedback_entries=args.feedback_entries)
+    urls = {service: getattr(args, f"{service}_url") for service in DEFAULT_URLS}
+    load_test = LoadTest(mix, urls, payloads, args.clients, args.duration, args.warmup, args.think_ms / 1000,
+                         args.timeout, ["polling"] if args.polling else None)
+    try:
+        report = load_test.run()
+    finally:
+        if stub:
+            stub.stop()
+
+    print(format_report(report))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"config": vars(args), "report": report, "moodleStubCalls": stub.get_stats() if stub else None}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
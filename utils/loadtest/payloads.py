@@ -0,0 +1,92 @@
+import os
+import sys
+import uuid
+
+# the PDF corpus generator of the pdf benchmarks
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "rpcs", "pdf"))
+
+# Events the payload builders know, per service
+EVENTS = {
+    "test": ["call"],
+    "pdf": ["call", "annotationsExtract", "embedAnnotations", "deleteAllAnnotations"],
+    "moodle": ["call", "getUsersFromCourse", "getUsersFromAssignment", "getAssignmentInfoFromCourse",
+               "getSubmissionInfosFromAssignment", "downloadSubmissionsFromUrl", "publishAssignmentTextFeedback"],
+}
+
+
+class Payloads:
+    """
+    Builds the request data of the load test events, sized by the options of the run.
+    """
+
+    def __init__(self, call_bytes=16, pdf_pages=5, pdf_words=300, pdf_density=0.05, unique_files=True,
+                 moodle_url=None, moodle_key="loadtest", moodle_files=5, feedback_entries=10, course_id=1, assignment_cmid=101):
+        """
+        Args:
+            call_bytes: Size of the string sent to the call events.
+            pdf_pages: Pages of the PDF sent to the pdf events.
+            pdf_words: Words per page of the PDF.
+            pdf_density: Fraction of highlighted words in the PDF.
+            unique_files: Whether every PDF request gets distinct bytes, so the result cache of the service never answers.
+            moodle_url: Base URL of the Moodle (stub) the moodleAPI service calls.
+            moodle_key: API key sent to the moodleAPI service.
+            moodle_files: Number of file URLs per downloadSubmissionsFromUrl request.
+            feedback_entries: Number of students per publishAssignmentTextFeedback request.
+            course_id: Course of the Moodle requests.
+            assignment_cmid: Course module ID of the assignment of the Moodle requests.
+        """
+        self.call_data = "x" * call_bytes
+        self.unique_files = unique_files
+        self.moodle_url = moodle_url
+        self.moodle_key = moodle_key
+        self.moodle_files = moodle_files
+        self.feedback_entries = feedback_entries
+        self.course_id = course_id
+        self.assignment_cmid = assignment_cmid
+        self.documents = None
+        self.pdf_case = {"pages": pdf_pages, "words": pdf_words, "density": pdf_density,
+                         "multiline": False, "grouping": "care", "seed": 0}
+
+    def _pdf(self, kind):
+        if self.documents is None:
+            from benchmarks.corpus import generate
+            self.documents = generate(self.pdf_case)
+        pdf = self.documents[kind]
+        if self.unique_files:
+            # a comment after the end of the file changes its hash (the cache key) but not its content
+            pdf += b"\n%" + uuid.uuid4().hex.encode() + b"\n"
+        return pdf
+
+    def _moodle_options(self):
+        return {"apiKey": self.moodle_key, "apiUrl": self.moodle_url, "url": self.moodle_url,
+                "courseID": self.course_id, "assignmentID": self.assignment_cmid}
+
+    def build(self, service, event):
+        """
+        Returns the request data of an event.
+        Raises:
+            ValueError if the event is unknown.
+        """
+        if event == "call":
+            return self.call_data
+        if service == "pdf":
+            match event:
+                case "annotationsExtract" | "deleteAllAnnotations":
+                    return {"file": self._pdf("annotated")}
+                case "embedAnnotations":
+                    return {"file": self._pdf("plain"), "annotations": self.documents["annotations"]}
+        if service == "moodle":
+            options = self._moodle_options()
+            match event:
+                case "getUsersFromCourse" | "getAssignmentInfoFromCourse" | "getSubmissionInfosFromAssignment":
+                    return {"options": options}
+                case "getUsersFromAssignment":
+                    return {"options": options, "courseID": self.course_id, "assignmentID": self.assignment_cmid}
+                case "downloadSubmissionsFromUrl":
+                    return {"options": options, "fileUrls": [
+                        f"{self.moodle_url}/pluginfile.php/{i + 1}/assignsubmission_file/submission_files/0/submission0.pdf?token={self.moodle_key}"
+                        for i in range(self.moodle_files)]}
+                case "publishAssignmentTextFeedback":
+                    return {"options": options, "feedback": [
+                        {"extId": i + 1, "text": f"Feedback for user {i + 1}"} for i in range(self.feedback_entries)]}
+        raise ValueError(f"Unknown event '{service}:{event}'")
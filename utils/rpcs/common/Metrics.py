@@ -0,0 +1,240 @@
+import asyncio
+import functools
+import threading
+import time
+from contextlib import contextmanager
+
+# Latency buckets in seconds, up to the timeouts of long exports
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _format_labels(label_names, label_values, extra=None):
+    pairs = list(zip(label_names, label_values)) + (extra or [])
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, help, label_names=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self.lock = threading.Lock()
+        self.samples = {}  # label values -> value
+
+    def _key(self, labels):
+        return tuple(labels.get(name, "") for name in self.label_names)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        with self.lock:
+            for label_values, value in sorted(self.samples.items()):
+                lines.append(f"{self.name}{_format_labels(self.label_names, label_values)} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.samples[key] = self.samples.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.samples[key] = self.samples.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name, help, label_names=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, label_names)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            sample = self.samples.get(key)
+            if sample is None:
+                sample = self.samples[key] = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    sample["buckets"][i] += 1
+            sample["sum"] += value
+            sample["count"] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        with self.lock:
+            for label_values, sample in sorted(self.samples.items()):
+                for bound, count in zip(self.buckets, sample["buckets"]):
+                    lines.append(f"{self.name}_bucket{_format_labels(self.label_names, label_values, [('le', _format_value(float(bound)))])} {count}")
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, label_values, [('le', '+Inf')])} {sample['count']}")
+                lines.append(f"{self.name}_sum{_format_labels(self.label_names, label_values)} {_format_value(sample['sum'])}")
+                lines.append(f"{self.name}_count{_format_labels(self.label_names, label_values)} {sample['count']}")
+        return lines
+
+
+def payload_size(value):
+    """
+    Approximate size of a Socket.IO payload in bytes: binary attachments and strings by their length,
+    other scalars by the length of their text form.
+    """
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return len(value)
+    if isinstance(value, str):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(len(str(key)) + payload_size(item) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return sum(payload_size(item) for item in value)
+    if value is None:
+        return 0
+    return len(str(value))
+
+
+class Metrics:
+    """
+    Metrics of an RPC service in the Prometheus text format, served at /metrics next to the Socket.IO app.
+
+    All Socket.IO event handlers are instrumented with instrument: request and error counts, latency histograms,
+    in-flight gauges and payload bytes per event. Services add their own measurements (e.g. pages processed)
+    and time calls to upstream services with upstream.
+    """
+
+    def __init__(self):
+        self.requests = Counter("rpc_requests_total", "Socket.IO events handled.", ["event"])
+        self.errors = Counter("rpc_errors_total", "Socket.IO events that raised or answered with success false.", ["event"])
+        self.latency = Histogram("rpc_request_duration_seconds", "Time to answer a Socket.IO event.", ["event"])
+        self.in_flight = Gauge("rpc_requests_in_flight", "Socket.IO events being handled.", ["event"])
+        self.bytes_in = Counter("rpc_received_bytes_total", "Approximate size of the received event payloads.", ["event"])
+        self.bytes_out = Counter("rpc_sent_bytes_total", "Approximate size of the sent responses.", ["event"])
+        self.pages = Counter("rpc_pages_processed_total", "PDF pages processed.", ["event"])
+        self.upstream_latency = Histogram("rpc_upstream_duration_seconds", "Time of calls to upstream services.", ["function"])
+        self.upstream_errors = Counter("rpc_upstream_errors_total", "Failed calls to upstream services.", ["function"])
+        self.metrics = [self.requests, self.errors, self.latency, self.in_flight, self.bytes_in, self.bytes_out,
+                        self.pages, self.upstream_latency, self.upstream_errors]
+
+    def render(self):
+        """
+        Returns all metrics in the Prometheus text exposition format.
+        """
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def _begin(self, event, args):
+        self.in_flight.inc(event=event)
+        self.bytes_in.inc(payload_size(args), event=event)
+        return time.perf_counter()
+
+    def _end(self, event, start, response, failed):
+        self.latency.observe(time.perf_counter() - start, event=event)
+        self.in_flight.dec(event=event)
+        self.requests.inc(event=event)
+        if failed or (isinstance(response, dict) and response.get("success") is False):
+            self.errors.inc(event=event)
+        self.bytes_out.inc(payload_size(response), event=event)
+
+    def wrap(self, event, handler):
+        """
+        Returns the handler of an event instrumented with the request metrics, for plain and coroutine handlers.
+        """
+        if asyncio.iscoroutinefunction(handler):
+            @functools.wraps(handler)
+            async def async_wrapper(sid, *args):
+                start = self._begin(event, args)
+                response, failed = None, True
+                try:
+                    response = await handler(sid, *args)
+                    failed = False
+                    return response
+                finally:
+                    self._end(event, start, response, failed)
+            return async_wrapper
+
+        @functools.wraps(handler)
+        def wrapper(sid, *args):
+            start = self._begin(event, args)
+            response, failed = None, True
+            try:
+                response = handler(sid, *args)
+                failed = False
+                return response
+            finally:
+                self._end(event, start, response, failed)
+        return wrapper
+
+    def instrument(self, sio):
+        """
+        Instruments all event handlers registered on the Socket.IO server so far (except connect and disconnect).
+        """
+        for namespace, handlers in sio.handlers.items():
+            for event, handler in list(handlers.items()):
+                if event not in ("connect", "disconnect"):
+                    handlers[event] = self.wrap(event, handler)
+
+    @contextmanager
+    def upstream(self, function):
+        """
+        Times the enclosed call to an upstream service (e.g. a Moodle wsfunction).
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.upstream_errors.inc(function=function)
+            raise
+        finally:
+            self.upstream_latency.observe(time.perf_counter() - start, function=function)
+
+    def wsgi_app(self, environ, start_response):
+        """
+        WSGI app serving the metrics at /metrics, mounted beside the Socket.IO app.
+        """
+        if environ.get("PATH_INFO") != "/metrics":
+            start_response("404 Not Found", [("Content-Type", "text/plain")])
+            return [b"Not Found"]
+        body = self.render().encode()
+        start_response("200 OK", [("Content-Type", CONTENT_TYPE), ("Content-Length", str(len(body)))])
+        return [body]
+
+    async def asgi_app(self, scope, receive, send):
+        """
+        ASGI app serving the metrics at /metrics, mounted beside the Socket.IO app.
+        """
+        if scope["type"] != "http":
+            return
+        if scope["path"] != "/metrics":
+            await send({"type": "http.response.start", "status": 404, "headers": [(b"content-type", b"text/plain")]})
+            await send({"type": "http.response.body", "body": b"Not Found"})
+            return
+        body = self.render().encode()
+        await send({"type": "http.response.start", "status": 200,
+                    "headers": [(b"content-type", CONTENT_TYPE.encode()), (b"content-length", str(len(body)).encode())]})
+        await send({"type": "http.response.body", "body": body})
+
+
+# Metrics of this service process
+metrics = Metrics()
@@ -0,0 +1,261 @@
+import asyncio
+import bisect
+import functools
+import itertools
+import os
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+
+class Overloaded(Exception):
+    """
+    Raised when a request cannot start before its deadline or the wait queue is full.
+    """
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+    def response(self):
+        """
+        The response returned for a rejected request, marked so the backend can retry it later.
+        """
+        return {"success": False, "overloaded": True, "retryAfter": self.retry_after, "message": "overloaded: " + str(self)}
+
+
+class _Waiter:
+    def __init__(self, event, priority, seq, wake):
+        self.event = event
+        self.priority = priority
+        self.seq = seq
+        self.wake = wake
+        self.granted = False
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class Scheduler:
+    """
+    Admission control for the Socket.IO handlers.
+
+    Every scheduled request takes a slot of its event (limited per event) and of the service (limited in total).
+    Requests that cannot start right away wait in a bounded queue ordered by priority (lower first, then arrival),
+    so interactive requests overtake bulk ones whenever a slot frees up.
+    A request that cannot start before its deadline, or finds the queue full, is rejected with Overloaded.
+    """
+
+    def __init__(self, limits=None, priorities=None, max_active=None, max_queue=32, max_wait=20.0, retry_after=1.0):
+        """
+        Args:
+            limits: Dict of event name to the number of requests of that event running at once (missing: no event limit).
+            priorities: Dict of event name to its default priority, lower runs first (missing: 0).
+            max_active: Number of scheduled requests running at once over all events (None: no limit).
+            max_queue: Number of requests waiting at once over all events.
+            max_wait: Longest time in seconds a request waits for its slot, also if its own deadline is later.
+            retry_after: Seconds the backend is asked to wait before retrying a rejected request.
+        """
+        self.limits = limits or {}
+        self.priorities = priorities or {}
+        self.max_active = max_active
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.retry_after = retry_after
+
+        self.lock = threading.Lock()
+        self.active = {}  # event -> number of running requests
+        self.total_active = 0
+        self.waiters = []  # sorted by priority, then arrival
+        self.seq = itertools.count()
+        self.stats = {}  # event -> {"started": ..., "queued": ..., "rejected": ...}
+
+    @classmethod
+    def from_env(cls, prefix, limits=None, priorities=None, max_active=None):
+        """
+        Creates the scheduler from environment variables, falling back to the given defaults:
+        <prefix>_SCHED_LIMITS and <prefix>_SCHED_PRIORITIES as "event=value,event=value",
+        <prefix>_SCHED_MAX_ACTIVE, <prefix>_SCHED_MAX_QUEUE, <prefix>_SCHED_MAX_WAIT (seconds).
+        Args:
+            prefix: Prefix of the environment variables, e.g. "PDF".
+            limits: Default event limits.
+            priorities: Default event priorities.
+            max_active: Default limit over all events.
+        """
+        def parse(name, default):
+            value = os.environ.get(f"{prefix}_SCHED_{name}")
+            if not value:
+                return dict(default or {})
+            return {event.strip(): int(n) for event, n in (item.split("=") for item in value.split(",") if item.strip())}
+
+        return cls(
+            limits=parse("LIMITS", limits),
+            priorities=parse("PRIORITIES", priorities),
+            max_active=int(os.environ.get(f"{prefix}_SCHED_MAX_ACTIVE", max_active or 0)) or None,
+            max_queue=int(os.environ.get(f"{prefix}_SCHED_MAX_QUEUE", 32)),
+            max_wait=float(os.environ.get(f"{prefix}_SCHED_MAX_WAIT", 20.0)),
+        )
+
+    def _count(self, event, outcome):
+        counters = self.stats.setdefault(event, {"started": 0, "queued": 0, "rejected": 0})
+        counters[outcome] += 1
+
+    def _can_start(self, event):
+        limit = self.limits.get(event)
+        return (limit is None or self.active.get(event, 0) < limit) and \
+            (self.max_active is None or self.total_active < self.max_active)
+
+    def _start(self, event):
+        self.active[event] = self.active.get(event, 0) + 1
+        self.total_active += 1
+        self._count(event, "started")
+
+    def _wait_time(self, data):
+        """
+        Seconds a request may wait: the scheduler's max_wait, shortened by an optional
+        "deadline" in the request data (milliseconds since the epoch, as Date.now() in the backend).
+        """
+        wait = self.max_wait
+        deadline = data.get("deadline") if isinstance(data, dict) else None
+        if isinstance(deadline, (int, float)):
+            wait = min(wait, deadline / 1000.0 - time.time())
+        return wait
+
+    def _priority(self, event, data):
+        priority = data.get("priority") if isinstance(data, dict) else None
+        return priority if isinstance(priority, int) else self.priorities.get(event, 0)
+
+    def _enqueue(self, event, data, wake):
+        """
+        Starts the request or queues it (lock held).
+        Returns:
+            None if the request started, otherwise its waiter.
+        Raises:
+            Overloaded if the request can neither start nor wait.
+        """
+        if self._can_start(event):
+            self._start(event)
+            return None
+        if len(self.waiters) >= self.max_queue:
+            self._count(event, "rejected")
+            raise Overloaded(f"too many requests waiting ({len(self.waiters)})", self.retry_after)
+        if self._wait_time(data) <= 0:
+            self._count(event, "rejected")
+            raise Overloaded(f"{event} cannot start before its deadline", self.retry_after)
+        waiter = _Waiter(event, self._priority(event, data), next(self.seq), wake)
+        bisect.insort(self.waiters, waiter)
+        self._count(event, "queued")
+        return waiter
+
+    def _give_up(self, waiter):
+        """
+        Removes a waiter whose time ran out (lock held).
+        Returns:
+            True if it was granted a slot in the meantime and may run after all.
+        """
+        if waiter.granted:
+            return True
+        self.waiters.remove(waiter)
+        self._count(waiter.event, "rejected")
+        return False
+
+    def _release(self, event):
+        with self.lock:
+            self.active[event] -= 1
+            self.total_active -= 1
+            # grant every waiter that fits now, in priority order
+            remaining = []
+            for waiter in self.waiters:
+                if self._can_start(waiter.event):
+                    self._start(waiter.event)
+                    waiter.granted = True
+                    waiter.wake()
+                else:
+                    remaining.append(waiter)
+            self.waiters = remaining
+
+    @contextmanager
+    def slot(self, event, data=None):
+        """
+        Runs the enclosed block in a slot of the event, blocking the current thread until one is free.
+        Args:
+            event: Name of the Socket.IO event.
+            data: Request data with an optional "priority" and "deadline".
+        Raises:
+            Overloaded if the request cannot start in time.
+        """
+        signal = threading.Event()
+        with self.lock:
+            waiter = self._enqueue(event, data, signal.set)
+        if waiter is not None:
+            signal.wait(max(0.0, self._wait_time(data)))
+            with self.lock:
+                if not self._give_up(waiter):
+                    raise Overloaded(f"{event} waited too long for a free slot", self.retry_after)
+        try:
+            yield
+        finally:
+            self._release(event)
+
+    @asynccontextmanager
+    async def async_slot(self, event, data=None):
+        """
+        Like slot, but waits without blocking the event loop.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def wake():
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+
+        with self.lock:
+            waiter = self._enqueue(event, data, wake)
+        if waiter is not None:
+            try:
+                await asyncio.wait_for(asyncio.shield(future), max(0.0, self._wait_time(data)))
+            except asyncio.TimeoutError:
+                pass
+            except asyncio.CancelledError:
+                with self.lock:
+                    granted = self._give_up(waiter)
+                if granted:
+                    self._release(event)
+                raise
+            with self.lock:
+                if not self._give_up(waiter):
+                    raise Overloaded(f"{event} waited too long for a free slot", self.retry_after)
+        try:
+            yield
+        finally:
+            self._release(event)
+
+    def scheduled(self, event):
+        """
+        Decorator for a Socket.IO handler (sid, data) that runs it in a slot of the event
+        and returns the overloaded response if it cannot start in time.
+        """
+        def decorator(handler):
+            @functools.wraps(handler)
+            def wrapper(sid, data=None):
+                try:
+                    with self.slot(event, data):
+                        return handler(sid, data)
+                except Overloaded as e:
+                    return e.response()
+            return wrapper
+        return decorator
+
+    def get_stats(self):
+        """
+        Returns the running and waiting requests and the started/queued/rejected counters per event.
+        """
+        with self.lock:
+            return {
+                "active": dict(self.active),
+                "totalActive": self.total_active,
+                "waiting": len(self.waiters),
+                "limits": dict(self.limits),
+                "maxActive": self.max_active,
+                "maxQueue": self.max_queue,
+                "events": {event: dict(counters) for event, counters in self.stats.items()},
+            }
@@ -0,0 +1,170 @@
+import asyncio
+import itertools
+
+import pytest
+import socketio
+
+import Metrics
+from Metrics import CONTENT_TYPE, Counter, Histogram, payload_size
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """
+    Makes every handled event take 30 ms: perf_counter returns 0.0, 0.03, 1.0, 1.03, ...
+    """
+    times = iter(start + offset for start in itertools.count() for offset in (0.0, 0.03))
+    monkeypatch.setattr(Metrics.time, "perf_counter", lambda: next(times))
+
+
+def scrape_wsgi(metrics, path="/metrics"):
+    """
+    Calls the WSGI app of the metrics.
+    Returns:
+        Tuple (status, headers, body).
+    """
+    response = {}
+
+    def start_response(status, headers):
+        response.update(status=status, headers=dict(headers))
+
+    body = b"".join(metrics.wsgi_app({"PATH_INFO": path, "REQUEST_METHOD": "GET"}, start_response))
+    return response["status"], response["headers"], body.decode()
+
+
+def scrape_asgi(metrics, path="/metrics"):
+    """
+    Calls the ASGI app of the metrics.
+    Returns:
+        Tuple (status, headers, body).
+    """
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    asyncio.run(metrics.asgi_app({"type": "http", "method": "GET", "path": path}, receive, send))
+    start, body = messages
+    return start["status"], dict(start["headers"]), body["body"].decode()
+
+
+def samples(text):
+    """
+    Parses the samples of the Prometheus text format into a dict of "name{labels}" to value.
+    """
+    return {line.rsplit(" ", 1)[0]: float(line.rsplit(" ", 1)[1])
+            for line in text.splitlines() if line and not line.startswith("#")}
+
+
+def instrumented_server():
+    sio = socketio.Server(async_mode="threading")
+    sio.on("extract", handler=lambda sid, data: {"success": True, "data": "x" * 10})
+    sio.on("refuse", handler=lambda sid, data: {"success": False, "message": "no"})
+
+    def fail(sid, data):
+        raise ValueError("broken")
+
+    sio.on("fail", handler=fail)
+    sio.on("connect", handler=lambda sid, environ: None)
+    return sio
+
+
+def test_instrumented_calls_are_counted_and_timed(clock):
+    metrics = Metrics.Metrics()
+    sio = instrumented_server()
+    connect = sio.handlers["/"]["connect"]
+    metrics.instrument(sio)
+    handlers = sio.handlers["/"]
+    assert handlers["connect"] is connect
+
+    handlers["extract"]("sid", {"file": b"12345"})
+    handlers["extract"]("sid", {"file": b"12345"})
+    handlers["refuse"]("sid", {})
+    with pytest.raises(ValueError):
+        handlers["fail"]("sid", {})
+
+    status, headers, body = scrape_wsgi(metrics)
+    assert status == "200 OK"
+    assert headers["Content-Type"] == CONTENT_TYPE and int(headers["Content-Length"]) == len(body.encode())
+    assert "# TYPE rpc_requests_total counter" in body and "# TYPE rpc_request_duration_seconds histogram" in body
+    values = samples(body)
+    assert values['rpc_requests_total{event="extract"}'] == 2
+    assert values['rpc_requests_total{event="fail"}'] == 1
+    assert 'rpc_errors_total{event="extract"}' not in values
+    assert values['rpc_errors_total{event="refuse"}'] == 1 and values['rpc_errors_total{event="fail"}'] == 1
+    assert values['rpc_requests_in_flight{event="extract"}'] == 0
+    assert values['rpc_received_bytes_total{event="extract"}'] == 2 * (len("file") + 5)
+    assert values['rpc_sent_bytes_total{event="extract"}'] == 2 * (len("success") + len("True") + len("data") + 10)
+
+    # 30 ms per call: above the 25 ms bucket, within the 50 ms one
+    assert values['rpc_request_duration_seconds_bucket{event="extract",le="0.025"}'] == 0
+    assert values['rpc_request_duration_seconds_bucket{event="extract",le="0.05"}'] == 2
+    assert values['rpc_request_duration_seconds_bucket{event="extract",le="+Inf"}'] == 2
+    assert values['rpc_request_duration_seconds_sum{event="extract"}'] == pytest.approx(0.06)
+    assert values['rpc_request_duration_seconds_count{event="extract"}'] == 2
+
+
+def test_async_handlers_are_instrumented(clock):
+    metrics = Metrics.Metrics()
+    sio = socketio.AsyncServer(async_mode="asgi")
+
+    async def extract(sid, data):
+        return {"success": True}
+
+    sio.on("extract", handler=extract)
+    metrics.instrument(sio)
+    assert asyncio.run(sio.handlers["/"]["extract"]("sid", {})) == {"success": True}
+
+    status, headers, body = scrape_asgi(metrics)
+    assert status == 200 and headers[b"content-type"] == CONTENT_TYPE.encode()
+    values = samples(body)
+    assert values['rpc_requests_total{event="extract"}'] == 1
+    assert values['rpc_request_duration_seconds_count{event="extract"}'] == 1
+
+
+def test_only_the_metrics_path_is_served():
+    metrics = Metrics.Metrics()
+    assert scrape_wsgi(metrics, "/socket.io/")[0] == "404 Not Found"
+    assert scrape_asgi(metrics, "/other")[0] == 404
+
+
+def test_upstream_calls_are_timed_and_failures_counted(clock):
+    metrics = Metrics.Metrics()
+    with metrics.upstream("core_course_get_courses"):
+        pass
+    with pytest.raises(ConnectionError), metrics.upstream("core_course_get_courses"):
+        raise ConnectionError()
+    values = samples(metrics.render())
+    assert values['rpc_upstream_duration_seconds_count{function="core_course_get_courses"}'] == 2
+    assert values['rpc_upstream_errors_total{function="core_course_get_courses"}'] == 1
+
+
+def test_text_format():
+    counter = Counter("jobs_total", "Jobs.", ["queue"])
+    counter.inc(queue='a "b"\nc')
+    counter.inc(2, queue="plain")
+    assert counter.render() == [
+        "# HELP jobs_total Jobs.",
+        "# TYPE jobs_total counter",
+        'jobs_total{queue="a \\"b\\"\\nc"} 1',
+        'jobs_total{queue="plain"} 2',
+    ]
+
+    histogram = Histogram("size", "Sizes.", buckets=(1, 10))
+    histogram.observe(0.5)
+    histogram.observe(5)
+    histogram.observe(50)
+    assert histogram.render()[2:] == [
+        'size_bucket{le="1.0"} 1',
+        'size_bucket{le="10.0"} 2',
+        'size_bucket{le="+Inf"} 3',
+        "size_sum 55.5",
+        "size_count 3",
+    ]
+
+
+def test_payload_size():
+    assert payload_size({"file": b"1234", "pages": [1, 22], "name": "ab", "none": None}) == 4 + 4 + 5 + 3 + 4 + 2 + 4
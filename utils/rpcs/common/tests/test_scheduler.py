@@ -0,0 +1,106 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from Scheduler import Overloaded, Scheduler
+
+
+def hold(scheduler, event, data=None):
+    """
+    Takes a slot of the event in a thread until the returned event is set.
+    """
+    started, release = threading.Event(), threading.Event()
+
+    def run():
+        with scheduler.slot(event, data):
+            started.set()
+            release.wait(5)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return started, release, thread
+
+
+def wait_for(condition):
+    deadline = time.monotonic() + 5
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_full_queue_rejects_the_request():
+    scheduler = Scheduler(limits={"embed": 1}, max_queue=1, max_wait=5)
+    started, release, running = hold(scheduler, "embed")
+    started.wait(5)
+    _, release_waiting, waiting = hold(scheduler, "embed")
+    wait_for(lambda: scheduler.get_stats()["waiting"] == 1)
+
+    with pytest.raises(Overloaded, match="too many requests waiting") as error:
+        with scheduler.slot("embed"):
+            pass
+    assert error.value.response()["overloaded"] and error.value.response()["retryAfter"] == scheduler.retry_after
+    release.set()
+    release_waiting.set()
+    running.join(5)
+    waiting.join(5)
+    assert scheduler.get_stats()["events"]["embed"] == {"started": 2, "queued": 1, "rejected": 1}
+    assert scheduler.get_stats()["totalActive"] == 0
+
+
+def test_scheduled_handler_returns_the_overloaded_response():
+    scheduler = Scheduler(limits={"embed": 1}, max_queue=0)
+    started, release, thread = hold(scheduler, "embed")
+    started.wait(5)
+    response = scheduler.scheduled("embed")(lambda sid, data: {"success": True})("sid", {})
+    release.set()
+    thread.join(5)
+    assert response["success"] is False and response["overloaded"] is True
+
+
+def test_request_past_its_deadline_is_rejected():
+    scheduler = Scheduler(limits={"embed": 1})
+    started, release, thread = hold(scheduler, "embed")
+    started.wait(5)
+    with pytest.raises(Overloaded, match="deadline"):
+        with scheduler.slot("embed", {"deadline": time.time() * 1000 - 1}):
+            pass
+    with pytest.raises(Overloaded, match="waited too long"):
+        with scheduler.slot("embed", {"deadline": time.time() * 1000 + 50}):
+            pass
+    release.set()
+    thread.join(5)
+
+
+def test_waiting_requests_start_by_priority():
+    scheduler = Scheduler(max_active=1)
+    started, release, thread = hold(scheduler, "first")
+    started.wait(5)
+    order = []
+
+    def run(event, priority):
+        with scheduler.slot(event, {"priority": priority}):
+            order.append(event)
+
+    waiters = [threading.Thread(target=run, args=("bulk", 10)), threading.Thread(target=run, args=("interactive", 0))]
+    for index, waiter in enumerate(waiters):
+        waiter.start()
+        wait_for(lambda: scheduler.get_stats()["waiting"] == index + 1)
+    release.set()
+    for waiter in [thread, *waiters]:
+        waiter.join(5)
+    assert order == ["interactive", "bulk"]
+
+
+def test_async_slot_rejects_when_the_queue_is_full():
+    scheduler = Scheduler(limits={"extract": 1}, max_queue=0)
+
+    async def main():
+        async with scheduler.async_slot("extract"):
+            with pytest.raises(Overloaded):
+                async with scheduler.async_slot("extract"):
+                    pass
+
+    asyncio.run(main())
+    assert scheduler.get_stats()["active"] == {"extract": 0}
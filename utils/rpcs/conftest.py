@@ -0,0 +1,23 @@
+import os
+import sys
+
+RPCS_DIR = os.path.dirname(os.path.abspath(__file__))
+COMMON_DIR = os.path.join(RPCS_DIR, "common")
+
+# the modules of a service are imported as in its Docker image, where they lie next to the shared modules
+sys.path.append(COMMON_DIR)
+
+
+def pytest_pycollect_makemodule(module_path, parent):
+    """
+    Puts the folder of the service a test module belongs to (utils/rpcs/<service>/tests) first on the import path.
+    Modules of the other services are dropped from the import cache, as services have modules of the same name (main).
+    """
+    service_dir = os.path.dirname(os.path.dirname(os.path.abspath(module_path)))
+    if service_dir in sys.path:
+        sys.path.remove(service_dir)
+    sys.path.insert(0, service_dir)
+    for name, module in list(sys.modules.items()):
+        module_dir = os.path.dirname(os.path.abspath(getattr(module, "__file__", None) or os.sep))
+        if os.path.dirname(module_dir) == RPCS_DIR and module_dir not in (service_dir, COMMON_DIR):
+            del sys.modules[name]
@@ -0,0 +1,169 @@
+import hashlib
+import json
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+# Seconds the responses of the read functions are reused, functions not listed here are never cached
+DEFAULT_TTLS = {
+    "core_enrol_get_enrolled_users": 60,
+    "mod_assign_get_assignments": 300,
+    "mod_assign_get_user_mappings": 60,
+}
+# Functions that only read, so they do not invalidate the cached responses of the site
+READ_FUNCTIONS = {"mod_assign_get_submissions", "core_course_get_courses", "core_user_get_users_by_field"}
+
+
+class CallCache:
+    """
+    Shared memoization of Moodle web service calls that change rarely, like the assignments and enrolments of a course.
+
+    Responses are keyed by the site URL, the token, the function and its parameters, so different sites
+    and tokens never see each other's responses. Every function has its own time to live; the responses are
+    kept pickled in an LRU that is bounded by their size in bytes. A call of any other function that is
+    not known to only read (e.g. mod_assign_save_grade) drops all cached responses of its site.
+    """
+
+    def __init__(self, max_bytes, ttls=None):
+        """
+        Args:
+            max_bytes: Maximum size of all pickled responses, 0 disables the cache.
+            ttls: Dict of function name to seconds its responses are reused, defaults to DEFAULT_TTLS.
+        """
+        self.max_bytes = max_bytes
+        self.ttls = dict(DEFAULT_TTLS if ttls is None else ttls)
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # key -> (site, expiry, pickled response), least recently used first
+        self.bytes = 0
+        self.stats = {}  # function -> {"hits": ..., "misses": ...}
+        self.generations = {}  # site -> number of invalidations, so a read that overlaps a write is not stored
+        self.invalidations = 0
+
+    @classmethod
+    def from_env(cls):
+        """
+        Creates the cache from MOODLE_CALL_CACHE_MAX_BYTES (default 32 MB)
+        and MOODLE_CALL_CACHE_TTLS as "function=seconds,function=seconds" (merged into the defaults, 0 disables a function).
+        """
+        ttls = dict(DEFAULT_TTLS)
+        value = os.environ.get("MOODLE_CALL_CACHE_TTLS")
+        if value:
+            ttls.update({name.strip(): float(seconds) for name, seconds in (item.split("=") for item in value.split(",") if item.strip())})
+        return cls(
+            max_bytes=int(os.environ.get("MOODLE_CALL_CACHE_MAX_BYTES", 32 * 1024 * 1024)),
+            ttls={name: seconds for name, seconds in ttls.items() if seconds > 0},
+        )
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    @staticmethod
+    def key(site, api_key, wsfunction, params):
+        """
+        Builds the cache key of a call.
+        Args:
+            site: Base URL of the Moodle instance.
+            api_key: Token of the call.
+            wsfunction: Name of the web service function.
+            params: JSON-serializable parameters of the function.
+        Returns:
+            Hex digest identifying the call.
+        """
+        digest = hashlib.sha256()
+        digest.update(site.rstrip("/").encode())
+        digest.update(hashlib.sha256(api_key.encode()).digest())
+        digest.update(wsfunction.encode())
+        digest.update(json.dumps(params, sort_keys=True, default=str).encode())
+        return digest.hexdigest()
+
+    def call(self, site, api_key, wsfunction, params, fetch):
+        """
+        Returns the response of a call, from the cache if it holds a fresh one.
+        Args:
+            site: Base URL of the Moodle instance.
+            api_key: Token of the call.
+            wsfunction: Name of the web service function.
+            params: Parameters of the function.
+            fetch: Callable without arguments that calls Moodle.
+        """
+        if not self.enabled:
+            return fetch()
+        ttl = self.ttls.get(wsfunction)
+        if not ttl:
+            if wsfunction in READ_FUNCTIONS:
+                return fetch()
+            # the site changes with this call, also if it fails halfway
+            try:
+                return fetch()
+            finally:
+                self.invalidate(site)
+
+        site = site.rstrip("/")
+        key = self.key(site, api_key, wsfunction, params)
+        blob = self._get(wsfunction, key)
+        if blob is not None:
+            return pickle.loads(blob)
+        generation = self.generations.get(site, 0)
+        response = fetch()
+        self._put(key, site, generation, time.monotonic() + ttl, pickle.dumps(response, protocol=pickle.HIGHEST_PROTOCOL))
+        return response
+
+    def _get(self, wsfunction, key):
+        with self.lock:
+            counters = self.stats.setdefault(wsfunction, {"hits": 0, "misses": 0})
+            entry = self.entries.get(key)
+            if entry is not None and entry[1] < time.monotonic():
+                self._drop(key)
+                entry = None
+            if entry is None:
+                counters["misses"] += 1
+                return None
+            self.entries.move_to_end(key)
+            counters["hits"] += 1
+            return entry[2]
+
+    def _put(self, key, site, generation, expiry, blob):
+        if len(blob) > self.max_bytes:
+            return
+        with self.lock:
+            if self.generations.get(site, 0) != generation:
+                return
+            self._drop(key)
+            self.entries[key] = (site, expiry, blob)
+            self.bytes += len(blob)
+            while self.bytes > self.max_bytes and self.entries:
+                self._drop(next(iter(self.entries)))
+
+    def _drop(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= len(entry[2])
+
+    def invalidate(self, site):
+        """
+        Drops all cached responses of a Moodle instance.
+        """
+        site = site.rstrip("/")
+        with self.lock:
+            for key in [key for key, entry in self.entries.items() if entry[0] == site]:
+                self._drop(key)
+            self.generations[site] = self.generations.get(site, 0) + 1
+            self.invalidations += 1
+
+    def get_stats(self):
+        """
+        Returns hit/miss counters per function and the current size of the cache.
+        """
+        with self.lock:
+            return {
+                "functions": {name: dict(counters) for name, counters in self.stats.items()},
+                "hits": sum(c["hits"] for c in self.stats.values()),
+                "misses": sum(c["misses"] for c in self.stats.values()),
+                "invalidations": self.invalidations,
+                "entries": len(self.entries),
+                "bytes": self.bytes,
+                "maxBytes": self.max_bytes,
+            }
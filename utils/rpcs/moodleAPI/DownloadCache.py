@@ -0,0 +1,164 @@
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import uuid
+from collections import OrderedDict
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+logger = logging.getLogger('gunicorn.error')
+
+CHUNK_SIZE = 256 * 1024
+
+
+def copy_file(source, target):
+    """
+    Copies a file in chunks.
+    Returns:
+        The SHA-256 hex digest and the size of the file.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    with open(source, "rb") as src, open(target, "wb") as dst:
+        while chunk := src.read(CHUNK_SIZE):
+            dst.write(chunk)
+            digest.update(chunk)
+            size += len(chunk)
+    return digest.hexdigest(), size
+
+
+class DownloadCache:
+    """
+    Store of downloaded Moodle files on disk, so repeated imports only download new or modified submissions.
+
+    A file is identified by its URL without the token plus its timemodified; a new upload to a submission changes
+    the timemodified and thus misses the cache. Entries are partitioned per token, so a token is never served a file
+    that it has not downloaded itself. The store is bounded by the size of its files, least recently used out.
+    """
+
+    def __init__(self, directory, max_bytes):
+        """
+        Args:
+            directory: Directory of the cached files.
+            max_bytes: Maximum size of all cached files, 0 disables the cache.
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # key -> size of the file, least recently used first
+        self.bytes = 0
+        self.stats = {"hits": 0, "misses": 0, "stored": 0, "evicted": 0}
+
+        if self.enabled:
+            os.makedirs(self.directory, exist_ok=True)
+            files = [f for f in os.scandir(self.directory) if f.name.endswith(".bin")]
+            for f in sorted(files, key=lambda f: f.stat().st_mtime):
+                self.entries[f.name[:-len(".bin")]] = f.stat().st_size
+                self.bytes += f.stat().st_size
+
+    @classmethod
+    def from_env(cls):
+        """
+        Creates the cache from MOODLE_CACHE_DIR (default: care-moodle-cache in the temp directory)
+        and MOODLE_CACHE_MAX_BYTES (default 1 GB).
+        """
+        return cls(
+            directory=os.environ.get("MOODLE_CACHE_DIR") or os.path.join(tempfile.gettempdir(), "care-moodle-cache"),
+            max_bytes=int(os.environ.get("MOODLE_CACHE_MAX_BYTES", 1024 * 1024 * 1024)),
+        )
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    @staticmethod
+    def key(file_url, timemodified, api_key):
+        """
+        Builds the cache key of a file.
+        Args:
+            file_url: URL of the file, with or without the token.
+            timemodified: Time the file was last modified in Moodle, as listed with the submission.
+            api_key: Token the file is downloaded with.
+        Returns:
+            Hex digest identifying the file version for the token.
+        """
+        parts = urlsplit(file_url)
+        query = urlencode([(name, value) for name, value in parse_qsl(parts.query) if name != "token"])
+        digest = hashlib.sha256()
+        digest.update(urlunsplit(parts._replace(query=query, fragment="")).encode())
+        digest.update(f"|{timemodified}|".encode())
+        digest.update(hashlib.sha256(api_key.encode()).digest())
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".bin")
+
+    def get(self, key, target):
+        """
+        Copies the cached file of a key to target.
+        Returns:
+            The SHA-256 hex digest and the size of the file, or None if the key is not cached.
+        """
+        if not self.enabled:
+            return None
+        with self.lock:
+            cached = key in self.entries
+            if cached:
+                self.entries.move_to_end(key)
+        if cached:
+            try:
+                result = copy_file(self._path(key), target)
+                # the modification time orders the entries when the cache is loaded again
+                os.utime(self._path(key))
+                with self.lock:
+                    self.stats["hits"] += 1
+                return result
+            except OSError as e:
+                logger.warning(f"Could not read cached download {key}: {e}")
+                with self.lock:
+                    self._drop(key)
+        with self.lock:
+            self.stats["misses"] += 1
+        return None
+
+    def put(self, key, source):
+        """
+        Stores a copy of a downloaded file. Files larger than the whole cache are not stored.
+        """
+        if not self.enabled or os.path.getsize(source) > self.max_bytes:
+            return
+        temp_path = os.path.join(self.directory, f".{uuid.uuid4().hex}.part")
+        try:
+            _, size = copy_file(source, temp_path)
+            os.replace(temp_path, self._path(key))
+        except OSError as e:
+            logger.warning(f"Could not cache download {key}: {e}")
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return
+        with self.lock:
+            self.bytes -= self.entries.pop(key, 0)
+            self.entries[key] = size
+            self.bytes += size
+            self.stats["stored"] += 1
+            while self.bytes > self.max_bytes and self.entries:
+                oldest = next(iter(self.entries))
+                self._drop(oldest)
+                self.stats["evicted"] += 1
+
+    def _drop(self, key):
+        size = self.entries.pop(key, None)
+        if size is not None:
+            self.bytes -= size
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    def get_stats(self):
+        """
+        Returns the hit/miss counters and the current size of the cache.
+        """
+        with self.lock:
+            return {**self.stats, "entries": len(self.entries), "bytes": self.bytes, "maxBytes": self.max_bytes}
@@ -0,0 +1,139 @@
+import hashlib
+import json
+import logging
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlsplit
+
+from Metrics import metrics
+
+# Directory of the volume shared with the backend, file references are relative to it
+SHARED_DIR = os.environ.get("MOODLE_SHARED_DIR", "/files")
+# Spool directory of the downloads, relative to the shared directory
+DOWNLOAD_DIR = os.environ.get("MOODLE_DOWNLOAD_DIR", "moodle")
+# Number of files downloaded at once per request
+CONCURRENCY = int(os.environ.get("MOODLE_DOWNLOAD_CONCURRENCY", 4))
+CHUNK_SIZE = 256 * 1024
+
+
+class Downloader:
+    """
+    Downloads files from Moodle with a bounded number of concurrent requests.
+
+    Every response is streamed in chunks to a file in the spool directory, so a download never holds a whole file,
+    let alone a whole course, in memory. Each finished file is reported as soon as it is done; a failed file is
+    reported with its error and does not stop the others.
+
+    A file can be given with its timemodified ({"url": ..., "timemodified": ...} instead of the URL alone);
+    an unchanged file is then copied from the DownloadCache instead of downloaded again.
+    """
+
+    def __init__(self, client, concurrency=None, base_dir=None, download_dir=None, chunk_size=CHUNK_SIZE, cache=None):
+        """
+        Args:
+            client: MoodleClient whose session downloads the files.
+            concurrency: Maximum number of concurrent downloads, defaults to MOODLE_DOWNLOAD_CONCURRENCY (4).
+            base_dir: Shared directory, defaults to MOODLE_SHARED_DIR.
+            download_dir: Spool directory relative to the shared directory, defaults to MOODLE_DOWNLOAD_DIR.
+            chunk_size: Bytes read from the response at a time.
+            cache: Optional DownloadCache for the files given with their timemodified.
+        """
+        self.client = client
+        self.concurrency = max(1, concurrency or CONCURRENCY)
+        self.base_dir = os.path.realpath(base_dir or SHARED_DIR)
+        self.spool_dir = os.path.join(self.base_dir, download_dir or DOWNLOAD_DIR)
+        self.chunk_size = chunk_size
+        self.cache = cache
+        self.logger = logging.getLogger('gunicorn.error')
+
+    def fetch(self, index, file):
+        """
+        Downloads one file into the spool directory, or copies it from the cache.
+        Args:
+            index: Position of the file in the request.
+            file: URL of the file including the token, or a dict with the "url" and its "timemodified".
+        Returns:
+            Dict with the "index", "success" and "message", and for a downloaded file its "path", "hash", "size"
+            and whether it came from the cache ("cached").
+        """
+        path = None
+        try:
+            file_url = file["url"] if isinstance(file, dict) else file
+            timemodified = file.get("timemodified") if isinstance(file, dict) else None
+            os.makedirs(self.spool_dir, exist_ok=True)
+            extension = os.path.splitext(urlsplit(file_url).path)[1]
+            path = os.path.join(self.spool_dir, uuid.uuid4().hex + extension)
+
+            cache_key = None
+            if self.cache is not None and self.cache.enabled and timemodified:
+                cache_key = self.cache.key(file_url, timemodified, self.client.api_key)
+                cached = self.cache.get(cache_key, path)
+                if cached is not None:
+                    file_hash, size = cached
+                    return {"index": index, "success": True, "message": "File copied from the cache.",
+                            "path": path, "hash": file_hash, "size": size, "cached": True}
+
+            digest = hashlib.sha256()
+            size = 0
+            with metrics.upstream("download"), self.client.get(file_url, stream=True) as response:
+                response.raise_for_status()
+                if response.headers.get("Content-Type", "").startswith("application/json"):
+                    # Moodle answers an invalid token or a missing file with a JSON error instead of the file
+                    error = json.loads(response.content)
+                    raise ValueError(error.get("error") or error.get("message") or str(error))
+                with open(path + ".part", "wb") as f:
+                    for chunk in response.iter_content(self.chunk_size):
+                        f.write(chunk)
+                        digest.update(chunk)
+                        size += len(chunk)
+            os.replace(path + ".part", path)
+            if cache_key is not None:
+                self.cache.put(cache_key, path)
+            return {"index": index, "success": True, "message": "File downloaded successfully.",
+                    "path": path, "hash": digest.hexdigest(), "size": size, "cached": False}
+        except Exception as e:
+            self.logger.error(f"Download of file {index} failed: {e}")
+            if path is not None and os.path.exists(path + ".part"):
+                os.remove(path + ".part")
+            return {"index": index, "success": False, "message": "error: " + str(e)}
+
+    def download(self, file_urls, on_done=None):
+        """
+        Downloads files concurrently.
+        Args:
+            file_urls: URLs of the files (or dicts with the "url" and "timemodified", see fetch).
+            on_done: Called as on_done(result, done, total) with the result of every file (see fetch) once it is finished.
+        Returns:
+            The results of all files, in the order of file_urls.
+        """
+        results = [None] * len(file_urls)
+        if not file_urls:
+            return results
+        with ThreadPoolExecutor(max_workers=min(self.concurrency, len(file_urls))) as executor:
+            futures = [executor.submit(self.fetch, index, file_url) for index, file_url in enumerate(file_urls)]
+            for done, future in enumerate(as_completed(futures), start=1):
+                result = future.result()
+                results[result["index"]] = result
+                if on_done is not None:
+                    on_done(result, done, len(file_urls))
+        return results
+
+    def ref(self, result):
+        """
+        Returns the reference sent back for a downloaded file.
+        Returns:
+            Dict with the "path" relative to the shared directory, the "hash" and the "size" of the file.
+        """
+        return {"path": os.path.relpath(result["path"], self.base_dir), "hash": result["hash"], "size": result["size"]}
+
+    @staticmethod
+    def read(result):
+        """
+        Returns the content of a downloaded file and removes it from the spool directory.
+        """
+        try:
+            with open(result["path"], "rb") as f:
+                return f.read()
+        finally:
+            os.remove(result["path"])
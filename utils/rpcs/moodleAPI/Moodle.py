@@ -1,19 +1,80 @@
-from moodle_api import moodle_api
+import os
+import re
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 import requests
+from Downloader import Downloader
+from MoodleClient import MoodleClient
 from User import User
 import logging
+from Metrics import metrics
 
 __author__ = "Alexander Bürkle, Dennis Zyska, Yiwei Wang, Linyin Huang"
 
+# Students per mod_assign_save_grades call, chunks saved at once and retries of a chunk after a connection error
+GRADES_CHUNK_SIZE = int(os.environ.get("MOODLE_GRADES_CHUNK_SIZE", 50))
+GRADES_PARALLEL = int(os.environ.get("MOODLE_GRADES_PARALLEL", 2))
+GRADES_RETRIES = int(os.environ.get("MOODLE_GRADES_RETRIES", 2))
+GRADES_RETRY_DELAY = 1.0
+# Moodle error codes that reject a whole call independent of its students (token, capability, missing function)
+ABORT_ERRORCODES = {"invalidtoken", "accessexception", "nopermissions", "requireloginerror", "servicenotavailable",
+                    "webservicenotenabled", "sitemaintenance", "forcepasswordchangenotice"}
+# Moodle error codes that reject single students of a call (e.g. one that is not enrolled in the course)
+STUDENT_ERRORCODES = {"usernotincourse", "notenrolled", "invaliduser", "invaliduserid", "usernotfound", "notgradable"}
+# a user ID in an error message or debug info, e.g. "User 42 is not enrolled" or "userid => 42"
+_user_id = re.compile(r"\buser(?:id)?s?\b\W{0,4}(\d+)", re.IGNORECASE)
+
+
+def rejects_students(error, user_ids):
+    """
+    Tells whether a Moodle exception rejects some students of a call rather than the call as a whole.
+    Access errors never do and per-student error codes always do; any other error only does if it names a student
+    of the call by ID. A message that merely mentions users (like "Invalid user token") rejects the call.
+    Args:
+        error (dict): The exception returned by Moodle, with its 'errorcode', 'message' and optional 'debuginfo'.
+        user_ids (iterable): IDs of the students sent with the call.
+    """
+    errorcode = error.get('errorcode')
+    if errorcode in ABORT_ERRORCODES:
+        return False
+    if errorcode in STUDENT_ERRORCODES:
+        return True
+    named = set(_user_id.findall(f"{error.get('message', '')} {error.get('debuginfo', '')}"))
+    return not named.isdisjoint(str(user_id) for user_id in user_ids)
+
+
 class Moodle:
-    def __init__(self, api_key, url, endpoint="/webservice/rest/server.php"):
-        print(url)
+    def __init__(self, api_key, url, endpoint="/webservice/rest/server.php", download_cache=None, call_cache=None):
         self.api_key = api_key
         self.url = url
         self.endpoint = endpoint
         self.logger = logging.getLogger(__name__)
-        moodle_api.URL = url
-        moodle_api.KEY = api_key
+        # owns the URL and token of this instance, the connections are pooled per URL (see MoodleClient)
+        self.client = MoodleClient(url, api_key, endpoint)
+        # optional DownloadCache of the submission files
+        self.download_cache = download_cache
+        # optional CallCache shared by all instances, for the lookups that change rarely
+        self.call_cache = call_cache
+
+    def call(self, wsfunction, **kwargs):
+        """
+        Calls a Moodle web service function, recording its latency per wsfunction.
+        With a call cache, fresh responses of the cached functions are reused and writes invalidate them (see CallCache).
+        Args:
+            wsfunction (str): Name of the web service function.
+            **kwargs: Parameters of the function.
+        Returns:
+            The decoded JSON response.
+        """
+        def fetch():
+            with metrics.upstream(wsfunction):
+                return self.client.call(wsfunction, **kwargs)
+
+        if self.call_cache is None:
+            return fetch()
+        return self.call_cache.call(self.url, self.api_key, wsfunction, kwargs, fetch)
      
      
     def get_users_from_course(self, course_id):
@@ -34,7 +95,7 @@ class Moodle:
         
         
         # Get users from the course
-        course_users = moodle_api.call('core_enrol_get_enrolled_users', courseid=course_id)
+        course_users = self.call('core_enrol_get_enrolled_users', courseid=course_id)
         
         users = []
         
@@ -67,7 +128,7 @@ class Moodle:
         Returns:
             list: A list of tuples containing assignment IDs and names.
         """
-        course_assignments = moodle_api.call('mod_assign_get_assignments', courseids=[course_id])
+        course_assignments = self.call('mod_assign_get_assignments', courseids=[course_id])
         
         assign_ids_with_names = []
         
@@ -87,7 +148,7 @@ class Moodle:
         Returns:
         - list: A list of tuples containing the general user ID and the assignment user ID.
         """
-        return moodle_api.call('mod_assign_get_user_mappings', assignmentids=[assignment_id])['assignments'][0]['mappings']
+        return self.call('mod_assign_get_user_mappings', assignmentids=[assignment_id])['assignments'][0]['mappings']
 
     def get_id_mapping_for_assignment(self, course_id, assignment_cmid):
         """
@@ -99,7 +160,7 @@ class Moodle:
         Returns:
         - list: A list of tuples containing the general user ID and the assignment user ID.
         """
-        course_assignments = moodle_api.call('mod_assign_get_assignments', courseids=[course_id])
+        course_assignments = self.call('mod_assign_get_assignments', courseids=[course_id])
         
         assignment_cmid = int(assignment_cmid)
         
@@ -132,7 +193,7 @@ class Moodle:
         
 
         # Get users from the course
-        course_users = moodle_api.call('core_enrol_get_enrolled_users', courseid=course_id)
+        course_users = self.call('core_enrol_get_enrolled_users', courseid=course_id)
         assignment_id = self.get_id_mapping_for_assignment(course_id, assignment_cmid)
         
         users = []
@@ -162,13 +223,24 @@ class Moodle:
         return users
 
         
-    def publish_assignment_text_feedback(self, assignment_id, course_id, feedback_data):
+    def publish_assignment_text_feedback(self, assignment_id, course_id, feedback_data, chunk_size=None, parallel=None, retries=None):
         """
         This method uploads feedback data to a specific assignment in a Moodle course.
+        The grades are saved in chunks with mod_assign_save_grades, several chunks at once. A chunk that fails on the
+        connection is retried; a chunk that Moodle rejects for some of its students is split in halves until they are
+        isolated, so every student gets its own result and a rerun only has to send the failed ones. An error that
+        rejects the call as a whole (see rejects_students) aborts the publishing, the students not sent yet fail with it.
         Args:
             assignment_id (int): The ID of the assignment to upload data for.
             course_id (int): The ID of the course containing the assignment.
             feedback_data (list of dict): A list of dictionaries containing users' feedback data.
+            chunk_size (int): Students per mod_assign_save_grades call, defaults to MOODLE_GRADES_CHUNK_SIZE (50).
+            parallel (int): Chunks saved at once, defaults to MOODLE_GRADES_PARALLEL (2).
+            retries (int): Retries of a chunk after a connection error, defaults to MOODLE_GRADES_RETRIES (2).
+        Returns:
+            list of dict: The result of every student in the order of feedback_data, with 'extId', 'success' and 'message'.
+        Raises:
+            ValueError: If the assignment is not found in the course.
         Example:
             login_data = [
                 {'extId': 1, 'text': 'Feedback for user 1'},
@@ -177,21 +249,81 @@ class Moodle:
             publish_assignment_text_feedback(assignment_id=123, course_id=456, feedback_data=feedback_data)
         """
         assignment_id = self.get_id_mapping_for_assignment(course_id, assignment_id)
-        
-        for entry in feedback_data:
-            parameters = {}
-            parameters['assignmentid'] = assignment_id
-            parameters['userid'] = entry['extId']
-            parameters['grade'] = 100
-            parameters['attemptnumber'] = 1
-            parameters['addattempt'] = 1
-            parameters['workflowstate'] = 'Graded'
-            parameters['applytoall'] = 0
-            parameters['plugindata[assignfeedbackcomments_editor][text]'] = entry['text']
-            parameters['plugindata[assignfeedbackcomments_editor][format]'] = 0
-            parameters['plugindata[files_filemanager]'] = 0
-            moodle_api.call('mod_assign_save_grade', **parameters)
-                
+        if not isinstance(assignment_id, int):
+            raise ValueError(assignment_id)
+        chunk_size = max(1, chunk_size or GRADES_CHUNK_SIZE)
+        retries = GRADES_RETRIES if retries is None else retries
+
+        grades = [{
+            'userid': entry['extId'],
+            'grade': 100,
+            'attemptnumber': 1,
+            'addattempt': 1,
+            'workflowstate': 'Graded',
+            'plugindata': {
+                'assignfeedbackcomments_editor': {'text': entry['text'], 'format': 0},
+                'files_filemanager': 0,
+            },
+        } for entry in feedback_data]
+        results = {}
+        sent = set()
+        lock = threading.Lock()
+        aborted = []  # message of the error that rejected a whole call, no further chunks are sent after it
+
+        def save(chunk):
+            if aborted:
+                for grade in chunk:
+                    results[grade['userid']] = (False, "error: not sent, publishing aborted: " + aborted[0])
+                return
+            with lock:
+                resent = [grade['userid'] for grade in chunk if grade['userid'] in sent]
+                sent.update(grade['userid'] for grade in chunk)
+            if resent:
+                # mod_assign_save_grades is not transactional, Moodle may have saved these before rejecting the chunk
+                self.logger.warning(f"Sending the grades of {len(resent)} students again after a rejected chunk: {resent}")
+
+            rejected = False
+            for attempt in range(retries + 1):
+                try:
+                    self.call('mod_assign_save_grades', assignmentid=assignment_id, applytoall=0, grades=chunk)
+                    for grade in chunk:
+                        results[grade['userid']] = (True, "Feedback published successfully.")
+                    return
+                except SystemError as e:
+                    # rejected by Moodle, retrying does not help
+                    moodle_error = e.args[-1] if e.args and isinstance(e.args[-1], dict) else {}
+                    error = moodle_error.get('message', str(e))
+                    if not rejects_students(moodle_error, [grade['userid'] for grade in chunk]):
+                        self.logger.error(f"Moodle rejected mod_assign_save_grades ({moodle_error.get('errorcode')}), aborting: {error}")
+                        aborted.append(error)
+                    else:
+                        rejected = True
+                    break
+                except (requests.RequestException, ValueError) as e:
+                    error = str(e)
+                    if attempt < retries:
+                        self.logger.warning(f"Saving {len(chunk)} grades failed ({e}), retrying")
+                        time.sleep(GRADES_RETRY_DELAY * 2 ** attempt)
+                except Exception as e:
+                    # any other failure fails the chunk, so every student still gets a result
+                    self.logger.exception(f"Saving {len(chunk)} grades failed")
+                    error = str(e) or type(e).__name__
+                    break
+            if rejected and len(chunk) > 1:
+                save(chunk[:len(chunk) // 2])
+                save(chunk[len(chunk) // 2:])
+                return
+            for grade in chunk:
+                results[grade['userid']] = (False, "error: " + error)
+
+        chunks = [grades[i:i + chunk_size] for i in range(0, len(grades), chunk_size)]
+        with ThreadPoolExecutor(max_workers=max(1, min(parallel or GRADES_PARALLEL, len(chunks) or 1))) as executor:
+            for future in [executor.submit(save, chunk) for chunk in chunks]:
+                future.result()
+
+        return [{'extId': entry['extId'], 'success': results[entry['extId']][0], 'message': results[entry['extId']][1]}
+                for entry in feedback_data]
+
     def get_submission_infos_from_assignment(self, course_id, assignment_cmid):
         """
         Retrieves submission information from a specific assignment in a Moodle course.
@@ -209,7 +341,7 @@ class Moodle:
         """
         
         # Get users from the course
-        course_users = moodle_api.call('core_enrol_get_enrolled_users', courseid=course_id)
+        course_users = self.call('core_enrol_get_enrolled_users', courseid=course_id)
 
         assignment_id = self.get_id_mapping_for_assignment(course_id, assignment_cmid)
         
@@ -221,7 +353,7 @@ class Moodle:
                 roles += role['name'] + ', '
             users.append(User(user['id'], user['firstname'], user['lastname'], "", user['email'], roles[:-2]))
 
-        submissions = moodle_api.call('mod_assign_get_submissions', assignmentids=[assignment_id])     
+        submissions = self.call('mod_assign_get_submissions', assignmentids=[assignment_id])     
         
         submission_infos = []  
         
@@ -252,8 +384,7 @@ class Moodle:
                 if 'fileareas' in plugin:
                     for filearea in plugin['fileareas']:
                         for files in filearea['files']:
-                            file_url = files['fileurl']
-                            file_url += f'?token={moodle_api.KEY}'
+                            file_url = self.client.file_url(files['fileurl'])
                             file_name = files['filename']
                             
                             # Enhanced file metadata
@@ -283,17 +414,67 @@ class Moodle:
                             
     def download_submissions_from_url(self, file_urls):
         """
-        Downloads files from the given list of URLs.
+        Downloads files from the given list of URLs and returns their contents.
+        The files are downloaded concurrently and spooled to temporary files (see Downloader), then read back in order.
+        A failed file is reported in its item and does not fail the others. All contents are held in memory at once,
+        so large downloads should use download_submissions_to_files.
 
         Args:
-            file_urls (list of str): A list of URLs pointing to the files to be downloaded.
+            file_urls (list of str): A list of URLs pointing to the files to be downloaded,
+                or of dicts with the 'url' and its 'timemodified' to copy unchanged files from the download cache.
 
         Returns:
-            list of bytes: A list containing the content of each downloaded file.
+            list of dict: An item per file in the order of file_urls, with:
+                - 'index' (int): The position of the file in file_urls.
+                - 'success' (bool): Whether the file was downloaded.
+                - 'message' (str): The error of a failed file.
+                - 'cached' (bool): Whether the file was copied from the download cache.
+                - 'file' (bytes): The content of a downloaded file.
+        """
+        results = Downloader(self.client, base_dir=tempfile.gettempdir(), cache=self.download_cache).download(file_urls)
+        items = []
+        try:
+            for result in results:
+                item = {key: result[key] for key in ("index", "success", "message", "cached") if key in result}
+                if result["success"]:
+                    try:
+                        item["file"] = Downloader.read(result)
+                    except OSError as e:
+                        item.update(success=False, message="error: " + str(e))
+                items.append(item)
+            return items
+        finally:
+            for result in results:
+                if result["success"] and os.path.exists(result["path"]):
+                    os.remove(result["path"])
+
+    def download_submissions_to_files(self, file_urls, on_done=None):
         """
-        files = []
-        for file_url in file_urls:
-            response = requests.get(file_url)
-            files.append(response.content)
-        return files   
-  
+        Downloads files from the given list of URLs into the directory shared with the backend.
+        The files are downloaded concurrently and streamed to disk, so they never cross the socket (see Downloader).
+
+        Args:
+            file_urls (list of str): A list of URLs pointing to the files to be downloaded, or dicts as for download_submissions_from_url.
+            on_done (callable): Called as on_done(item, done, total) with the item of every file once it is finished.
+
+        Returns:
+            list of dict: An item per file in the order of file_urls, with:
+                - 'index' (int): The position of the file in file_urls.
+                - 'success' (bool): Whether the file was downloaded.
+                - 'message' (str): The error of a failed file.
+                - 'cached' (bool): Whether the file was copied from the download cache.
+                - 'fileRef' (dict): The 'path' relative to the shared directory, 'hash' and 'size' of a downloaded file.
+        """
+        downloader = Downloader(self.client, cache=self.download_cache)
+
+        def item(result):
+            entry = {key: result[key] for key in ("index", "success", "message", "cached") if key in result}
+            if result["success"]:
+                entry["fileRef"] = downloader.ref(result)
+            return entry
+
+        def report(result, done, total):
+            if on_done is not None:
+                on_done(item(result), done, total)
+
+        return [item(result) for result in downloader.download(file_urls, report)]
@@ -0,0 +1,90 @@
+import os
+import threading
+from http.cookiejar import DefaultCookiePolicy
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from moodle_api import moodle_api
+
+ENDPOINT = "/webservice/rest/server.php"
+
+
+class MoodleClient:
+    """
+    Client of the REST web service of one Moodle instance, authenticated with one token.
+
+    Replaces the module variables URL and KEY of moodle_api, so concurrent requests for different instances or tokens
+    cannot mix them up. All clients of the same base URL share one requests.Session, whose connection pool keeps
+    the TCP/TLS connections alive between calls; the session stores no cookies, so nothing leaks between tokens.
+    """
+
+    _sessions = {}  # base URL -> requests.Session
+    _lock = threading.Lock()
+
+    def __init__(self, url, api_key, endpoint=ENDPOINT, pool_size=None, timeout=None):
+        """
+        Args:
+            url: Base URL of the Moodle instance.
+            api_key: Web service token.
+            endpoint: Path of the REST endpoint.
+            pool_size: Connections kept alive per host, default from MOODLE_HTTP_POOL_SIZE (16).
+            timeout: Seconds to wait for Moodle, default from MOODLE_HTTP_TIMEOUT (no timeout if unset).
+        """
+        self.url = url.rstrip("/")
+        self.api_key = api_key
+        self.endpoint = endpoint
+        self.pool_size = pool_size or int(os.environ.get("MOODLE_HTTP_POOL_SIZE", 16))
+        if timeout is None and os.environ.get("MOODLE_HTTP_TIMEOUT"):
+            timeout = float(os.environ["MOODLE_HTTP_TIMEOUT"])
+        self.timeout = timeout
+        self.session = self.session_for(self.url, self.pool_size)
+
+    @classmethod
+    def session_for(cls, url, pool_size):
+        """
+        Returns the shared session of a base URL, created on first use with a pool of pool_size connections per host.
+        """
+        with cls._lock:
+            session = cls._sessions.get(url)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+                cls._sessions[url] = session
+            return session
+
+    def call(self, wsfunction, **kwargs):
+        """
+        Calls a web service function, like moodle_api.call.
+        Args:
+            wsfunction: Name of the web service function.
+            **kwargs: Parameters of the function, flattened with moodle_api.rest_api_parameters.
+        Returns:
+            The decoded JSON response.
+        Raises:
+            SystemError if Moodle answers with an exception.
+        """
+        parameters = moodle_api.rest_api_parameters(kwargs)
+        parameters.update({"wstoken": self.api_key, "moodlewsrestformat": "json", "wsfunction": wsfunction})
+        response = self.session.post(self.url + self.endpoint, parameters, timeout=self.timeout)
+        response = response.json()
+        if type(response) == dict and response.get("exception"):
+            raise SystemError("Error calling Moodle API\n", response)
+        return response
+
+    def get(self, file_url, **kwargs):
+        """
+        Downloads a file (e.g. a submission file URL with the token) over the shared session.
+        Returns:
+            The requests.Response.
+        """
+        return self.session.get(file_url, timeout=self.timeout, **kwargs)
+
+    def file_url(self, file_url):
+        """
+        Returns the URL of a file of a web service response with the token of this client, as needed to download it.
+        """
+        return f"{file_url}?token={self.api_key}"
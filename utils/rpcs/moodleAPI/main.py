@@ -1,9 +1,26 @@
 import logging
+import os
+import sys
 import socketio
+
+# the modules shared by all RPC services are copied next to this file in the Docker image,
+# from a checkout they are imported from utils/rpcs/common
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "common"))
+
+from CallCache import CallCache
+from DownloadCache import DownloadCache
 from Moodle import Moodle
+from Scheduler import Scheduler
+from Metrics import metrics
 
 __author__ = "Alexander Bürkle, Dennis Zyska"
 
+# Defaults of the scheduler (see Scheduler.from_env to override them with MOODLE_SCHED_* variables):
+# bulk downloads and uploads are limited and wait behind the interactive lookups
+SCHEDULER_LIMITS = {"downloadSubmissionsFromUrl": 4, "publishAssignmentTextFeedback": 2}
+SCHEDULER_PRIORITIES = {"downloadSubmissionsFromUrl": 10, "publishAssignmentTextFeedback": 10}
+SCHEDULER_MAX_ACTIVE = 16
+
 def create_app():
     """
     # Webservice API Documentation:
@@ -22,6 +39,13 @@ def create_app():
     # create a Socket.IO server
     sio = socketio.Server(async_mode='threading')
 
+    # limits how many Moodle requests run at once
+    scheduler = Scheduler.from_env("MOODLE", SCHEDULER_LIMITS, SCHEDULER_PRIORITIES, SCHEDULER_MAX_ACTIVE)
+    # submission files downloaded before, see DownloadCache.from_env for the settings
+    download_cache = DownloadCache.from_env()
+    # responses of the course lookups that change rarely, shared by all requests, see CallCache.from_env for the settings
+    call_cache = CallCache.from_env()
+
     @sio.event
     def connect(sid, environ, auth):
         logger.info(f"Connection established with {sid}")
@@ -41,7 +65,7 @@ def create_app():
     def test(sid, data):
         logger.info(f"Received call: {data} from {sid}")
         try:
-            api = Moodle(data['options']['apiKey'], data['options']['url'])
+            api = Moodle(data['options']['apiKey'], data['options']['url'], call_cache=call_cache)
             users = api.create_users_from_course(data['courseID'])
             response = {"success": True, "data": users}
             return response
@@ -51,10 +75,11 @@ def create_app():
             return response
         
     @sio.on("getUsersFromCourse")
+    @scheduler.scheduled("getUsersFromCourse")
     def getUsersFromCourse(sid, data):
         try:
             logger.info(f"Received call: {data} from {sid}")
-            api = Moodle(data['options']['apiKey'], data['options']['apiUrl'])
+            api = Moodle(data['options']['apiKey'], data['options']['apiUrl'], call_cache=call_cache)
             users = api.get_users_from_course(data['options']['courseID'])
             response = {"success": True, "data": users}
             return response
@@ -64,10 +89,11 @@ def create_app():
             return response
     
     @sio.on("getUsersFromAssignment")
+    @scheduler.scheduled("getUsersFromAssignment")
     def getUsersFromAssignment(sid, data):
         try:
             logger.info(f"Received call: {data} from {sid}")
-            api = Moodle(data['options']['apiKey'], data['options']['url'])
+            api = Moodle(data['options']['apiKey'], data['options']['url'], call_cache=call_cache)
             users = api.get_users_from_assignment(data['courseID'], data['assignmentID'])
             response = {"success": True, "data": users}
             return response
@@ -77,10 +103,11 @@ def create_app():
             return response
     
     @sio.on("getSubmissionInfosFromAssignment")
+    @scheduler.scheduled("getSubmissionInfosFromAssignment")
     def getSubmissionInfosFromAssignment(sid, data):
         try:
             logger.info(f"Received call: {data} from {sid}")
-            api = Moodle(data['options']['apiKey'], data['options']['apiUrl'])
+            api = Moodle(data['options']['apiKey'], data['options']['apiUrl'], call_cache=call_cache)
             submission_infos = api.get_submission_infos_from_assignment(course_id=data['options']['courseID'], assignment_cmid=data['options']['assignmentID'])
             response = {"success": True, "data": submission_infos}
             return response
@@ -90,13 +117,34 @@ def create_app():
             return response
         
     @sio.on("downloadSubmissionsFromUrl")
+    @scheduler.scheduled("downloadSubmissionsFromUrl")
     def downloadSubmissionsFromUrl(sid, data):
+        """
+        Downloads submission files concurrently.
+        With "output" set to "fileRef" (recommended), the files are written to the directory shared with the backend:
+        every finished file is sent as a "downloadProgress" event ({"downloadId", "index", "done", "total", "success",
+        "message", "fileRef"}). Otherwise the contents of all files are returned in the items ("file"), which holds
+        them all in memory at once. Either way a failed file is listed with its message without failing the request.
+        Args:
+            sid: Session ID.
+            data: Contains the "options", the "fileUrls", an optional "output" and an optional "downloadId" echoed in the events.
+                A file URL can be given as {"url", "timemodified"}, so an unchanged file is served from the download cache.
+        Returns:
+            The summary {"downloadId", "total", "failed", "items"} with an item per file in the order of the URLs.
+        """
         try:
             logger.info(f"Received call: {data} from {sid}")
-            api = Moodle(data['options']['apiKey'], data['options']['apiUrl'])
-            files = api.download_submissions_from_url(file_urls=data['fileUrls'])
-            response = {"success": True, "data": files}
-            return response
+            api = Moodle(data['options']['apiKey'], data['options']['apiUrl'], download_cache=download_cache, call_cache=call_cache)
+            if data.get('output') == "fileRef":
+                def report(item, done, total):
+                    sio.emit("downloadProgress", {"downloadId": data.get('downloadId'), "done": done, "total": total, **item}, to=sid)
+
+                items = api.download_submissions_to_files(file_urls=data['fileUrls'], on_done=report)
+            else:
+                items = api.download_submissions_from_url(file_urls=data['fileUrls'])
+            failed = sum(1 for item in items if not item['success'])
+            return {"success": True, "message": f"Downloaded {len(items)} files, {failed} failed.",
+                    "data": {"downloadId": data.get('downloadId'), "total": len(items), "failed": failed, "items": items}}
         except Exception as e:
             logger.error(f"Error: {e}")
             logger.info(f"Received call: {data} from {sid}")
@@ -104,12 +152,25 @@ def create_app():
             return response
         
     @sio.on("publishAssignmentTextFeedback")
+    @scheduler.scheduled("publishAssignmentTextFeedback")
     def publishAssignmentTextFeedback(sid, data):
+        """
+        Publishes text feedback for many students in chunks (see Moodle.publish_assignment_text_feedback).
+        Returns:
+            The result of every student ({"extId", "success", "message"}) as "data";
+            the request fails if any student failed, naming them in the message, so a rerun can send only those.
+        """
         try:
             logger.info(f"Received call: {data} from {sid}")
-            api = Moodle(data['options']['apiKey'], data['options']['apiUrl'])
-            api.publish_assignment_text_feedback(course_id=data['options']['courseID'], assignment_id=data['options']['assignmentID'], feedback_data=data['feedback'])
-            response = {"success": True, "data": "Passwords uploaded successfully."}
+            api = Moodle(data['options']['apiKey'], data['options']['apiUrl'], call_cache=call_cache)
+            results = api.publish_assignment_text_feedback(course_id=data['options']['courseID'], assignment_id=data['options']['assignmentID'], feedback_data=data['feedback'])
+            failed = [result['extId'] for result in results if not result['success']]
+            if failed:
+                shown = ", ".join(str(ext_id) for ext_id in failed[:20]) + (", ..." if len(failed) > 20 else "")
+                message = f"Publishing failed for {len(failed)} of {len(results)} users: {shown}"
+            else:
+                message = "Passwords uploaded successfully."
+            response = {"success": not failed, "message": message, "data": results}
             return response
         except Exception as e:
             logger.error(f"Error: {e}")
@@ -117,10 +178,11 @@ def create_app():
             return response
     
     @sio.on("getAssignmentInfoFromCourse")
+    @scheduler.scheduled("getAssignmentInfoFromCourse")
     def getAssignmentInfoFromCourse(sid, data):
         try:
             logger.info(f"Received call: {data} from {sid}")
-            api = Moodle(data['options']['apiKey'], data['options']['apiUrl'])
+            api = Moodle(data['options']['apiKey'], data['options']['apiUrl'], call_cache=call_cache)
             assignments = api.get_assignment_ids_from_course(data['options']['courseID'])
             response = {"success": True, "data": assignments}
             return response
@@ -129,8 +191,19 @@ def create_app():
             response = {"success": False, "message": "error: " + str(e)}
             return response
     
+    @sio.on("schedulerStats")
+    def schedulerStats(sid, data=None):
+        return {"success": True, "data": scheduler.get_stats()}
+
+    @sio.on("cacheStats")
+    def cacheStats(sid, data=None):
+        return {"success": True, "data": {"downloads": download_cache.get_stats(), "calls": call_cache.get_stats()}}
+
+    # request metrics of all events and Moodle call latencies, served at /metrics beside the Socket.IO endpoint
+    metrics.instrument(sio)
+
     logger.info("Creating App...")
-    app = socketio.WSGIApp(sio)
+    app = socketio.WSGIApp(sio, metrics.wsgi_app)
     return app
 
 
@@ -0,0 +1,66 @@
+"""
+A local HTTP server standing in for a Moodle instance in the tests of the Moodle service.
+"""
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+
+class MoodleServer:
+    """
+    Answers every request with the result of respond(path, params), a JSON-serializable value or a
+    (status, body bytes) or (status, body bytes, content type) tuple, and records the path, parameters
+    and client port of every request.
+    """
+
+    def __init__(self, respond):
+        self.respond = respond
+        self.requests = []
+        self.lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def handle_request(self, params):
+                parts = urlsplit(self.path)
+                params = {**dict(parse_qsl(parts.query)), **params}
+                with server.lock:
+                    server.requests.append({"path": parts.path, "params": params, "port": self.client_address[1]})
+                result = server.respond(parts.path, params)
+                if not isinstance(result, tuple):
+                    result = (200, json.dumps(result).encode(), "application/json")
+                status, body, content_type = result if len(result) == 3 else (*result, "application/octet-stream")
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.send_header("Set-Cookie", "MoodleSession=secret; Path=/")
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                self.handle_request({})
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0))).decode()
+                self.handle_request(dict(parse_qsl(body)))
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        threading.Thread(target=self.httpd.serve_forever, args=(0.05,), daemon=True).start()
+
+    def calls(self, wsfunction=None):
+        """
+        Returns the parameters of the web service calls, optionally of one function only.
+        """
+        with self.lock:
+            return [r["params"] for r in self.requests
+                    if r["path"].endswith("server.php") and wsfunction in (None, r["params"].get("wsfunction"))]
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
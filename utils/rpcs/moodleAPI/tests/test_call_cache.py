@@ -0,0 +1,78 @@
+import threading
+
+from CallCache import CallCache
+
+SITE = "https://moodle.example.org"
+
+
+class Fetch:
+    """
+    Stands in for a Moodle call and counts how often it is made.
+    """
+
+    def __init__(self, response=None):
+        self.response = response
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return self.response if self.response is not None else {"call": self.calls}
+
+
+def test_read_is_reused_until_a_write_on_the_site():
+    cache = CallCache(max_bytes=1024 * 1024)
+    fetch = Fetch()
+    params = {"courseid": 3}
+    assert cache.call(SITE, "token", "core_enrol_get_enrolled_users", params, fetch) == {"call": 1}
+    assert cache.call(SITE + "/", "token", "core_enrol_get_enrolled_users", params, fetch) == {"call": 1}
+
+    cache.call(SITE, "token", "mod_assign_save_grades", {"assignmentid": 7}, Fetch({}))
+    assert cache.call(SITE, "token", "core_enrol_get_enrolled_users", params, fetch) == {"call": 2}
+    assert cache.get_stats()["invalidations"] == 1
+
+
+def test_write_of_another_site_keeps_the_responses():
+    cache = CallCache(max_bytes=1024 * 1024)
+    fetch = Fetch()
+    cache.call(SITE, "token", "mod_assign_get_assignments", {}, fetch)
+    cache.call("https://other.example.org", "token", "mod_assign_save_grades", {}, Fetch({}))
+    cache.call(SITE, "token", "core_course_get_courses", {}, Fetch({}))
+    cache.call(SITE, "token", "mod_assign_get_assignments", {}, fetch)
+    assert fetch.calls == 1
+
+
+def test_key_separates_tokens_functions_and_parameters():
+    key = CallCache.key(SITE, "token", "mod_assign_get_assignments", {"courseids": [3]})
+    assert key != CallCache.key(SITE, "other", "mod_assign_get_assignments", {"courseids": [3]})
+    assert key != CallCache.key(SITE, "token", "mod_assign_get_user_mappings", {"courseids": [3]})
+    assert key != CallCache.key(SITE, "token", "mod_assign_get_assignments", {"courseids": [4]})
+
+
+def test_read_that_overlaps_a_write_is_not_stored():
+    cache = CallCache(max_bytes=1024 * 1024)
+    started, written = threading.Event(), threading.Event()
+
+    def slow_fetch():
+        started.set()
+        written.wait(5)
+        return {"stale": True}
+
+    reader = threading.Thread(target=cache.call, args=(SITE, "token", "mod_assign_get_assignments", {}, slow_fetch))
+    reader.start()
+    started.wait(5)
+    cache.call(SITE, "token", "mod_assign_save_grades", {}, Fetch({}))
+    written.set()
+    reader.join(5)
+    assert cache.call(SITE, "token", "mod_assign_get_assignments", {}, Fetch({"stale": False})) == {"stale": False}
+
+
+def test_response_expires_after_its_ttl(monkeypatch):
+    import CallCache as module
+    now = [1000.0]
+    monkeypatch.setattr(module.time, "monotonic", lambda: now[0])
+    cache = CallCache(max_bytes=1024 * 1024, ttls={"mod_assign_get_assignments": 10})
+    fetch = Fetch()
+    cache.call(SITE, "token", "mod_assign_get_assignments", {}, fetch)
+    now[0] += 11
+    cache.call(SITE, "token", "mod_assign_get_assignments", {}, fetch)
+    assert fetch.calls == 2
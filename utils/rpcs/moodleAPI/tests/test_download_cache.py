@@ -0,0 +1,47 @@
+import hashlib
+
+from DownloadCache import DownloadCache
+
+URL = "https://moodle.example.org/webservice/pluginfile.php/12/assignsubmission_file/submission_files/3/essay.pdf"
+
+
+def test_key_changes_with_timemodified():
+    assert DownloadCache.key(URL, 1700000000, "token") != DownloadCache.key(URL, 1700000100, "token")
+
+
+def test_key_ignores_the_token_in_the_url_but_not_the_token_used():
+    assert DownloadCache.key(URL + "?token=abc&forcedownload=1", 1, "abc") == DownloadCache.key(URL + "?forcedownload=1", 1, "abc")
+    assert DownloadCache.key(URL, 1, "abc") != DownloadCache.key(URL, 1, "other")
+    assert DownloadCache.key(URL + "?forcedownload=1", 1, "abc") != DownloadCache.key(URL, 1, "abc")
+
+
+def test_modified_submission_misses_the_cache(tmp_path):
+    cache = DownloadCache(str(tmp_path / "cache"), max_bytes=1024 * 1024)
+    source = tmp_path / "download"
+    source.write_bytes(b"first upload")
+    cache.put(DownloadCache.key(URL, 1, "token"), str(source))
+
+    target = tmp_path / "target"
+    assert cache.get(DownloadCache.key(URL, 1, "token"), str(target)) == (hashlib.sha256(b"first upload").hexdigest(), 12)
+    assert target.read_bytes() == b"first upload"
+    assert cache.get(DownloadCache.key(URL, 2, "token"), str(tmp_path / "other")) is None
+    assert not (tmp_path / "other").exists()
+    assert cache.get_stats()["hits"] == 1 and cache.get_stats()["misses"] == 1
+
+
+def test_least_recently_used_file_is_evicted(tmp_path):
+    cache = DownloadCache(str(tmp_path / "cache"), max_bytes=20)
+    source = tmp_path / "download"
+    source.write_bytes(b"x" * 8)
+    for name in ("a", "b", "c"):
+        cache.put(name, str(source))
+    assert cache.get("a", str(tmp_path / "target")) is None
+    assert cache.get("c", str(tmp_path / "target")) is not None
+    assert cache.get_stats()["evicted"] == 1
+
+
+def test_entries_are_loaded_again(tmp_path):
+    source = tmp_path / "download"
+    source.write_bytes(b"content")
+    DownloadCache(str(tmp_path / "cache"), max_bytes=1024).put("a", str(source))
+    assert DownloadCache(str(tmp_path / "cache"), max_bytes=1024).get("a", str(tmp_path / "target")) is not None
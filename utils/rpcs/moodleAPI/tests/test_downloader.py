@@ -0,0 +1,149 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+import pytest
+import requests
+
+import main
+from Downloader import Downloader
+from Moodle import Moodle
+from MoodleClient import MoodleClient
+from moodle_server import MoodleServer
+
+
+def contents(index):
+    return f"%PDF submission {index} ".encode() * (index + 1) * 1000
+
+
+class Files:
+    """
+    Serves /file<i>.pdf, /missing.pdf as 404 and /expired.pdf as the JSON error Moodle sends for an invalid token;
+    the first requests wait until `concurrent` of them have arrived.
+    """
+
+    def __init__(self, concurrent=1):
+        self.barrier = threading.Barrier(concurrent, timeout=5)
+
+    def __call__(self, path, params):
+        if path == "/missing.pdf":
+            return 404, b"Not Found"
+        if path == "/expired.pdf":
+            return 200, json.dumps({"error": "Invalid token - token expired", "errorcode": "invalidtoken"}).encode(), "application/json"
+        try:
+            self.barrier.wait()
+        except threading.BrokenBarrierError:
+            pass
+        return 200, contents(int(path[len("/file"):-len(".pdf")])), "application/pdf"
+
+
+@pytest.fixture
+def server():
+    servers = []
+
+    def start(respond):
+        servers.append(MoodleServer(respond))
+        return servers[-1]
+
+    yield start
+    for server in servers:
+        server.close()
+
+
+def spooled(directory):
+    return sorted(os.listdir(directory)) if os.path.isdir(directory) else []
+
+
+def test_files_are_downloaded_concurrently(server, tmp_path):
+    files = Files(concurrent=3)
+    moodle = server(files)
+    downloader = Downloader(MoodleClient(moodle.url, "token"), concurrency=3, base_dir=str(tmp_path))
+    progress = []
+    results = downloader.download([f"{moodle.url}/file{i}.pdf?token=token" for i in range(6)],
+                                  lambda result, done, total: progress.append((result["index"], done, total)))
+
+    # the barrier of the first three requests only opens if they run at once
+    assert not files.barrier.broken
+    assert [result["index"] for result in results] == list(range(6))
+    for i, result in enumerate(results):
+        assert result["success"] and not result["cached"]
+        assert result["size"] == len(contents(i)) and result["hash"] == hashlib.sha256(contents(i)).hexdigest()
+        assert result["path"].endswith(".pdf") and os.path.dirname(result["path"]) == downloader.spool_dir
+        assert downloader.ref(result)["path"] == os.path.join("moodle", os.path.basename(result["path"]))
+        assert Downloader.read(result) == contents(i)
+    assert sorted(index for index, _, _ in progress) == list(range(6))
+    assert [(done, total) for _, done, total in progress] == [(done, 6) for done in range(1, 7)]
+    assert spooled(downloader.spool_dir) == []
+
+
+def test_failing_url_does_not_stop_the_others(server, tmp_path):
+    moodle = server(Files())
+    downloader = Downloader(MoodleClient(moodle.url, "token"), concurrency=2, base_dir=str(tmp_path))
+    results = downloader.download([f"{moodle.url}/file0.pdf", f"{moodle.url}/missing.pdf", f"{moodle.url}/file2.pdf"])
+    assert [result["success"] for result in results] == [True, False, True]
+    assert results[1]["message"].startswith("error: 404")
+    assert spooled(downloader.spool_dir) == sorted(os.path.basename(results[i]["path"]) for i in (0, 2))
+
+
+def test_json_error_body_is_a_failure(server, tmp_path):
+    moodle = server(Files())
+    downloader = Downloader(MoodleClient(moodle.url, "token"), base_dir=str(tmp_path))
+    [result] = downloader.download([f"{moodle.url}/expired.pdf"])
+    assert result == {"index": 0, "success": False, "message": "error: Invalid token - token expired"}
+    assert spooled(downloader.spool_dir) == []
+
+
+class BrokenClient:
+    """
+    A client whose downloads break off after the first chunk.
+    """
+    api_key = "token"
+
+    class Response:
+        headers = {"Content-Type": "application/pdf"}
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *args):
+            pass
+
+        def raise_for_status(self):
+            pass
+
+        def iter_content(self, chunk_size):
+            yield b"%PDF first chunk"
+            raise requests.ConnectionError("connection reset by peer")
+
+    def get(self, file_url, **kwargs):
+        return self.Response()
+
+
+def test_part_file_of_a_broken_download_is_removed(tmp_path):
+    downloader = Downloader(BrokenClient(), base_dir=str(tmp_path))
+    [result] = downloader.download(["https://moodle.example.org/essay.pdf"])
+    assert result == {"index": 0, "success": False, "message": "error: connection reset by peer"}
+    assert spooled(downloader.spool_dir) == []
+
+
+def test_inline_download_reports_every_file(server, tmp_path, monkeypatch):
+    monkeypatch.setattr(tempfile, "tempdir", str(tmp_path))
+    moodle = server(Files())
+    items = Moodle("token", moodle.url).download_submissions_from_url([f"{moodle.url}/file1.pdf", f"{moodle.url}/missing.pdf"])
+    assert items[0] == {"index": 0, "success": True, "message": "File downloaded successfully.", "cached": False, "file": contents(1)}
+    assert items[1]["index"] == 1 and not items[1]["success"] and "file" not in items[1]
+    assert spooled(tmp_path / "moodle") == []
+
+
+def test_inline_request_lists_failed_files_without_failing(server, tmp_path, monkeypatch):
+    monkeypatch.setattr(tempfile, "tempdir", str(tmp_path))
+    moodle = server(Files())
+    handler = main.create_app().engineio_app.handlers["/"]["downloadSubmissionsFromUrl"]
+    response = handler("sid", {"options": {"apiKey": "token", "apiUrl": moodle.url},
+                               "fileUrls": [f"{moodle.url}/expired.pdf", f"{moodle.url}/file0.pdf"]})
+    assert response["success"] and response["message"] == "Downloaded 2 files, 1 failed."
+    assert response["data"]["total"] == 2 and response["data"]["failed"] == 1
+    assert [item["success"] for item in response["data"]["items"]] == [False, True]
+    assert response["data"]["items"][1]["file"] == contents(0)
@@ -0,0 +1,66 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from Moodle import Moodle
+from MoodleClient import MoodleClient
+from moodle_server import MoodleServer
+
+
+@pytest.fixture
+def server():
+    server = MoodleServer(lambda path, params: {"token": params.get("wstoken"), "function": params.get("wsfunction")})
+    yield server
+    server.close()
+
+
+def test_call_sends_the_token_and_flattened_parameters(server):
+    client = MoodleClient(server.url, "token")
+    assert client.call("mod_assign_get_assignments", courseids=[3, 4]) == {"token": "token", "function": "mod_assign_get_assignments"}
+    [params] = server.calls()
+    assert params["courseids[0]"] == "3" and params["courseids[1]"] == "4"
+    assert params["moodlewsrestformat"] == "json"
+
+
+def test_concurrent_instances_keep_their_own_url_and_token(server):
+    other = MoodleServer(lambda path, params: {"token": params.get("wstoken"), "site": "other"})
+    try:
+        def call(i):
+            url, token = (server.url, f"token{i}") if i % 2 else (other.url, f"other{i}")
+            return token, Moodle(token, url).call("core_webservice_get_site_info")
+
+        with ThreadPoolExecutor(8) as executor:
+            results = list(executor.map(call, range(40)))
+        assert all(response["token"] == token for token, response in results)
+        assert all(("site" in response) == token.startswith("other") for token, response in results)
+        assert len(server.calls()) == 20 and len(other.calls()) == 20
+    finally:
+        other.close()
+
+
+def test_clients_of_one_site_share_a_pooled_session(server):
+    first, second = MoodleClient(server.url, "first"), MoodleClient(server.url + "/", "second")
+    assert first.session is second.session
+    assert MoodleClient("https://other.example.org", "first").session is not first.session
+    for _ in range(3):
+        first.call("core_webservice_get_site_info")
+        second.call("core_webservice_get_site_info")
+    # the connection is kept alive between the calls
+    assert len({request["port"] for request in server.requests}) == 1
+
+
+def test_session_stores_no_cookies(server):
+    client = MoodleClient(server.url, "token")
+    client.call("core_webservice_get_site_info")
+    client.get(client.file_url(server.url + "/pluginfile.php/1/essay.pdf"))
+    assert len(client.session.cookies) == 0
+    assert server.requests[-1]["params"] == {"token": "token"}
+
+
+def test_moodle_exception_raises():
+    server = MoodleServer(lambda path, params: {"exception": "moodle_exception", "errorcode": "invalidtoken", "message": "Invalid token"})
+    try:
+        with pytest.raises(SystemError):
+            MoodleClient(server.url, "token").call("core_webservice_get_site_info")
+    finally:
+        server.close()
@@ -0,0 +1,156 @@
+import threading
+
+import pytest
+import requests
+
+import Moodle as moodle_module
+from Moodle import Moodle, rejects_students
+
+COURSE = 3
+ASSIGNMENT_CMID = 5
+ASSIGNMENT_ID = 50
+
+
+def moodle_error(errorcode, message, debuginfo=None):
+    """
+    The exception MoodleClient.call raises for an exception response of Moodle.
+    """
+    response = {"exception": "moodle_exception", "errorcode": errorcode, "message": message}
+    if debuginfo is not None:
+        response["debuginfo"] = debuginfo
+    return SystemError("Error calling Moodle API\n", response)
+
+
+class StubMoodle:
+    """
+    Stands in for Moodle.call: answers the assignment lookup and passes every mod_assign_save_grades call
+    to save_grades, which raises to reject it; records the user IDs of every save call.
+    """
+
+    def __init__(self, save_grades=None):
+        self.save_grades = save_grades or (lambda user_ids, attempt: None)
+        self.saves = []
+        self.lock = threading.Lock()
+
+    def __call__(self, wsfunction, **kwargs):
+        if wsfunction == "mod_assign_get_assignments":
+            assert kwargs == {"courseids": [COURSE]}
+            return {"courses": [{"assignments": [{"cmid": ASSIGNMENT_CMID, "id": ASSIGNMENT_ID}]}]}
+        assert wsfunction == "mod_assign_save_grades"
+        assert kwargs["assignmentid"] == ASSIGNMENT_ID
+        user_ids = [grade["userid"] for grade in kwargs["grades"]]
+        with self.lock:
+            self.saves.append(user_ids)
+            attempt = self.saves.count(user_ids) - 1
+        self.save_grades(user_ids, attempt)
+        return None
+
+
+@pytest.fixture(autouse=True)
+def no_retry_delay(monkeypatch):
+    monkeypatch.setattr(moodle_module, "GRADES_RETRY_DELAY", 0)
+
+
+def publish(stub, students, **kwargs):
+    moodle = Moodle("token", "https://moodle.example.org")
+    moodle.call = stub
+    feedback = [{"extId": user_id, "text": f"Feedback for {user_id}"} for user_id in students]
+    return moodle.publish_assignment_text_feedback(ASSIGNMENT_CMID, COURSE, feedback, **kwargs)
+
+
+def test_full_chunk_is_saved_in_one_call():
+    stub = StubMoodle()
+    results = publish(stub, range(1, 6), chunk_size=10)
+    assert stub.saves == [[1, 2, 3, 4, 5]]
+    assert results == [{"extId": user_id, "success": True, "message": "Feedback published successfully."} for user_id in range(1, 6)]
+
+
+def test_chunks_cover_all_students():
+    stub = StubMoodle()
+    results = publish(stub, range(1, 8), chunk_size=3, parallel=2)
+    assert sorted(stub.saves) == [[1, 2, 3], [4, 5, 6], [7]]
+    assert all(result["success"] for result in results)
+
+
+def test_bisection_isolates_a_rejected_student():
+    def save_grades(user_ids, attempt):
+        if 6 in user_ids:
+            raise moodle_error("usernotincourse", "User 6 is not enrolled in the course")
+
+    stub = StubMoodle(save_grades)
+    results = publish(stub, range(1, 9), chunk_size=8)
+    assert [result["extId"] for result in results if not result["success"]] == [6]
+    assert results[5]["message"] == "error: User 6 is not enrolled in the course"
+    # halved until the student is alone: 1-8, 1-4, 5-8, 5-6, 5, 6, 7-8
+    assert len(stub.saves) == 7 and [6] in stub.saves
+
+
+def test_message_naming_a_student_by_id_bisects():
+    def save_grades(user_ids, attempt):
+        if 3 in user_ids:
+            raise moodle_error("invalidparameter", "Invalid parameter value detected", "grades => userid => 3: not gradable")
+
+    results = publish(StubMoodle(save_grades), range(1, 5), chunk_size=4)
+    assert [result["success"] for result in results] == [True, True, False, True]
+
+
+@pytest.mark.parametrize("error", [
+    moodle_error("invalidtoken", "Invalid token - token not found"),
+    moodle_error("nopermissions", "Sorry, but you do not currently have permissions to grade users"),
+    # mentions users, but none of the students of the call
+    moodle_error("invalidparameter", "Invalid parameter value detected (user grades are invalid)"),
+])
+def test_call_level_error_aborts_and_marks_the_rest_not_sent(error):
+    def save_grades(user_ids, attempt):
+        raise error
+
+    stub = StubMoodle(save_grades)
+    results = publish(stub, range(1, 7), chunk_size=2, parallel=1)
+    # no bisection and no further chunks
+    assert stub.saves == [[1, 2]]
+    assert [result["message"] for result in results[:2]] == ["error: " + error.args[1]["message"]] * 2
+    for result in results[2:]:
+        assert not result["success"]
+        assert result["message"] == "error: not sent, publishing aborted: " + error.args[1]["message"]
+
+
+def test_connection_errors_are_retried():
+    def save_grades(user_ids, attempt):
+        if attempt == 0:
+            raise requests.ConnectionError("connection reset")
+
+    stub = StubMoodle(save_grades)
+    results = publish(stub, [1, 2], chunk_size=2, retries=2)
+    assert stub.saves == [[1, 2], [1, 2]]
+    assert all(result["success"] for result in results)
+
+
+def test_chunk_fails_once_retries_are_exhausted():
+    def save_grades(user_ids, attempt):
+        raise requests.Timeout("read timed out")
+
+    stub = StubMoodle(save_grades)
+    results = publish(stub, [1, 2], chunk_size=2, retries=1)
+    assert stub.saves == [[1, 2], [1, 2]]
+    assert [result["message"] for result in results] == ["error: read timed out"] * 2
+
+
+def test_unexpected_errors_fail_only_their_chunk():
+    def save_grades(user_ids, attempt):
+        if 1 in user_ids:
+            raise KeyError("grades")
+
+    results = publish(StubMoodle(save_grades), range(1, 5), chunk_size=2)
+    assert [result["success"] for result in results] == [False, False, True, True]
+    assert results[0]["message"] == "error: 'grades'"
+
+
+def test_rejects_students():
+    assert rejects_students({"errorcode": "usernotincourse", "message": "Not enrolled"}, [1])
+    assert rejects_students({"errorcode": "x", "message": "User 42 is not enrolled"}, [41, 42])
+    assert rejects_students({"errorcode": "x", "message": "Invalid", "debuginfo": "userid => 42"}, ["42"])
+    assert not rejects_students({"errorcode": "x", "message": "User 42 is not enrolled"}, [41, 43])
+    assert not rejects_students({"errorcode": "x", "message": "Invalid user token"}, [1])
+    assert not rejects_students({"errorcode": "x", "message": "Users cannot be graded in assignment 42"}, [42, 7])
+    assert not rejects_students({"errorcode": "nopermissions", "message": "User 42 may not grade"}, [42])
+    assert not rejects_students({}, [1])
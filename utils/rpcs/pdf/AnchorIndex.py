@@ -0,0 +1,242 @@
+import bisect
+import unicodedata
+
+import pymupdf
+
+# Text extraction flags of the character stream (those of page.get_text("rawdict")), without reading images
+TEXT_FLAGS = pymupdf.TEXTFLAGS_RAWDICT & ~pymupdf.TEXT_PRESERVE_IMAGES
+
+
+def normalize(text):
+    """
+    Normalizes text for anchor search: compatibility forms (e.g. ligatures) are decomposed,
+    letters are lowercased, and runs of whitespace become a single space.
+    Args:
+        text: The text to normalize.
+    Returns:
+        The normalized text without leading or trailing whitespace.
+    """
+    return " ".join(unicodedata.normalize("NFKC", text).lower().split())
+
+
+class AnchorIndex:
+    """
+    Character stream of a single page with one box per character, built once per page
+    and used to resolve TextQuoteSelector parts (prefix, exact, suffix) to rectangles.
+
+    The stream is normalized like the search query (see normalize); lines are joined by a single space,
+    or without one if the line ends with a hyphen, so hyphenated words are found as in page.search_for.
+    """
+
+    def __init__(self, page):
+        """
+        Args:
+            page: The pymupdf page.
+        """
+        self.chars = []  # raw characters of the page in reading order
+        self.boxes = []  # pymupdf.Rect of every raw character
+        self.lines = []  # line number of every raw character
+
+        norm = []
+        self.norm_map = []  # raw character index of every normalized character (-1 for line breaks)
+
+        line_no = 0
+        for block in page.get_text("rawdict", flags=TEXT_FLAGS)["blocks"]:
+            if block.get("type") != 0:
+                continue
+            for line in block["lines"]:
+                for span in line["spans"]:
+                    for char in span["chars"]:
+                        char_idx = len(self.chars)
+                        self.chars.append(char["c"])
+                        self.boxes.append(pymupdf.Rect(char["bbox"]))
+                        self.lines.append(line_no)
+                        for c in unicodedata.normalize("NFKC", char["c"]).lower():
+                            if c.isspace():
+                                if not norm or norm[-1] == " ":
+                                    continue
+                                c = " "
+                            norm.append(c)
+                            self.norm_map.append(char_idx)
+
+                if norm and norm[-1] == "-":
+                    # dehyphenate: the word continues on the next line
+                    norm.pop()
+                    self.norm_map.pop()
+                elif norm and norm[-1] != " ":
+                    norm.append(" ")
+                    self.norm_map.append(-1)
+                line_no += 1
+
+        self.text = "".join(norm)
+
+    def longest_prefix(self, query):
+        """
+        Finds the longest prefix of the (normalized) query that occurs on the page.
+        Whether a prefix occurs is monotonic in its length, so a binary search over the length
+        needs only a logarithmic number of scans of the page text.
+        Args:
+            query: Normalized query string.
+        Returns:
+            Length of the longest occurring prefix (0 if not even the first character occurs).
+        """
+        if query in self.text:
+            return len(query)
+        low, high = 0, len(query) - 1
+        while low < high:
+            mid = (low + high + 1) // 2
+            if query[:mid] in self.text:
+                low = mid
+            else:
+                high = mid - 1
+        return low
+
+    def rects(self, start, end):
+        """
+        Returns one rectangle per line for a span of the normalized text.
+        Args:
+            start: Start offset in the normalized text.
+            end: End offset in the normalized text.
+        Returns:
+            List of pymupdf.Rect, in reading order.
+        """
+        return self._line_rects(sorted({self.norm_map[i] for i in range(start, end) if self.norm_map[i] >= 0}))
+
+    def char_rects(self, start, end):
+        """
+        Returns one rectangle per line for a span of the raw characters.
+        Args:
+            start: Index of the first raw character.
+            end: Index after the last raw character.
+        Returns:
+            List of pymupdf.Rect, in reading order.
+        """
+        return self._line_rects(range(start, end))
+
+    def _line_rects(self, char_indices):
+        rects = []
+        current_line = None
+        for char_idx in char_indices:
+            if self.lines[char_idx] != current_line:
+                current_line = self.lines[char_idx]
+                rects.append(pymupdf.Rect(self.boxes[char_idx]))
+            else:
+                rects[-1] |= self.boxes[char_idx]
+        return rects
+
+    def textbox(self, rect):
+        """
+        Returns the text of all characters overlapping a rectangle, like page.get_textbox,
+        but from the characters already read instead of a new text page.
+        Args:
+            rect: pymupdf.Rect of the area.
+        Returns:
+            The text, with lines separated by newlines.
+        """
+        x0, y0, x1, y1 = pymupdf.Rect(rect)
+        lines = {}
+        for c, box, line_no in zip(self.chars, self.boxes, self.lines):
+            if x0 >= box.x1 or y0 >= box.y1 or x1 <= box.x0 or y1 <= box.y0:
+                continue
+            lines.setdefault(line_no, []).append(c)
+        return "\n".join("".join(line_chars) for line_chars in lines.values())
+
+    def search(self, search_string):
+        """
+        Searches for a string on the page; if it does not occur, for its longest prefix that does.
+        Replaces repeated page.search_for calls with one character dropped at a time.
+        Args:
+            search_string: The string to search for.
+        Returns:
+            List of rectangles of all occurrences, one per line (may be empty if nothing matches).
+        """
+        query = normalize(search_string or "")
+        length = self.longest_prefix(query) if query else 0
+        if length == 0:
+            return []
+
+        needle = query[:length]
+        rects = []
+        pos = self.text.find(needle)
+        while pos != -1:
+            rects.extend(self.rects(pos, pos + length))
+            pos = self.text.find(needle, pos + length)
+        return rects
+
+
+def page_length(page):
+    """
+    Returns the number of raw characters of a page (the length of AnchorIndex.chars) without the character boxes:
+    the span texts of page.get_text("dict") consist of the same characters.
+    Args:
+        page: The pymupdf page.
+    """
+    return sum(
+        len(span["text"])
+        for block in page.get_text("dict", flags=TEXT_FLAGS)["blocks"] if block.get("type") == 0
+        for line in block["lines"]
+        for span in line["spans"]
+    )
+
+
+class OffsetIndex:
+    """
+    Maps character offsets of the whole document to pages and character boxes.
+
+    The document text is the concatenation of the raw characters of all pages without separators,
+    which is how the frontend (pdf.js text layer) counts TextPositionSelector offsets.
+    The AnchorIndex of a page is built on first use and shared with the quote search;
+    the pages before it are only counted (see page_length), in order and only as far as the requested offsets reach.
+    """
+
+    def __init__(self, doc):
+        """
+        Args:
+            doc: The pymupdf document.
+        """
+        self.doc = doc
+        self.indexes = {}
+        self.page_offsets = []  # offset of the first character of every page counted so far
+        self.end = 0
+
+    def page(self, page_num):
+        """
+        Returns the AnchorIndex of a page.
+        Args:
+            page_num: Zero-based page number.
+        """
+        if page_num not in self.indexes:
+            self.indexes[page_num] = AnchorIndex(self.doc[page_num])
+        return self.indexes[page_num]
+
+    def _page_of(self, offset):
+        while offset >= self.end and len(self.page_offsets) < len(self.doc):
+            page_num = len(self.page_offsets)
+            self.page_offsets.append(self.end)
+            index = self.indexes.get(page_num)
+            self.end += len(index.chars) if index is not None else page_length(self.doc[page_num])
+        if offset >= self.end:
+            return None
+        return bisect.bisect_right(self.page_offsets, offset) - 1
+
+    def locate(self, start, end):
+        """
+        Resolves a TextPositionSelector span to a page.
+        Args:
+            start: Start offset in the document text.
+            end: End offset in the document text.
+        Returns:
+            Tuple (page_num, anchor_index, page_start, page_end) with offsets into anchor_index.chars,
+            or None if the span is invalid, beyond the document or crosses a page boundary.
+        """
+        if not isinstance(start, int) or not isinstance(end, int) or not 0 <= start < end:
+            return None
+        page_num = self._page_of(start)
+        if page_num is None:
+            return None
+        index = self.page(page_num)
+        page_start = start - self.page_offsets[page_num]
+        page_end = end - self.page_offsets[page_num]
+        if page_end > len(index.chars):
+            return None
+        return page_num, index, page_start, page_end
@@ -0,0 +1,226 @@
+import contextvars
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from multiprocessing import resource_tracker, shared_memory
+
+_current = contextvars.ContextVar("cancel_token", default=None)
+_attach_lock = threading.Lock()
+
+
+def attach_shared_memory(name):
+    """
+    Attaches to a shared memory block created by another process, without registering it with the resource tracker.
+    The creator unlinks the block; a registration by the attaching worker would make the tracker warn about a leak
+    or unlink the block early once the worker exits.
+    Args:
+        name: Name of the block.
+    Raises:
+        FileNotFoundError if the block was already unlinked.
+    """
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    # before 3.13 attaching always registers the block; unregistering it afterwards is no option either, as spawned
+    # workers share the tracker of the server process and that would drop the creator's own registration
+    with _attach_lock:
+        register = resource_tracker.register
+        resource_tracker.register = lambda name, rtype: None
+        try:
+            return shared_memory.SharedMemory(name=name)
+        finally:
+            resource_tracker.register = register
+
+
+class Cancelled(Exception):
+    """
+    Raised inside a handler whose request was cancelled or ran past its response deadline.
+    """
+
+    def response(self):
+        """
+        Returns the response sent for the cancelled request (if the client still waits for it).
+        """
+        return {"success": False, "cancelled": True, "message": "cancelled: " + str(self)}
+
+
+class CancelToken:
+    """
+    Cancellation state of a request: an optional response deadline and a flag set by cancel,
+    e.g. when the client disconnects. The page and annotation loops of the handlers call check_cancelled,
+    which raises Cancelled, so abandoned work stops early instead of delaying queued requests.
+
+    A token handed to a worker process (pickled with the call) needs share first: its flag then lives
+    in a one-byte shared memory block, so a cancel in the server process reaches the running worker.
+    """
+
+    def __init__(self, deadline=None):
+        """
+        Args:
+            deadline: Time (seconds since the epoch) after which the response is no longer awaited, None for no deadline.
+        """
+        self.deadline = deadline
+        self.reason = None
+        self._event = threading.Event()
+        self._shm = None
+        self._owner = True
+
+    @classmethod
+    def from_request(cls, data):
+        """
+        Creates the token of a request with its "responseDeadline" (milliseconds since the epoch, as sent by the backend).
+        """
+        deadline = data.get("responseDeadline") if isinstance(data, dict) else None
+        return cls(deadline / 1000 if deadline else None)
+
+    def share(self):
+        """
+        Moves the flag into shared memory so that the token can be used in worker processes.
+        Returns:
+            The token itself.
+        """
+        if self._shm is None and self._owner:
+            self._shm = shared_memory.SharedMemory(create=True, size=1)
+            self._shm.buf[0] = 1 if self._event.is_set() else 0
+        return self
+
+    def cancel(self, reason="request cancelled"):
+        if self.reason is None:
+            self.reason = reason
+        self._event.set()
+        if self._shm is not None:
+            self._shm.buf[0] = 1
+
+    @property
+    def cancelled(self):
+        return self._event.is_set() or (self._shm is not None and self._shm.buf[0] == 1)
+
+    def error(self):
+        """
+        Returns:
+            The Cancelled exception if the request was cancelled or its deadline has passed, None otherwise.
+        """
+        if self.cancelled:
+            return Cancelled(self.reason or "request cancelled")
+        if self.deadline is not None and time.time() > self.deadline:
+            return Cancelled("response deadline exceeded")
+        return None
+
+    def check(self):
+        """
+        Raises:
+            Cancelled if the request was cancelled or its deadline has passed.
+        """
+        error = self.error()
+        if error is not None:
+            raise error
+
+    def close(self):
+        """
+        Releases the shared memory block (by the process that created it).
+        """
+        if self._shm is not None:
+            self._shm.close()
+            if self._owner:
+                self._shm.unlink()
+            self._shm = None
+
+    def __getstate__(self):
+        return {"deadline": self.deadline, "reason": self.reason, "shm_name": self._shm.name if self._shm else None,
+                "cancelled": self._event.is_set()}
+
+    def __setstate__(self, state):
+        self.deadline = state["deadline"]
+        self.reason = state["reason"]
+        self._event = threading.Event()
+        if state["cancelled"]:
+            self._event.set()
+        self._shm = None
+        self._owner = False
+        if state["shm_name"]:
+            try:
+                self._shm = attach_shared_memory(state["shm_name"])
+            except FileNotFoundError:
+                # the creator already released it, nobody waits for the request anymore
+                self.cancel(self.reason or "request cancelled")
+
+
+@contextmanager
+def cancellation(token):
+    """
+    Makes the token the one checked by check_cancelled in the enclosed block (in the current thread or task).
+    """
+    if token is None:
+        yield
+        return
+    reset = _current.set(token)
+    try:
+        yield token
+    finally:
+        _current.reset(reset)
+        if not token._owner:
+            token.close()
+
+
+def current_token():
+    return _current.get()
+
+
+def check_cancelled():
+    """
+    Raises Cancelled if the current request was cancelled or ran past its deadline; does nothing outside of cancellation.
+    """
+    token = _current.get()
+    if token is not None:
+        token.check()
+
+
+class CancelRegistry:
+    """
+    Tokens of the requests in progress per Socket.IO session, cancelled together when the session disconnects.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.tokens = {}  # sid -> set of tokens
+
+    @contextmanager
+    def track(self, sid, data, shared=False):
+        """
+        Creates the token of a request and tracks it under the session until the enclosed block ends.
+        Args:
+            sid: Session ID.
+            data: Request data, see CancelToken.from_request.
+            shared: Whether the token is used in worker processes, see CancelToken.share.
+        """
+        token = CancelToken.from_request(data)
+        if shared:
+            token.share()
+        with self.lock:
+            self.tokens.setdefault(sid, set()).add(token)
+        try:
+            yield token
+        except BaseException:
+            # work still running for the request (e.g. in worker processes) is no longer awaited
+            token.cancel("request aborted")
+            raise
+        finally:
+            with self.lock:
+                tokens = self.tokens.get(sid)
+                if tokens is not None:
+                    tokens.discard(token)
+                    if not tokens:
+                        del self.tokens[sid]
+            token.close()
+
+    def cancel(self, sid, reason="client disconnected"):
+        """
+        Cancels all requests of a session.
+        Returns:
+            The number of cancelled requests.
+        """
+        with self.lock:
+            tokens = list(self.tokens.get(sid, ()))
+        for token in tokens:
+            token.cancel(reason)
+        return len(tokens)
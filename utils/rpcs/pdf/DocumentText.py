@@ -0,0 +1,70 @@
+class DocumentText:
+    """
+    Text of a whole document, assembled once from its page texts.
+
+    Keeps the cumulative offset of every page in the whole text, so page-local offsets
+    (e.g. from page_text.find) can be resolved to offsets in the whole text and
+    prefix/suffix context is a plain slice of it.
+    """
+
+    def __init__(self, page_texts):
+        """
+        Args:
+            page_texts: Iterable with the text of every page, in page order.
+        """
+        self.page_texts = list(page_texts)
+        self.page_offsets = []
+        offset = 0
+        for page_text in self.page_texts:
+            self.page_offsets.append(offset)
+            offset += len(page_text)
+        self.text = "".join(self.page_texts)
+
+    @classmethod
+    def from_document(cls, doc):
+        """
+        Collects the text of all pages of a pymupdf document.
+        Args:
+            doc: The pymupdf document.
+        Returns:
+            DocumentText of the document.
+        """
+        return cls(page.get_text() for page in doc)
+
+    def to_global(self, page_num, index):
+        """
+        Resolves an offset in the text of a page to an offset in the whole text.
+        Args:
+            page_num: Zero-based page number.
+            index: Offset in the page text.
+        Returns:
+            Offset in the whole text.
+        """
+        return self.page_offsets[page_num] + index
+
+    def find(self, page_num, text):
+        """
+        Finds text on a page and returns its position in the whole text.
+        Args:
+            page_num: Zero-based page number.
+            text: The text to find.
+        Returns:
+            Tuple (start, end) of offsets in the whole text, or (-1, -1) if the text is not on the page.
+        """
+        start = self.page_texts[page_num].find(text)
+        if start == -1:
+            return -1, -1
+        start = self.to_global(page_num, start)
+        return start, start + len(text)
+
+    def context(self, start, end, length=30):
+        """
+        Returns the text before and after a span of the whole text.
+        Args:
+            start: Start offset in the whole text.
+            end: End offset in the whole text.
+            length: Maximum number of characters for prefix and suffix.
+        Returns:
+            Tuple (prefix, suffix).
+        """
+        return self.text[max(0, start - length):start], self.text[end:end + length]
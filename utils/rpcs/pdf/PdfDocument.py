@@ -0,0 +1,186 @@
+import os
+import shutil
+import tempfile
+import uuid
+
+import pymupdf
+
+from SharedFile import SharedFile
+
+OUTPUT_FULL = "full"
+OUTPUT_INCREMENTAL = "incremental"
+OUTPUT_MODES = (OUTPUT_FULL, OUTPUT_INCREMENTAL)
+
+
+class PdfDocument:
+    """
+    PDF file of a request, opened for modification and written back in the requested output mode.
+
+    In "full" mode the whole document is re-serialized with doc.write().
+    In "incremental" mode only a PDF incremental update is returned (the changed and appended objects
+    plus the new xref), which the caller appends to the original file it sent.
+    pymupdf only saves incrementally into the file a document was opened from,
+    so in this mode the original bytes are spooled to a temporary file first.
+    """
+
+    def __init__(self, file, output_mode=OUTPUT_FULL):
+        """
+        Args:
+            file: The PDF file as bytes.
+            output_mode: "full" or "incremental".
+        """
+        if output_mode not in OUTPUT_MODES:
+            raise ValueError(f"Unknown output mode '{output_mode}'")
+        self.file = file
+        self.output_mode = output_mode
+        self.path = None
+
+        if output_mode == OUTPUT_INCREMENTAL:
+            fd, self.path = tempfile.mkstemp(suffix=".pdf")
+            with os.fdopen(fd, "wb") as f:
+                f.write(file)
+            self.doc = pymupdf.open(self.path)
+        else:
+            self.doc = pymupdf.open(stream=file)
+
+    @classmethod
+    def from_request(cls, data):
+        """
+        Opens the PDF file of a Socket.IO request.
+        Args:
+            data: Request data with the PDF file (or a "fileRef" or "uploadId" naming it) and an optional "outputMode".
+        Returns:
+            A PdfDocument, or a SharedPdfDocument if the request names a file on the shared volume.
+        """
+        shared_file = SharedFile.from_request(data)
+        if shared_file is not None:
+            shared_file.verify()
+            ref = data.get("fileRef") or {}
+            output_path = shared_file.output_path(ref.get("output"), ref.get("overwrite", False))
+            return SharedPdfDocument(shared_file, output_path, data.get("outputMode", OUTPUT_FULL), ref.get("overwrite", False))
+        return cls(data["file"], data.get("outputMode", OUTPUT_FULL))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """
+        Closes the document and removes the temporary file of the incremental mode.
+        """
+        if not self.doc.is_closed:
+            self.doc.close()
+        if self.path:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+            self.path = None
+
+    @staticmethod
+    def unchanged(file, output_mode=OUTPUT_FULL):
+        """
+        Output for a request that leaves the document as it is, without opening it.
+        Args:
+            file: The original PDF file as bytes.
+            output_mode: "full" or "incremental".
+        Returns:
+            Tuple (buffer, info), see write.
+        """
+        if output_mode == OUTPUT_INCREMENTAL:
+            return b"", {"outputMode": OUTPUT_INCREMENTAL, "baseSize": len(file)}
+        return file, {"outputMode": OUTPUT_FULL}
+
+    def write(self):
+        """
+        Serializes the modified document.
+        Falls back to full output if the document cannot be saved incrementally (e.g. it had to be repaired when opened).
+        Returns:
+            Tuple (buffer, info). buffer is the whole file in full mode, or the bytes to append to the
+            original file in incremental mode. info holds the "outputMode" used and, for incremental
+            output, the "baseSize" of the original file the update applies to.
+        """
+        if self.output_mode == OUTPUT_INCREMENTAL and self.doc.can_save_incrementally():
+            self.doc.saveIncr()
+            with open(self.path, "rb") as f:
+                f.seek(len(self.file))
+                update = f.read()
+            return update, {"outputMode": OUTPUT_INCREMENTAL, "baseSize": len(self.file)}
+        return self.doc.write(), {"outputMode": OUTPUT_FULL}
+
+
+class SharedPdfDocument(PdfDocument):
+    """
+    PDF file on the volume shared with the backend, written to a result file next to it instead of returned.
+
+    All work happens in a temporary ".part" file owned by the request: in "incremental" mode the original is copied
+    there and the update is appended in place, in "full" mode the document is re-serialized into it. Only a
+    successful write moves it onto the result path, so a failed or cancelled request never touches an existing file.
+    Either way the result is the complete file.
+    """
+
+    def __init__(self, shared_file, output_path, output_mode=OUTPUT_FULL, overwrite=False):
+        """
+        Args:
+            shared_file: The verified SharedFile of the request.
+            output_path: Absolute path of the result file, see SharedFile.output_path.
+            output_mode: "full" or "incremental".
+            overwrite: Whether the result may replace an existing file.
+        """
+        if output_mode not in OUTPUT_MODES:
+            raise ValueError(f"Unknown output mode '{output_mode}'")
+        self.file = None
+        self.shared_file = shared_file
+        self.output_path = output_path
+        self.output_mode = output_mode
+        self.overwrite = overwrite
+        self.path = None
+        self.part_path = f"{output_path}.{uuid.uuid4().hex}.part"
+
+        if output_mode == OUTPUT_INCREMENTAL:
+            shutil.copyfile(shared_file.path, self.part_path)
+            self.doc = pymupdf.open(self.part_path)
+        else:
+            # mupdf reads the file on demand, it is never loaded into a Python buffer
+            self.doc = pymupdf.open(shared_file.path)
+
+    def write(self):
+        """
+        Writes the modified document to the result file.
+        Returns:
+            Tuple (ref, info): the reference of the result file (see SharedFile.ref) and the "outputMode",
+            always "full" since the result file holds the complete document.
+        Raises:
+            ValueError if the result file was created meanwhile and overwrite is not set.
+        """
+        if self.output_mode == OUTPUT_INCREMENTAL and self.doc.can_save_incrementally():
+            self.doc.saveIncr()
+        elif self.output_mode == OUTPUT_INCREMENTAL:
+            # the copy is open, the full document goes into a new part file
+            self.doc.save(self.part_path + ".full")
+            os.replace(self.part_path + ".full", self.part_path)
+        else:
+            self.doc.save(self.part_path)
+        if self.overwrite:
+            os.replace(self.part_path, self.output_path)
+        else:
+            # a link fails if the result exists, unlike a rename, which would replace it
+            try:
+                os.link(self.part_path, self.output_path)
+            except FileExistsError:
+                raise ValueError(f"Output file '{os.path.relpath(self.output_path, self.shared_file.base_dir)}' already exists")
+            os.remove(self.part_path)
+        return self.shared_file.ref(self.output_path), {"outputMode": OUTPUT_FULL}
+
+    def close(self):
+        """
+        Closes the document and removes the part file, the only file the request created before the result.
+        """
+        super().close()
+        for path in (self.part_path, self.part_path + ".full"):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
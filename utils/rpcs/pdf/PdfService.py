@@ -0,0 +1,252 @@
+import asyncio
+import functools
+import logging
+from concurrent.futures import CancelledError
+
+import pymupdf
+
+import extraction
+import handlers
+from Cancellation import CancelRegistry, Cancelled
+from Metrics import metrics
+from ResultCache import ResultCache
+from Scheduler import Scheduler, Overloaded
+from UploadStore import UploadStore
+
+# Defaults of the scheduler (see Scheduler.from_env to override them with PDF_SCHED_* variables):
+# interactive extraction has a lower priority value, so it starts before bulk exports waiting for a slot;
+# a batch is one job that spreads its documents over the whole process pool, so batches run one at a time
+SCHEDULER_LIMITS = {"annotationsExtract": 4, "embedAnnotations": 2, "deleteAllAnnotations": 2,
+                    "annotationsExtractBatch": 1, "embedAnnotationsBatch": 1}
+SCHEDULER_PRIORITIES = {"annotationsExtract": 0, "embedAnnotations": 10, "deleteAllAnnotations": 10,
+                        "annotationsExtractBatch": 20, "embedAnnotationsBatch": 20}
+SCHEDULER_MAX_ACTIVE = 4
+
+# Events that process one document and their handlers. Every request may set "timings" (stage timings in the
+# response), "profile" (cProfile/tracemalloc summary, with PDF_PROFILING enabled), "responseDeadline" (ms since the
+# epoch, the work stops once the client no longer waits, as it does when the client disconnects) and the scheduler's
+# "deadline" and "priority".
+EVENTS = {
+    # extracts all annotations and groups them by subject, see handlers.extract_annotations
+    "annotationsExtract": handlers.extract_annotations,
+    # embeds annotations with an optional outputMode ("full" or "incremental") and highlightMode ("annotation" or "word")
+    "embedAnnotations": handlers.embed_annotations,
+    # removes all annotations, with an optional outputMode
+    "deleteAllAnnotations": handlers.delete_all_annotations,
+}
+# The handlers as run inside a worker process of the pool, where the pages are not sharded again
+WORKER_HANDLERS = {**EVENTS, "annotationsExtract": functools.partial(handlers.extract_annotations, parallel=False)}
+# Batch events and the event run for each of their items: the documents are spread over the process pool as one
+# scheduled job, the result of every document is sent as a "batchProgress" event as soon as it is done
+BATCH_EVENTS = {"annotationsExtractBatch": "annotationsExtract", "embedAnnotationsBatch": "embedAnnotations"}
+# Events of the chunked upload protocol, see UploadStore
+UPLOAD_EVENTS = ("uploadBegin", "uploadChunk", "uploadCommit", "uploadFetch", "uploadDelete")
+STATS_EVENTS = ("cacheStats", "schedulerStats")
+
+
+class PdfService:
+    """
+    State and logic of the PDF RPC events, shared by the WSGI app (create_app) and the ASGI app (create_asgi_app).
+
+    The apps only dispatch: the WSGI app runs everything in the thread of the request, the ASGI app awaits the
+    same steps in the process pool or in threads, so the event loop stays free.
+    """
+
+    def __init__(self):
+        self.logger = logging.getLogger('gunicorn.error')
+        # responses of repeated requests on unchanged documents, see ResultCache.from_env for the settings
+        self.result_cache = ResultCache.from_env()
+        # limits how many heavy handlers run at once
+        self.scheduler = Scheduler.from_env("PDF", SCHEDULER_LIMITS, SCHEDULER_PRIORITIES, SCHEDULER_MAX_ACTIVE)
+        # files too large for a single message, sent and fetched in chunks
+        self.upload_store = UploadStore.from_env()
+        # requests in progress per session, cancelled when the client disconnects or stops waiting
+        self.cancel_registry = CancelRegistry()
+
+    def lookup(self, event, data):
+        """
+        Looks a request up in the result cache. Hashes the file, so the ASGI app calls it in a thread.
+        Returns:
+            Tuple (cache_key, cached response); the key is None if the response is not cached, the response None on a miss.
+        """
+        params = handlers.cache_params(event, data)
+        if params is None:
+            return None, None
+        cache_key = self.result_cache.key(event, handlers.content_hash(data), params)
+        return cache_key, self.result_cache.get(event, cache_key)
+
+    def store(self, event, cache_key, response, metrics_event=None):
+        """
+        Counts the pages of a handler response and stores it in the result cache.
+        Args:
+            event: Name of the event that produced the response.
+            cache_key: Key from lookup, None if the response is not cached.
+            response: The response of the handler.
+            metrics_event: Event the pages are counted for, defaults to event.
+        Returns:
+            The response.
+        """
+        metrics.pages.inc(response.get("pageCount", 0), event=metrics_event or event)
+        if cache_key is not None:
+            self.result_cache.put(cache_key, response)
+        return response
+
+    def sharded(self, event, data):
+        """
+        Whether a request is an extraction of a document large enough to be page-sharded across the process pool
+        (see extraction.use_parallel); it then runs in a thread that spreads the page ranges over the pool,
+        instead of in one worker process. Profiled requests are not sharded (see Trace.profiling).
+        """
+        if event != "annotationsExtract" or extraction.PARALLEL_WORKERS <= 1 or data.get("profile"):
+            return False
+        return extraction.use_parallel(handlers.page_count(data))
+
+    def error_response(self, event, error):
+        """
+        Returns the response of a request that raised: the overloaded or cancelled response,
+        or the error message for any other exception.
+        """
+        if isinstance(error, (Overloaded, Cancelled)):
+            self.logger.warning(f"{type(error).__name__} {event}: {error}")
+            return error.response()
+        self.logger.error(f"[{event}] Error: {error}")
+        return {"success": False, "message": "error: " + str(error)}
+
+    def batch(self, batch_event, data):
+        """
+        Starts a batch event.
+        Returns:
+            The Batch of the request data.
+        Raises:
+            ValueError if the batch has no items.
+        """
+        return Batch(self, batch_event, data)
+
+    def connected(self, sid, environ=None, auth=None):
+        self.logger.info(f"Connection established with {sid}")
+
+    def disconnected(self, sid, reason=None):
+        """
+        Cancels the requests of a closed session that are still in progress.
+        """
+        cancelled = self.cancel_registry.cancel(sid)
+        if cancelled:
+            self.logger.info(f"Connection with {sid} closed, cancelled {cancelled} requests")
+
+    def hello(self, sid, data=None):
+        """
+        Answers the generic 'call' event for testing connectivity.
+        """
+        self.logger.info(f"Received call: {data} from {sid}")
+        return {"success": True, "data": "Hello World!"}
+
+    def test(self, sid, data):
+        """
+        Answers the 'test' event by opening the PDF file of the request for reading.
+        """
+        self.logger.info(f"Received test call from {sid}")
+        try:
+            pymupdf.open(stream=data["file"]).close()
+            return {"success": True, "message": "PDF read successfully"}
+        except Exception as e:
+            return self.error_response("test", e)
+
+    def upload(self, event, sid, data):
+        """
+        Answers an event of the chunked upload protocol:
+        uploadBegin ("size", "hash", optional "uploadId" to resume) returns the "uploadId" and the bytes "received";
+        uploadChunk ("uploadId", "offset", "data") returns the bytes "received";
+        uploadCommit ("uploadId") verifies size and hash, other events can then name the file by "uploadId";
+        uploadFetch ("uploadId", "offset", "length") reads a chunk of an upload or of a result returned by "uploadId";
+        uploadDelete ("uploadId") removes an upload or a result once it is no longer needed.
+        """
+        store = self.upload_store
+        try:
+            match event:
+                case "uploadBegin":
+                    return {"success": True, "data": store.begin(data["size"], data["hash"], data.get("uploadId"))}
+                case "uploadChunk":
+                    return {"success": True, "data": store.chunk(data["uploadId"], data["offset"], data["data"])}
+                case "uploadCommit":
+                    return {"success": True, "data": store.commit(data["uploadId"])}
+                case "uploadFetch":
+                    return {"success": True, "data": store.fetch(data["uploadId"], data.get("offset", 0), data.get("length"))}
+                case "uploadDelete":
+                    store.delete(data["uploadId"])
+                    return {"success": True, "message": "Upload deleted."}
+            raise ValueError(f"Unknown upload event '{event}'")
+        except Exception as e:
+            return self.error_response(event, e)
+
+    def stats(self, event, sid=None, data=None):
+        """
+        Answers cacheStats (hit/miss counters of the result cache per event and its size)
+        and schedulerStats (running and waiting requests and the counters per event).
+        """
+        match event:
+            case "cacheStats":
+                return {"success": True, "data": self.result_cache.get_stats()}
+            case "schedulerStats":
+                return {"success": True, "data": self.scheduler.get_stats()}
+        return {"success": False, "message": f"error: unknown event '{event}'"}
+
+
+class Batch:
+    """
+    Progress of a batch event: the request data of its items, the batchProgress messages sent so far
+    ({"batchId", "index", "id", "done", "total"} plus the response of the item) and the summary returned at the end.
+    """
+
+    def __init__(self, service, batch_event, data):
+        """
+        Args:
+            service: The PdfService.
+            batch_event: Name of the batch event.
+            data: Request data of the batch (see handlers.batch_items).
+        """
+        self.service = service
+        self.batch_event = batch_event
+        self.event = BATCH_EVENTS[batch_event]
+        self.handler = WORKER_HANDLERS[self.event]
+        self.data = data
+        self.items = handlers.batch_items(data)
+        self.progress = []
+
+    def report(self, index, response):
+        """
+        Records a finished item.
+        Args:
+            index: Position of the item in the batch.
+            response: Response of the item, or the exception it raised.
+        Returns:
+            The batchProgress message to send.
+        """
+        message = handlers.batch_progress(self.data, index, self.items[index], response, len(self.progress) + 1, len(self.items))
+        self.progress.append(message)
+        return message
+
+    def done(self, index, cache_key, outcome, token):
+        """
+        Records an item that ran in the process pool: its response is counted and cached,
+        a cancelled item is reported with the reason of the token, any other error with its message.
+        Args:
+            index: Position of the item in the batch.
+            cache_key: Key from PdfService.lookup.
+            outcome: Response of the handler, or the exception it raised.
+            token: CancelToken of the batch.
+        Returns:
+            The batchProgress message to send.
+        """
+        if isinstance(outcome, (Cancelled, CancelledError, asyncio.CancelledError)):
+            outcome = token.error() or Cancelled("request cancelled")
+        elif isinstance(outcome, BaseException):
+            self.service.logger.error(f"[{self.batch_event}] Item {index} failed: {outcome}")
+        else:
+            outcome = self.service.store(self.event, cache_key, outcome, self.batch_event)
+        return self.report(index, outcome)
+
+    def summary(self):
+        """
+        Returns the response of the batch event, see handlers.batch_summary.
+        """
+        return handlers.batch_summary(self.data, self.progress)
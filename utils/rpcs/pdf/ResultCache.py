@@ -0,0 +1,172 @@
+import hashlib
+import json
+import logging
+import os
+import pickle
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger('gunicorn.error')
+
+
+class ResultCache:
+    """
+    Cache for handler responses, keyed by the content hash of the PDF file plus the event and its request parameters.
+
+    Responses are kept pickled in an in-memory LRU that is bounded by their size in bytes.
+    If a spill directory is configured, entries evicted from memory are written there
+    (bounded by size as well, oldest first out) and promoted back to memory on the next hit.
+    """
+
+    def __init__(self, max_bytes, spill_dir=None, spill_max_bytes=0):
+        """
+        Args:
+            max_bytes: Maximum size of all pickled responses in memory, 0 disables the cache.
+            spill_dir: Optional directory for entries evicted from memory.
+            spill_max_bytes: Maximum size of the spill directory.
+        """
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir
+        self.spill_max_bytes = spill_max_bytes
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # key -> pickled response, least recently used first
+        self.bytes = 0
+        self.spilled = OrderedDict()  # key -> size of the spilled file, oldest first
+        self.spilled_bytes = 0
+        self.stats = {}  # event -> {"hits": ..., "misses": ...}
+
+        if self.spill_dir:
+            os.makedirs(self.spill_dir, exist_ok=True)
+            files = [f for f in os.scandir(self.spill_dir) if f.name.endswith(".pkl")]
+            for f in sorted(files, key=lambda f: f.stat().st_mtime):
+                self.spilled[f.name[:-len(".pkl")]] = f.stat().st_size
+                self.spilled_bytes += f.stat().st_size
+
+    @classmethod
+    def from_env(cls):
+        """
+        Creates the cache from PDF_CACHE_MAX_BYTES (default 256 MB), PDF_CACHE_DIR and PDF_CACHE_DIR_MAX_BYTES (default 2 GB).
+        """
+        return cls(
+            max_bytes=int(os.environ.get("PDF_CACHE_MAX_BYTES", 256 * 1024 * 1024)),
+            spill_dir=os.environ.get("PDF_CACHE_DIR") or None,
+            spill_max_bytes=int(os.environ.get("PDF_CACHE_DIR_MAX_BYTES", 2 * 1024 * 1024 * 1024)),
+        )
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    @staticmethod
+    def key(event, file_hash, params=None):
+        """
+        Builds the cache key of a request.
+        The document hash sent by the backend identifies the document, not its content,
+        so the key uses a hash of the file bytes itself.
+        Args:
+            event: Name of the Socket.IO event.
+            file_hash: SHA-256 hex digest of the PDF file.
+            params: JSON-serializable request parameters that influence the response.
+        Returns:
+            Hex digest identifying the request.
+        """
+        digest = hashlib.sha256()
+        digest.update(event.encode())
+        digest.update(file_hash.encode())
+        digest.update(json.dumps(params, sort_keys=True, default=str).encode())
+        return digest.hexdigest()
+
+    def _count(self, event, outcome):
+        counters = self.stats.setdefault(event, {"hits": 0, "misses": 0})
+        counters[outcome] += 1
+
+    def _spill_path(self, key):
+        return os.path.join(self.spill_dir, key + ".pkl")
+
+    def get(self, event, key):
+        """
+        Returns the cached response for a key, or None.
+        Args:
+            event: Name of the Socket.IO event, for the hit/miss counters.
+            key: Cache key, see key.
+        """
+        if not self.enabled:
+            return None
+        with self.lock:
+            blob = self.entries.get(key)
+            if blob is not None:
+                self.entries.move_to_end(key)
+            elif key in self.spilled:
+                try:
+                    with open(self._spill_path(key), "rb") as f:
+                        blob = f.read()
+                except OSError:
+                    blob = None
+                self._drop_spilled(key)
+                if blob is not None:
+                    self._store(key, blob)
+            self._count(event, "hits" if blob is not None else "misses")
+        return pickle.loads(blob) if blob is not None else None
+
+    def put(self, key, response):
+        """
+        Stores a response. Responses larger than the whole cache are not stored.
+        """
+        if not self.enabled:
+            return
+        blob = pickle.dumps(response, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(blob) > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.bytes -= len(self.entries.pop(key))
+            self._store(key, blob)
+
+    def _store(self, key, blob):
+        self.entries[key] = blob
+        self.bytes += len(blob)
+        while self.bytes > self.max_bytes and self.entries:
+            evicted_key, evicted = self.entries.popitem(last=False)
+            self.bytes -= len(evicted)
+            self._spill(evicted_key, evicted)
+
+    def _spill(self, key, blob):
+        if not self.spill_dir or len(blob) > self.spill_max_bytes:
+            return
+        try:
+            with open(self._spill_path(key), "wb") as f:
+                f.write(blob)
+        except OSError as e:
+            logger.warning(f"Could not spill cache entry {key}: {e}")
+            return
+        self._drop_spilled(key)
+        self.spilled[key] = len(blob)
+        self.spilled_bytes += len(blob)
+        while self.spilled_bytes > self.spill_max_bytes and self.spilled:
+            oldest = next(iter(self.spilled))
+            self._drop_spilled(oldest)
+            try:
+                os.remove(self._spill_path(oldest))
+            except OSError:
+                pass
+
+    def _drop_spilled(self, key):
+        size = self.spilled.pop(key, None)
+        if size is not None:
+            self.spilled_bytes -= size
+
+    def get_stats(self):
+        """
+        Returns hit/miss counters per event and the current size of the cache.
+        """
+        with self.lock:
+            return {
+                "events": {event: dict(counters) for event, counters in self.stats.items()},
+                "hits": sum(c["hits"] for c in self.stats.values()),
+                "misses": sum(c["misses"] for c in self.stats.values()),
+                "entries": len(self.entries),
+                "bytes": self.bytes,
+                "maxBytes": self.max_bytes,
+                "spilledEntries": len(self.spilled),
+                "spilledBytes": self.spilled_bytes,
+            }
@@ -0,0 +1,176 @@
+import hashlib
+import mmap
+import os
+import re
+import tempfile
+import uuid
+
+# Directory of the volume shared with the backend, file references are resolved relative to it
+SHARED_DIR = os.environ.get("PDF_SHARED_DIR", "/files")
+# Spool directory of files sent in chunks (see UploadStore)
+UPLOAD_DIR = os.environ.get("PDF_UPLOAD_DIR", os.path.join(tempfile.gettempdir(), "care-uploads"))
+
+_upload_id_pattern = re.compile(r"^[0-9a-f]{32}$")
+
+
+def file_digest(path):
+    """
+    Computes the SHA-256 hex digest of a file through a read-only memory map, without reading it into memory.
+    Args:
+        path: Path of the file.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size > 0:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                digest.update(m)
+    return digest.hexdigest()
+
+
+class SharedFile:
+    """
+    A PDF file on the volume shared with the backend.
+
+    Instead of the file bytes ("file"), a request can name the file by its path relative to the shared directory
+    and its SHA-256 hash ({"fileRef": {"path": ..., "hash": ...}}); results are then written to a sibling file
+    (or to the "output" path of the reference, which must not exist unless "overwrite" is set)
+    and returned as a reference of the same shape, so the document never crosses the socket.
+    A request can also name a committed chunked upload ({"uploadId": ...}), see UploadedFile.
+    """
+
+    def __init__(self, path, hash=None, base_dir=None):
+        """
+        Args:
+            path: Path of the file relative to the shared directory.
+            hash: Expected SHA-256 hex digest of the file, verified by verify (optional).
+            base_dir: Shared directory, defaults to PDF_SHARED_DIR.
+        """
+        self.base_dir = os.path.realpath(base_dir or SHARED_DIR)
+        self.path = self.resolve(path)
+        self.hash = hash
+
+    @classmethod
+    def from_request(cls, data):
+        """
+        Returns the shared file named by the "fileRef" of a request, or None if the file is sent inline.
+        Args:
+            data: Request data.
+        """
+        ref = data.get("fileRef")
+        if ref:
+            return cls(ref["path"], ref.get("hash"))
+        if data.get("uploadId"):
+            return UploadedFile(data["uploadId"])
+        return None
+
+    def resolve(self, path):
+        """
+        Resolves a path relative to the shared directory, rejecting paths (or symlinks) that lead outside of it.
+        Args:
+            path: Relative path.
+        Returns:
+            The absolute path.
+        """
+        if not isinstance(path, str) or not path or os.path.isabs(path):
+            raise ValueError(f"Invalid file reference '{path}'")
+        full_path = os.path.realpath(os.path.join(self.base_dir, path))
+        if os.path.commonpath([full_path, self.base_dir]) != self.base_dir or full_path == self.base_dir:
+            raise ValueError(f"File reference '{path}' is outside of the shared directory")
+        return full_path
+
+    def verify(self):
+        """
+        Checks the file against the hash of the reference.
+        Returns:
+            The SHA-256 hex digest of the file.
+        Raises:
+            ValueError if the file does not match the hash.
+        """
+        digest = file_digest(self.path)
+        if self.hash and self.hash.lower() != digest:
+            raise ValueError("File reference hash does not match the file")
+        self.hash = digest
+        return digest
+
+    def output_path(self, name=None, overwrite=False):
+        """
+        Returns the path for the result file, next to the input file unless the request names one.
+        Args:
+            name: Optional path of the result relative to the shared directory.
+            overwrite: Whether the named result may be an existing file.
+        Raises:
+            ValueError if the named result is the input file, or exists and overwrite is not set.
+        """
+        if name:
+            path = self.resolve(name)
+            if path == self.path:
+                raise ValueError("The output file cannot be the input file")
+            if os.path.exists(path) and not overwrite:
+                raise ValueError(f"Output file '{name}' already exists")
+            return path
+        stem = os.path.splitext(os.path.basename(self.path))[0]
+        return os.path.join(os.path.dirname(self.path), f"{stem}.{uuid.uuid4().hex}.pdf")
+
+    def ref(self, path=None):
+        """
+        Returns the reference sent back for a file in the shared directory.
+        Args:
+            path: Absolute path of the file, defaults to this file.
+        Returns:
+            Dict with the "path" relative to the shared directory, the "hash" and the "size" of the file.
+        """
+        path = path or self.path
+        return {
+            "path": os.path.relpath(path, self.base_dir),
+            "hash": file_digest(path) if path != self.path or not self.hash else self.hash,
+            "size": os.path.getsize(path),
+        }
+
+
+def check_upload_id(upload_id):
+    """
+    Validates an upload ID, which becomes part of a file name in the spool directory.
+    """
+    if not isinstance(upload_id, str) or not _upload_id_pattern.match(upload_id):
+        raise ValueError(f"Invalid upload ID '{upload_id}'")
+    return upload_id
+
+
+def new_upload_id():
+    return uuid.uuid4().hex
+
+
+class UploadedFile(SharedFile):
+    """
+    A committed chunked upload in the spool directory, named in a request by its "uploadId".
+    Results are spooled as new uploads and returned as {"uploadId", "hash", "size"}, to be fetched in chunks.
+    """
+
+    def __init__(self, upload_id, hash=None, base_dir=None):
+        """
+        Args:
+            upload_id: ID of the committed upload.
+            hash: Expected SHA-256 hex digest of the file (optional).
+            base_dir: Spool directory, defaults to PDF_UPLOAD_DIR.
+        """
+        self.upload_id = check_upload_id(upload_id)
+        super().__init__(upload_id + ".pdf", hash, base_dir or UPLOAD_DIR)
+        if not os.path.exists(self.path):
+            raise ValueError(f"Upload '{upload_id}' does not exist or is not committed")
+        # using an upload keeps it from expiring, see UploadStore.expire
+        os.utime(self.path)
+
+    def output_path(self, name=None, overwrite=False):
+        """
+        Returns the path for the result file, a new upload in the spool directory.
+        """
+        return os.path.join(self.base_dir, new_upload_id() + ".pdf")
+
+    def ref(self, path=None):
+        """
+        Returns the reference sent back for a file in the spool directory.
+        Returns:
+            Dict with the "uploadId", the "hash" and the "size" of the file.
+        """
+        ref = super().ref(path)
+        return {"uploadId": os.path.splitext(ref.pop("path"))[0], **ref}
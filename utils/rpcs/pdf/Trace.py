@@ -0,0 +1,125 @@
+import contextvars
+import cProfile
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+# Whether requests may ask to be profiled ("profile": true), enabled per deployment
+PROFILING_ENABLED = os.environ.get("PDF_PROFILING", "").lower() in ("1", "true", "yes")
+# Number of functions in the profile summary
+PROFILE_TOP = int(os.environ.get("PDF_PROFILE_TOP", 20))
+
+_current = contextvars.ContextVar("trace", default=None)
+# cProfile and tracemalloc are process-wide, so only one request is profiled at a time
+_profile_lock = threading.Lock()
+
+
+class Trace:
+    """
+    Stage timings of a single request.
+    Nested spans are recorded under their path (e.g. "embed > anchor search"),
+    repeated spans of the same path are summed up with their count.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.stages = {}  # path -> [seconds, count], in order of first occurrence
+        self.stack = []
+
+    @contextmanager
+    def span(self, name):
+        self.stack.append(name)
+        path = " > ".join(self.stack)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.stack.pop()
+            stage = self.stages.setdefault(path, [0.0, 0])
+            stage[0] += elapsed
+            stage[1] += 1
+
+    def to_dict(self):
+        """
+        Returns the timings as sent in the "timings" key of a response.
+        """
+        return {
+            "totalMs": round((time.perf_counter() - self.start) * 1000, 3),
+            "stages": [{"stage": path, "ms": round(seconds * 1000, 3), "count": count}
+                       for path, (seconds, count) in self.stages.items()],
+        }
+
+
+@contextmanager
+def tracing():
+    """
+    Records the spans of the enclosed block (in the current thread or task) into a new Trace.
+    """
+    trace = Trace()
+    token = _current.set(trace)
+    try:
+        yield trace
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def span(name):
+    """
+    Times a stage of the current request; does nothing outside of tracing.
+    """
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+    with trace.span(name):
+        yield
+
+
+@contextmanager
+def profiling(top=PROFILE_TOP):
+    """
+    Runs the enclosed block under cProfile and tracemalloc.
+    Yields a dict that is filled afterwards with the "peakMemoryBytes" and the top "functions" by cumulative time,
+    or with an "error" if profiling is disabled or another request is being profiled.
+    The functions are those of the calling thread only, so the block must not hand its work to other threads
+    or processes (profiled extractions are not page-sharded); the peak memory is that of the whole process,
+    including requests running alongside.
+    """
+    summary = {}
+    if not PROFILING_ENABLED:
+        summary["error"] = "profiling is not enabled in this deployment"
+        yield summary
+        return
+    if not _profile_lock.acquire(blocking=False):
+        summary["error"] = "another request is being profiled"
+        yield summary
+        return
+    try:
+        tracemalloc.start()
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield summary
+        finally:
+            profiler.disable()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            stats = pstats.Stats(profiler).stats
+            functions = sorted(stats.items(), key=lambda item: item[1][3], reverse=True)[:top]
+            summary.update({
+                "scope": "calling thread; peak memory of the whole process",
+                "peakMemoryBytes": peak,
+                "functions": [{
+                    "function": f"{os.path.basename(file)}:{line}({name})",
+                    "calls": calls,
+                    "totalMs": round(total_time * 1000, 3),
+                    "cumulativeMs": round(cumulative_time * 1000, 3),
+                } for (file, line, name), (_, calls, total_time, cumulative_time, _) in functions],
+            })
+    finally:
+        _profile_lock.release()
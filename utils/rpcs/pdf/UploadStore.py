@@ -0,0 +1,185 @@
+import json
+import os
+import threading
+import time
+
+from SharedFile import UPLOAD_DIR, UploadedFile, check_upload_id, file_digest, new_upload_id
+
+
+class UploadStore:
+    """
+    Spool directory for PDF files transferred in chunks, for files too large for a single Socket.IO message.
+
+    An upload is begun with its size and SHA-256 hash, filled with chunks at increasing offsets and committed
+    once complete and verified. The state lives on disk (<id>.part, <id>.json, committed <id>.pdf),
+    so a sender that lost its connection begins again with the same ID and continues at the received offset.
+    Committed uploads (and results spooled by the handlers) are read back in chunks with fetch.
+    """
+
+    def __init__(self, directory=None, max_age=24 * 60 * 60, max_chunk=4 * 1024 * 1024):
+        """
+        Args:
+            directory: Spool directory, defaults to PDF_UPLOAD_DIR.
+            max_age: Seconds after which untouched uploads are removed.
+            max_chunk: Largest chunk accepted or returned, in bytes.
+        """
+        self.directory = os.path.realpath(directory or UPLOAD_DIR)
+        self.max_age = max_age
+        self.max_chunk = max_chunk
+        self.lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    @classmethod
+    def from_env(cls):
+        """
+        Creates the store from PDF_UPLOAD_DIR, PDF_UPLOAD_MAX_AGE (seconds, default one day)
+        and PDF_UPLOAD_MAX_CHUNK (bytes, default 4 MB).
+        """
+        return cls(
+            max_age=int(os.environ.get("PDF_UPLOAD_MAX_AGE", 24 * 60 * 60)),
+            max_chunk=int(os.environ.get("PDF_UPLOAD_MAX_CHUNK", 4 * 1024 * 1024)),
+        )
+
+    def _path(self, upload_id, extension):
+        return os.path.join(self.directory, check_upload_id(upload_id) + extension)
+
+    def _read_meta(self, upload_id):
+        try:
+            with open(self._path(upload_id, ".json")) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            raise ValueError(f"Unknown upload '{upload_id}'")
+
+    def expire(self):
+        """
+        Removes uploads and results that were not touched for max_age seconds.
+        The files of an upload (<id>.json, <id>.part, <id>.pdf and the temporary files of a result being written)
+        expire together, after the last change of any of them, so an upload in progress keeps its meta.
+        """
+        limit = time.time() - self.max_age
+        paths, last_activity = {}, {}
+        for entry in os.scandir(self.directory):
+            upload_id = entry.name.split(".", 1)[0]
+            try:
+                mtime = entry.stat().st_mtime
+            except FileNotFoundError:
+                continue
+            paths.setdefault(upload_id, []).append(entry.path)
+            last_activity[upload_id] = max(last_activity.get(upload_id, 0), mtime)
+        with self.lock:
+            for upload_id, mtime in last_activity.items():
+                if mtime >= limit:
+                    continue
+                for path in paths[upload_id]:
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+
+    def begin(self, size, hash, upload_id=None):
+        """
+        Begins an upload, or resumes it if the ID of an unfinished upload is given.
+        Args:
+            size: Size of the file in bytes.
+            hash: SHA-256 hex digest of the file.
+            upload_id: ID of an upload to resume (optional).
+        Returns:
+            Dict with the "uploadId", the number of bytes "received" so far and whether it is "committed".
+        """
+        if upload_id:
+            meta = self._read_meta(upload_id)
+            if meta["size"] != size or meta["hash"] != hash.lower():
+                raise ValueError(f"Upload '{upload_id}' was begun for a different file")
+            if os.path.exists(self._path(upload_id, ".pdf")):
+                return {"uploadId": upload_id, "received": size, "committed": True}
+            part_path = self._path(upload_id, ".part")
+            os.utime(part_path)
+            return {"uploadId": upload_id, "received": os.path.getsize(part_path), "committed": False}
+
+        if not isinstance(size, int) or size < 0 or not isinstance(hash, str):
+            raise ValueError("An upload needs the size and the SHA-256 hash of the file")
+        self.expire()
+        upload_id = new_upload_id()
+        with open(self._path(upload_id, ".json"), "w") as f:
+            json.dump({"size": size, "hash": hash.lower()}, f)
+        open(self._path(upload_id, ".part"), "wb").close()
+        return {"uploadId": upload_id, "received": 0, "committed": False}
+
+    def chunk(self, upload_id, offset, data):
+        """
+        Writes a chunk of an upload. Chunks are written in order; a chunk starting before the received offset
+        (sent again after a reconnect) overwrites the same bytes.
+        Args:
+            upload_id: ID of the upload.
+            offset: Position of the chunk in the file.
+            data: The chunk as bytes.
+        Returns:
+            Dict with the number of bytes "received".
+        """
+        meta = self._read_meta(upload_id)
+        if not isinstance(offset, int) or offset < 0:
+            raise ValueError(f"Invalid chunk offset {offset}")
+        if len(data) > self.max_chunk:
+            raise ValueError(f"Chunk of {len(data)} bytes exceeds the maximum of {self.max_chunk} bytes")
+        if offset + len(data) > meta["size"]:
+            raise ValueError("Chunk exceeds the size of the upload")
+        part_path = self._path(upload_id, ".part")
+        with self.lock:
+            received = os.path.getsize(part_path)
+            if offset > received:
+                raise ValueError(f"Chunk at offset {offset} does not continue the upload at {received}")
+            with open(part_path, "r+b") as f:
+                f.seek(offset)
+                f.write(data)
+            received = max(received, offset + len(data))
+        return {"received": received}
+
+    def commit(self, upload_id):
+        """
+        Completes an upload after checking its size and hash.
+        Returns:
+            The reference of the committed file, see UploadedFile.ref.
+        """
+        meta = self._read_meta(upload_id)
+        pdf_path = self._path(upload_id, ".pdf")
+        if not os.path.exists(pdf_path):
+            part_path = self._path(upload_id, ".part")
+            received = os.path.getsize(part_path)
+            if received != meta["size"]:
+                raise ValueError(f"Upload incomplete, received {received} of {meta['size']} bytes")
+            if file_digest(part_path) != meta["hash"]:
+                raise ValueError("Upload does not match its hash")
+            os.replace(part_path, pdf_path)
+        return UploadedFile(upload_id, meta["hash"], self.directory).ref()
+
+    def fetch(self, upload_id, offset=0, length=None):
+        """
+        Reads a chunk of a committed upload or of a spooled result.
+        Args:
+            upload_id: ID of the file.
+            offset: Position of the chunk.
+            length: Length of the chunk, at most max_chunk (default).
+        Returns:
+            Dict with the chunk as "data", the total "size" and whether the chunk reaches the end ("eof").
+        """
+        pdf_path = self._path(upload_id, ".pdf")
+        if not os.path.exists(pdf_path):
+            raise ValueError(f"Upload '{upload_id}' does not exist or is not committed")
+        length = self.max_chunk if length is None else min(length, self.max_chunk)
+        size = os.path.getsize(pdf_path)
+        # reading a file keeps it from expiring
+        os.utime(pdf_path)
+        with open(pdf_path, "rb") as f:
+            f.seek(offset)
+            data = f.read(length)
+        return {"data": data, "size": size, "eof": offset + len(data) >= size}
+
+    def delete(self, upload_id):
+        """
+        Removes an upload or a spooled result with all its files.
+        """
+        for extension in (".pdf", ".part", ".json"):
+            try:
+                os.remove(self._path(upload_id, extension))
+            except FileNotFoundError:
+                pass
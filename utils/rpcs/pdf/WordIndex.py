@@ -0,0 +1,173 @@
+import math
+import pymupdf
+
+try:
+    import numpy as np
+except ImportError:  # the batched engine is optional, words_in_quads falls back to rect_contain
+    np = None
+
+_threshold_intersection = 0.01  # if the intersection is large enough.
+_cm_per_point = 2.54 / 72.0
+
+
+def check_contain(r_word, points):
+    """
+    Checks if a word rectangle is contained in the given highlight area.
+    The area of the intersection should be large enough compared to the area of the word.
+    Args:
+        r_word: pymupdf.Rect of a single word.
+        points: List of points in the highlight area.
+    Returns:
+        bool: Whether the word is contained in the highlight area.
+    """
+    return rect_contain(r_word, pymupdf.Quad(points).rect)
+
+
+def rect_contain(r_word, r_highlight):
+    """
+    Same rule as check_contain, but for a highlight area that is already given as the bounding rectangle of its quad.
+    Args:
+        r_word: pymupdf.Rect of a single word.
+        r_highlight: pymupdf.Rect of the highlight quad (left untouched).
+    Returns:
+        bool: Whether the word is contained in the highlight area.
+    """
+    r = pymupdf.Rect(r_highlight)
+    r.intersect(r_word)
+    return r.get_area("cm") >= r_word.get_area("cm") * _threshold_intersection
+
+
+class WordIndex:
+    """
+    Spatial index (uniform grid) over the words of a single page.
+
+    The index is built once per page from page.get_text("words") and queried once per highlight quad,
+    so only the words in the grid cells overlapping a quad are checked instead of every word on the page.
+    If NumPy is available, the word boxes are also kept as an (N,4) array, so all quads of an annotation
+    can be checked against all words in a single vectorized pass (see words_in_quads).
+    """
+
+    def __init__(self, words, cell_size=None):
+        """
+        Args:
+            words: List of words as returned by page.get_text("words").
+            cell_size: Edge length of a grid cell in points, derived from the median word height if not given.
+        """
+        self.words = words
+        self.rects = [pymupdf.Rect(w[:4]) for w in words]
+        self.cell_size = cell_size or self._default_cell_size(self.rects)
+        self.cells = {}
+        # words without area pass the containment rule for every quad, so they are always candidates
+        self.always = []
+
+        for idx, rect in enumerate(self.rects):
+            if rect.is_empty:
+                self.always.append(idx)
+                continue
+            for cell in self._cells(rect):
+                self.cells.setdefault(cell, []).append(idx)
+
+        self.boxes = None
+        if np is not None:
+            self.boxes = np.array([w[:4] for w in words], dtype=np.float64).reshape(-1, 4)
+            # pymupdf intersects rectangles in single precision (mupdf fz_rect), the word area uses the original values
+            self.boxes_f32 = self.boxes.astype(np.float32).astype(np.float64)
+            widths = np.maximum(0, self.boxes[:, 2] - self.boxes[:, 0])
+            heights = np.maximum(0, self.boxes[:, 3] - self.boxes[:, 1])
+            self.min_areas = (_cm_per_point ** 2) * widths * heights * _threshold_intersection
+
+    @staticmethod
+    def _default_cell_size(rects):
+        """
+        Uses twice the median word height, so a word usually spans one or two cells.
+        """
+        heights = sorted(r.height for r in rects if not r.is_empty)
+        if not heights:
+            return 20.0
+        return max(heights[len(heights) // 2] * 2, 1.0)
+
+    def _cell_range(self, rect):
+        size = self.cell_size
+        return (math.floor(rect.x0 / size), math.floor(rect.y0 / size),
+                math.floor(rect.x1 / size), math.floor(rect.y1 / size))
+
+    def _cells(self, rect):
+        cx0, cy0, cx1, cy1 = self._cell_range(rect)
+        for cx in range(cx0, cx1 + 1):
+            for cy in range(cy0, cy1 + 1):
+                yield cx, cy
+
+    def candidates(self, rect):
+        """
+        Returns the indices of all words that may overlap the given rectangle, in page order.
+        Args:
+            rect: pymupdf.Rect to query.
+        Returns:
+            Sorted list of word indices.
+        """
+        if rect.is_empty:
+            return list(self.always)
+
+        cx0, cy0, cx1, cy1 = self._cell_range(rect)
+        if (cx1 - cx0 + 1) * (cy1 - cy0 + 1) > len(self.cells):
+            # the query covers more cells than are occupied, scanning all words is cheaper
+            return list(range(len(self.words)))
+
+        found = set(self.always)
+        for cell in self._cells(rect):
+            found.update(self.cells.get(cell, ()))
+        return sorted(found)
+
+    def words_in_quad(self, points):
+        """
+        Returns the words contained in a single highlight quad, in page order.
+        Args:
+            points: List of the four points of the quad.
+        Returns:
+            List of words (same tuples as in page.get_text("words")).
+        """
+        r_highlight = pymupdf.Quad(points).rect
+        return [
+            self.words[idx] for idx in self.candidates(r_highlight)
+            if rect_contain(self.rects[idx], r_highlight)
+        ]
+
+    def words_in_quads(self, quads):
+        """
+        Returns the words contained in each of the given highlight quads, in page order.
+        Uses one vectorized pass over all word boxes and quads if NumPy is available,
+        otherwise queries words_in_quad for every quad.
+        Args:
+            quads: List of quads, each given as a list of its four points.
+        Returns:
+            List with one list of words per quad.
+        """
+        if self.boxes is None or not quads:
+            return [self.words_in_quad(points) for points in quads]
+
+        highlights = np.array([tuple(pymupdf.Quad(points).rect) for points in quads], dtype=np.float64)
+        highlights = highlights.astype(np.float32).astype(np.float64)
+        words = self.boxes_f32
+
+        # intersection of every quad (rows) with every word (columns), empty intersections have zero area
+        widths = np.maximum(0, np.minimum(highlights[:, None, 2], words[None, :, 2])
+                            - np.maximum(highlights[:, None, 0], words[None, :, 0]))
+        heights = np.maximum(0, np.minimum(highlights[:, None, 3], words[None, :, 3])
+                             - np.maximum(highlights[:, None, 1], words[None, :, 1]))
+        contained = (_cm_per_point ** 2) * widths * heights >= self.min_areas[None, :]
+
+        return [[self.words[idx] for idx in np.flatnonzero(row)] for row in contained]
+
+    def first_intersecting(self, rect):
+        """
+        Returns the first word in reading order that intersects the given rectangle.
+        The candidates from the grid are already sorted by word index, i.e. in reading order.
+        Args:
+            rect: pymupdf.Rect to query.
+        Returns:
+            Index of the word in the word list, or None if no word intersects the rectangle.
+        """
+        for idx in self.candidates(rect):
+            if self.rects[idx].intersects(rect):
+                return idx
+        return None
@@ -0,0 +1,13 @@
+"""
+Benchmarks of the PDF RPC handlers on a synthetic corpus.
+
+The corpus (see corpus.py) is generated with pymupdf over a grid of page counts, words per page,
+highlight densities, single- or multi-line highlights and $$care-grouped or foreign annotations.
+Every case times annotationsExtract, embedAnnotations and deleteAllAnnotations in-process and through
+a Socket.IO client, each in a fresh process, and records the wall time, the peak RSS and the output size.
+
+Run from utils/rpcs/pdf:
+
+    python -m benchmarks run --grid quick --output results.json
+    python -m benchmarks compare baseline.json results.json
+"""
@@ -0,0 +1,121 @@
+import argparse
+import datetime
+import json
+import logging
+import os
+import platform
+import sys
+import tempfile
+
+import pymupdf
+
+from .compare import compare, format_report, load
+from .corpus import GRIDS, case_id, grid_cases, write_corpus
+from .runner import EVENTS, MODES, run_case, run_isolated
+
+
+def _values(text, type):
+    return [type(value) for value in text.split(",")]
+
+
+def _flag(value):
+    return value.lower() in ("1", "true", "yes", "multi")
+
+
+def run(args):
+    grid = dict(GRIDS[args.grid])
+    for name, type in (("pages", int), ("words", int), ("density", float), ("multiline", _flag), ("grouping", str)):
+        if getattr(args, name):
+            grid[name] = _values(getattr(args, name), type)
+    cases = grid_cases(grid, args.seed)
+    events = _values(args.events, str) if args.events else EVENTS
+    modes = _values(args.modes, str) if args.modes else MODES
+
+    print(f"Generating {len(cases)} case(s) in {args.corpus}", file=sys.stderr)
+    corpus = write_corpus(cases, args.corpus)
+
+    if not args.isolate:
+        logging.disable(logging.CRITICAL)
+    results = []
+    for case in cases:
+        for event in events:
+            for mode in modes:
+                arguments = (case, corpus[case_id(case)], event, mode, args.repeat, args.url, args.timeout)
+                try:
+                    result = run_isolated(*arguments) if args.isolate else run_case(*arguments)
+                except Exception as e:
+                    result = {"id": f"{case_id(case)}/{event}/{mode}", "case": case, "event": event, "mode": mode,
+                              "success": False, "message": str(e).strip().splitlines()[-1]}
+                results.append(result)
+                if result["success"]:
+                    print(f"{result['id']:<60} {result['wallMs']['median']:>10.1f} ms {result['peakRssKb'] - result['baseRssKb']:>8} kB",
+                          file=sys.stderr)
+                else:
+                    print(f"{result['id']:<60} failed: {result['message']}", file=sys.stderr)
+
+    output = {
+        "meta": {
+            "created": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "pymupdf": pymupdf.__version__,
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "grid": grid,
+            "repeat": args.repeat,
+            "isolated": args.isolate,
+            "url": args.url,
+        },
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(output, f, indent=2)
+    print(f"Wrote {len(results)} result(s) to {args.output}", file=sys.stderr)
+    return 0 if all(result["success"] for result in results) else 1
+
+
+def run_compare(args):
+    rows = compare(load(args.baseline), load(args.results), args.threshold, args.rss_threshold)
+    print(format_report(rows, args.only_regressions))
+    return 1 if any(row["regression"] for row in rows) else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description="Benchmarks of the PDF RPC handlers.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="generate the corpus and time the events")
+    run_parser.add_argument("--grid", choices=sorted(GRIDS), default="quick", help="parameter grid (default: quick)")
+    run_parser.add_argument("--pages", help="comma-separated page counts, overrides the grid")
+    run_parser.add_argument("--words", help="comma-separated words per page, overrides the grid")
+    run_parser.add_argument("--density", help="comma-separated fractions of highlighted words, overrides the grid")
+    run_parser.add_argument("--multiline", help="comma-separated true/false for multi-line highlights, overrides the grid")
+    run_parser.add_argument("--grouping", help="comma-separated care/foreign, overrides the grid")
+    run_parser.add_argument("--seed", type=int, default=0, help="seed of the corpus")
+    run_parser.add_argument("--events", help=f"comma-separated events (default: {','.join(EVENTS)})")
+    run_parser.add_argument("--modes", help=f"comma-separated modes (default: {','.join(MODES)})")
+    run_parser.add_argument("--repeat", type=int, default=5, help="timed runs per case after a warm-up run")
+    run_parser.add_argument("--url", help="running service for the socketio mode, a local server is started otherwise")
+    run_parser.add_argument("--timeout", type=float, default=600, help="seconds to wait for a Socket.IO response")
+    run_parser.add_argument("--corpus", default=os.path.join(tempfile.gettempdir(), "care-pdf-benchmarks"),
+                            help="directory of the generated documents, reused across runs")
+    run_parser.add_argument("--no-isolate", dest="isolate", action="store_false",
+                            help="run all cases in this process (faster, but the peak RSS accumulates)")
+    run_parser.add_argument("--output", default="benchmark-results.json", help="file for the JSON results")
+    run_parser.set_defaults(function=run)
+
+    compare_parser = commands.add_parser("compare", help="compare results against a baseline")
+    compare_parser.add_argument("baseline", help="JSON results of the baseline run")
+    compare_parser.add_argument("results", help="JSON results of the current run")
+    compare_parser.add_argument("--threshold", type=float, default=0.1,
+                                help="allowed relative growth of wall time and output size (default: 0.1)")
+    compare_parser.add_argument("--rss-threshold", type=float, default=0.2,
+                                help="allowed relative growth of the peak RSS (default: 0.2)")
+    compare_parser.add_argument("--only-regressions", action="store_true", help="list only the regressions")
+    compare_parser.set_defaults(function=run_compare)
+
+    args = parser.parse_args()
+    return args.function(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,83 @@
+import json
+
+# Metrics compared against the baseline: (name in the report, how to read it from a result, noise floor)
+METRICS = [
+    ("wallMs", lambda result: result["wallMs"]["median"], 2.0),
+    ("peakRssKb", lambda result: result["peakRssKb"] - result["baseRssKb"], 4096),
+    ("outputBytes", lambda result: result["outputBytes"], 0),
+]
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare(baseline, current, threshold=0.1, rss_threshold=0.2):
+    """
+    Compares benchmark results against a baseline run.
+    A metric regresses if it grew by more than the threshold (relative) and by more than its noise floor (absolute);
+    the RSS is compared as the growth over the process baseline, since the import footprint dominates small cases.
+    Args:
+        baseline: Results of the baseline run, as written by the run command.
+        current: Results of the current run.
+        threshold: Allowed relative growth of the wall time and the output size.
+        rss_threshold: Allowed relative growth of the peak RSS.
+    Returns:
+        List of report rows {"id", "metric", "baseline", "current", "change", "regression"},
+        plus rows with metric "missing" or "failed" for cases that did not produce a result.
+    """
+    baseline_results = {result["id"]: result for result in baseline["results"]}
+    rows = []
+    for result in current["results"]:
+        base = baseline_results.get(result["id"])
+        if base is None:
+            continue
+        if not result.get("success", True) and base.get("success", True):
+            rows.append({"id": result["id"], "metric": "failed", "baseline": None, "current": result.get("message"),
+                         "change": None, "regression": True})
+            continue
+        for name, value, noise in METRICS:
+            before, after = value(base), value(result)
+            if before is None or after is None:
+                continue
+            change = (after - before) / before if before else 0.0
+            allowed = rss_threshold if name == "peakRssKb" else threshold
+            rows.append({
+                "id": result["id"],
+                "metric": name,
+                "baseline": before,
+                "current": after,
+                "change": round(change, 4),
+                "regression": change > allowed and after - before > noise,
+            })
+    current_ids = {result["id"] for result in current["results"]}
+    for result_id in baseline_results:
+        if result_id not in current_ids:
+            rows.append({"id": result_id, "metric": "missing", "baseline": None, "current": None,
+                         "change": None, "regression": False})
+    return rows
+
+
+def format_report(rows, only_regressions=False):
+    """
+    Formats the report rows as a text table, regressions marked with "!".
+    """
+    lines = [f"  {'case / event / mode':<60} {'metric':<12} {'baseline':>12} {'current':>12} {'change':>8}"]
+    for row in rows:
+        if only_regressions and not row["regression"]:
+            continue
+        change = "" if row["change"] is None else f"{row['change']:+.1%}"
+        lines.append(f"{'!' if row['regression'] else ' '} {row['id']:<60} {row['metric']:<12} "
+                     f"{_format_value(row['baseline']):>12} {_format_value(row['current']):>12} {change:>8}")
+    regressions = sum(row["regression"] for row in rows)
+    lines.append(f"{regressions} regression(s) in {len({row['id'] for row in rows})} result(s)")
+    return "\n".join(lines)
+
+
+def _format_value(value):
+    if value is None:
+        return "-"
+    if isinstance(value, float):
+        return f"{value:.2f}"
+    return str(value)
@@ -0,0 +1,211 @@
+import itertools
+import json
+import os
+import random
+
+import pymupdf
+
+# Parameter grids of the benchmark cases, every combination of the values is one case
+GRIDS = {
+    "quick": {
+        "pages": [1, 10],
+        "words": [300],
+        "density": [0.05],
+        "multiline": [False, True],
+        "grouping": ["care", "foreign"],
+    },
+    "full": {
+        "pages": [1, 10, 50, 200],
+        "words": [200, 800],
+        "density": [0.01, 0.05, 0.2],
+        "multiline": [False, True],
+        "grouping": ["care", "foreign"],
+    },
+}
+
+PAGE_RECT = pymupdf.Rect(50, 50, 550, 800)
+FONT = "helv"
+SYLLABLES = "ka lo mi ne ru sa te vo zi ban cor del fin gar hol mur pen rat sol tin".split()
+
+
+def case_id(case):
+    """
+    Returns the name of a case, e.g. "p10-w300-d0.05-multi-care", used for its corpus files and results.
+    """
+    return "p{pages}-w{words}-d{density}-{lines}-{grouping}".format(
+        lines="multi" if case["multiline"] else "single", **case)
+
+
+def grid_cases(grid, seed=0):
+    """
+    Expands a parameter grid into its cases.
+    Args:
+        grid: Dict of parameter name to list of values, see GRIDS.
+        seed: Seed of the generated text and highlights.
+    Returns:
+        List of case dicts.
+    """
+    names = ["pages", "words", "density", "multiline", "grouping"]
+    return [dict(zip(names, values), seed=seed) for values in itertools.product(*(grid[name] for name in names))]
+
+
+def _layout(page, words):
+    """
+    Writes the words line by line into the page rectangle, with the largest font size that fits all of them.
+    """
+    for fontsize in range(11, 3, -1):
+        # leading wide enough that the word boxes of neighbouring lines do not overlap
+        line_height = fontsize * 1.6
+        space = pymupdf.get_text_length(" ", fontname=FONT, fontsize=fontsize)
+        lines, line, width = [], [], 0
+        for word in words:
+            word_width = pymupdf.get_text_length(word, fontname=FONT, fontsize=fontsize)
+            if line and width + space + word_width > PAGE_RECT.width:
+                lines.append(line)
+                line, width = [], 0
+            width += (space if line else 0) + word_width
+            line.append(word)
+        lines.append(line)
+        if len(lines) * line_height <= PAGE_RECT.height:
+            break
+    for i, line in enumerate(lines):
+        page.insert_text((PAGE_RECT.x0, PAGE_RECT.y0 + (i + 1) * line_height), " ".join(line), fontname=FONT, fontsize=fontsize)
+
+
+def _spans(rng, words, case):
+    """
+    Picks the highlighted word spans of a page, non-overlapping; multi-line spans start at the end of a line.
+    Args:
+        rng: Random generator of the page.
+        words: Words of the page as returned by page.get_text("words").
+        case: The benchmark case.
+    Returns:
+        List of (start, stop) word index ranges.
+    """
+    if not case["density"] or len(words) < 2:
+        return []
+    lines = {}
+    for i, word in enumerate(words):
+        lines.setdefault(word[5:7], []).append(i)
+    lines = list(lines.values())
+    average_length = 7 if case["multiline"] else 5
+    count = max(1, round(case["density"] * len(words) / average_length))
+
+    spans, used = [], set()
+    for _ in range(count * 4):
+        if len(spans) == count:
+            break
+        if case["multiline"] and len(lines) > 1:
+            line = rng.choice(lines[:-1])
+            start = line[-rng.randint(1, min(3, len(line)))]
+            stop = min(line[-1] + 1 + rng.randint(2, 5), len(words))
+        else:
+            line = rng.choice(lines)
+            length = rng.randint(2, 8)
+            first = rng.randint(0, max(0, len(line) - length))
+            start, stop = line[first], line[min(first + length, len(line)) - 1] + 1
+        if used.isdisjoint(range(start, stop)):
+            used.update(range(start, stop))
+            spans.append((start, stop))
+    return sorted(spans)
+
+
+def _quote(words, start, stop, context=5):
+    exact = " ".join(w[4] for w in words[start:stop])
+    prefix = " ".join(w[4] for w in words[max(0, start - context):start])
+    suffix = " ".join(w[4] for w in words[stop:stop + context])
+    return exact, prefix + " " if prefix else "", " " + suffix if suffix else ""
+
+
+def _highlight(page, words, start, stop, subject, comment, grouping):
+    """
+    Adds the annotations of a span: for CARE grouping one highlight per line and a comment that share a $$ subject
+    (as the extraction sees them after editing in CARE), otherwise one multi-quad highlight with the comment in its content.
+    """
+    quads_by_line = {}
+    for word in words[start:stop]:
+        quads_by_line.setdefault(word[5:7], []).append(pymupdf.Rect(word[:4]).quad)
+
+    if grouping == "care":
+        for quads in quads_by_line.values():
+            annot = page.add_highlight_annot(quads=quads)
+            annot.set_info({"title": "$$bench", "subject": subject, "content": ""})
+            annot.update()
+        annot = page.add_text_annot(pymupdf.Rect(words[start][:4]).tl, comment)
+        annot.set_info({"title": "$$bench", "subject": subject, "content": comment})
+        annot.update()
+    else:
+        annot = page.add_highlight_annot(quads=[quad for quads in quads_by_line.values() for quad in quads])
+        annot.set_info({"title": "bench", "subject": "Highlight", "content": comment})
+        annot.update()
+
+
+def generate(case):
+    """
+    Generates the documents of a case.
+    Args:
+        case: Case dict with the number of pages, words per page, highlight density (fraction of highlighted words),
+            whether highlights span lines, the grouping ("care" for $$ subjects, "foreign" for other annotations) and the seed.
+    Returns:
+        Dict with the "plain" PDF, the "annotated" PDF (same text with highlights and comments),
+        and the "annotations" of the same spans as the backend sends them to embedAnnotations.
+    """
+    rng = random.Random(f"{case['seed']}-{case_id(case)}")
+    doc = pymupdf.open()
+    page_spans = []
+    for page_num in range(case["pages"]):
+        page = doc.new_page()
+        text = ["".join(rng.choices(SYLLABLES, k=rng.randint(1, 4))) for _ in range(case["words"])]
+        _layout(page, text)
+        words = page.get_text("words")
+        page_spans.append((words, _spans(rng, words, case)))
+    plain = doc.tobytes(garbage=3, deflate=True)
+
+    annotations = []
+    for page, (words, spans) in zip(doc, page_spans):
+        for i, (start, stop) in enumerate(spans):
+            comment = f"Comment {i} on page {page.number + 1}"
+            _highlight(page, words, start, stop, f"$$bench{page.number}_{i}", comment, case["grouping"])
+            exact, prefix, suffix = _quote(words, start, stop)
+            annotations.append({
+                "selectors": {"target": [{"selector": [
+                    {"type": "PagePositionSelector", "number": page.number + 1},
+                    {"type": "TextQuoteSelector", "exact": exact, "prefix": prefix, "suffix": suffix},
+                ]}]},
+                "username": "bench",
+                "tag": "Highlight",
+                "comments": [{"text": comment}],
+            })
+    annotated = doc.tobytes(garbage=3, deflate=True)
+    doc.close()
+    return {"plain": plain, "annotated": annotated, "annotations": annotations}
+
+
+def write_corpus(cases, directory):
+    """
+    Writes the documents of all cases to a directory, <id>.plain.pdf, <id>.annotated.pdf and <id>.json
+    with the annotations. Cases already in the directory are kept, the generation is deterministic.
+    Args:
+        cases: List of case dicts.
+        directory: Corpus directory.
+    Returns:
+        Dict of case id to the dict of its file paths ("plain", "annotated", "annotations").
+    """
+    os.makedirs(directory, exist_ok=True)
+    paths = {}
+    for case in cases:
+        name = f"{case_id(case)}-s{case['seed']}"
+        files = {
+            "plain": os.path.join(directory, f"{name}.plain.pdf"),
+            "annotated": os.path.join(directory, f"{name}.annotated.pdf"),
+            "annotations": os.path.join(directory, f"{name}.json"),
+        }
+        if not all(os.path.exists(path) for path in files.values()):
+            documents = generate(case)
+            for key in ("plain", "annotated"):
+                with open(files[key], "wb") as f:
+                    f.write(documents[key])
+            with open(files["annotations"], "w") as f:
+                json.dump(documents["annotations"], f)
+        paths[case_id(case)] = files
+    return paths
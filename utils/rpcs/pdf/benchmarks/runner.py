@@ -0,0 +1,188 @@
+import json
+import logging
+import multiprocessing
+import os
+import resource
+import statistics
+import sys
+import threading
+import time
+import traceback
+from socketserver import ThreadingMixIn
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+from .corpus import case_id
+
+EVENTS = ["annotationsExtract", "embedAnnotations", "deleteAllAnnotations"]
+MODES = ["inprocess", "socketio"]
+
+
+def build_request(event, files):
+    """
+    Builds the request data of an event from the corpus files of a case:
+    extraction and deletion get the annotated document, embedding the plain document and the annotations.
+    """
+    if event == "embedAnnotations":
+        with open(files["plain"], "rb") as f, open(files["annotations"]) as a:
+            return {"file": f.read(), "annotations": json.load(a)}
+    with open(files["annotated"], "rb") as f:
+        return {"file": f.read()}
+
+
+def output_size(event, response):
+    """
+    Size of the result in bytes: the JSON of the extracted annotations or the written PDF.
+    """
+    if not response.get("success"):
+        return None
+    if event == "annotationsExtract":
+        return len(json.dumps(response["data"]["annotations"]).encode())
+    if event == "deleteAllAnnotations":
+        return len(response["data"]["file"])
+    return len(response["data"])
+
+
+def peak_rss_kb():
+    """
+    Peak resident set size of this process in kB (ru_maxrss is in bytes on macOS).
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+class _ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class _QuietHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def _serve():
+    """
+    Serves the Socket.IO app of the service on a free local port in a background thread.
+    Returns:
+        Tuple (server, url).
+    """
+    import main
+    app = main.create_app()
+    logging.getLogger('gunicorn.error').setLevel(logging.WARNING)
+    server = make_server("127.0.0.1", 0, app, server_class=_ThreadingWSGIServer, handler_class=_QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+def _timed_calls(call, repeat):
+    """
+    Calls once to warm up and then repeat times.
+    Returns:
+        Tuple (last response, list of wall times in milliseconds).
+    """
+    response = call()
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        response = call()
+        runs.append((time.perf_counter() - start) * 1000)
+    return response, runs
+
+
+def run_case(case, files, event, mode, repeat, url=None, timeout=600):
+    """
+    Times one event on the documents of one case.
+    Args:
+        case: The case dict (see corpus.generate).
+        files: Corpus files of the case (see corpus.write_corpus).
+        event: Name of the Socket.IO event.
+        mode: "inprocess" to call the handler function directly, "socketio" to call the event through a Socket.IO client.
+        repeat: Number of timed runs after a warm-up run.
+        url: Service to call in socketio mode, a local server is started if None.
+        timeout: Seconds to wait for a Socket.IO response.
+    Returns:
+        Result dict with the wall times, the peak RSS and the output size.
+    """
+    # the result cache would answer the repeated runs
+    os.environ["PDF_CACHE_MAX_BYTES"] = "0"
+    data = build_request(event, files)
+    base_rss = peak_rss_kb()
+
+    if mode == "inprocess":
+        import handlers
+        handler = {
+            "annotationsExtract": handlers.extract_annotations,
+            "embedAnnotations": handlers.embed_annotations,
+            "deleteAllAnnotations": handlers.delete_all_annotations,
+        }[event]
+        response, runs = _timed_calls(lambda: handler(dict(data)), repeat)
+    else:
+        import socketio
+        server = None
+        if url is None:
+            server, url = _serve()
+        client = socketio.Client()
+        # the local WSGI server cannot upgrade to websocket
+        client.connect(url, transports=["polling"] if server else None, wait_timeout=30)
+        try:
+            response, runs = _timed_calls(lambda: client.call(event, data, timeout=timeout), repeat)
+        except socketio.exceptions.TimeoutError:
+            # the service drops messages above its size limit (1 MB by default) without an answer
+            raise TimeoutError(f"No response within {timeout}s for a request of {len(data['file'])} bytes")
+        finally:
+            client.disconnect()
+            if server:
+                server.shutdown()
+
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return {
+        "id": f"{case_id(case)}/{event}/{mode}",
+        "case": case,
+        "event": event,
+        "mode": mode,
+        "success": bool(response.get("success")),
+        "message": None if response.get("success") else response.get("message"),
+        "wallMs": {
+            "min": round(min(runs), 3),
+            "median": round(statistics.median(runs), 3),
+            "mean": round(statistics.fmean(runs), 3),
+            "runs": [round(run, 3) for run in runs],
+        },
+        "baseRssKb": base_rss,
+        "peakRssKb": peak_rss_kb(),
+        # largest worker process, e.g. of the parallel extraction
+        "peakChildRssKb": children // 1024 if sys.platform == "darwin" else children,
+        "inputBytes": len(data["file"]),
+        "outputBytes": output_size(event, response),
+    }
+
+
+def _run_child(connection, args):
+    try:
+        logging.disable(logging.CRITICAL)
+        connection.send(("ok", run_case(*args)))
+    except Exception:
+        connection.send(("error", traceback.format_exc()))
+    finally:
+        connection.close()
+
+
+def run_isolated(*args):
+    """
+    Runs run_case in a fresh process, so the peak RSS belongs to this case alone.
+    A plain (non-daemonic) process is used, the parallel extraction starts worker processes of its own.
+    Raises:
+        RuntimeError with the traceback of the child if the case failed.
+    """
+    context = multiprocessing.get_context("spawn")
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=_run_child, args=(sender, args))
+    process.start()
+    sender.close()
+    try:
+        status, result = receiver.recv()
+    except EOFError:
+        status, result = "error", f"benchmark process exited with code {process.exitcode}"
+    process.join()
+    if status != "ok":
+        raise RuntimeError(result)
+    return result
@@ -0,0 +1,257 @@
+import logging
+import math
+
+from AnchorIndex import OffsetIndex, normalize
+from Cancellation import check_cancelled
+from Trace import span
+from WordIndex import WordIndex
+
+logger = logging.getLogger('gunicorn.error')
+
+SUBJECT = "care"
+HIGHLIGHT_COLOR = (1, 1, 0)  # always yellow for highlight
+
+# "annotation": one highlight carrying the quads of all words per CARE annotation
+# "word": one highlight per word (format of older exports, still read by the extraction)
+HIGHLIGHT_MODES = ("annotation", "word")
+
+
+def parse_annotation(annot, i):
+    """
+    Reads the selectors of an annotation sent by the backend.
+    Args:
+        annot: Annotation dict with selectors, username, tag and comments.
+        i: Position of the annotation in the request, used for its $$ subject.
+    Returns:
+        Dict with the page number (one-based, None if missing), text position and quote of the annotation.
+    """
+    page_number = None
+    selectors = annot.get("selectors", {})
+    targets = selectors.get("target", [])
+    text_start = None
+    text_end = None
+    prefix = None
+    exact = None
+    suffix = None
+    if targets and isinstance(targets, list):
+        for target in targets:
+            for selector in target.get("selector", []):
+                match selector.get("type"):
+                    case "PagePositionSelector":
+                        page_number = selector.get("number")
+                    case "TextPositionSelector":
+                        text_start = selector.get("start")
+                        text_end = selector.get("end")
+                    case "TextQuoteSelector":
+                        prefix = selector.get("prefix")
+                        exact = selector.get("exact")
+                        suffix = selector.get("suffix")
+            if page_number is not None:
+                break
+    return {
+        "page_number": page_number,
+        "text_start": text_start,
+        "text_end": text_end,
+        "prefix": prefix,
+        "exact": exact,
+        "suffix": suffix,
+        "subject": "$$" + SUBJECT + str(i),
+        "username": annot.get("username", "unknown"),  # Prefix username with $$ to indicate care annotation
+        "tag": annot.get("tag"),
+        "comments": annot.get("comments", []),
+    }
+
+
+def group_by_page(annotations):
+    """
+    Parses the annotations and groups them by page, keeping the request order within each page.
+    Args:
+        annotations: List of annotation dicts from the request.
+    Returns:
+        Dict of one-based page number to the list of parsed annotations on that page, in page order.
+    """
+    pages = {}
+    for i, annot in enumerate(annotations):
+        entry = parse_annotation(annot, i)
+        if entry["page_number"] is not None:
+            pages.setdefault(entry["page_number"], []).append(entry)
+    return dict(sorted(pages.items()))
+
+
+def embed_annotations(doc, annotations, highlight_mode="annotation"):
+    """
+    Embeds annotations page by page: all annotations of a page are applied together
+    with the page's word index and character stream built only once.
+    Args:
+        doc: The pymupdf document, modified in place.
+        annotations: List of annotation dicts from the request.
+        highlight_mode: "annotation" for one multi-quad highlight per annotation, "word" for one highlight per word.
+    """
+    if highlight_mode not in HIGHLIGHT_MODES:
+        raise ValueError(f"Unknown highlight mode '{highlight_mode}'")
+
+    # character streams of the pages with document offsets, built on first use and shared by all annotations
+    offset_index = OffsetIndex(doc)
+
+    for page_number, entries in group_by_page(annotations).items():
+        check_cancelled()
+        doc_page = doc[page_number - 1]
+        with span("anchor index"):
+            anchor_index = offset_index.page(page_number - 1)
+        word_index = None
+
+        for entry in entries:
+            check_cancelled()
+            # place by the position selector if its text confirms the quote, search the quote otherwise
+            with span("anchor search"):
+                selected_rect = get_position_rect(offset_index, page_number - 1, entry["text_start"], entry["text_end"], entry["exact"])
+                if selected_rect is None:
+                    selected_rect = get_best_exact_rect(anchor_index, entry["exact"], entry["prefix"], entry["suffix"])
+
+            if selected_rect is not None and not selected_rect.is_empty:
+                if word_index is None:
+                    with span("word index"):
+                        word_index = WordIndex(doc_page.get_text("words"))
+                with span("textbox"):
+                    extracted_text = anchor_index.textbox(selected_rect)
+                with span("annotation creation"):
+                    add_comment(doc_page, (selected_rect.x0, selected_rect.y0), entry["comments"], HIGHLIGHT_COLOR, entry["tag"], entry["subject"], entry["username"])
+                    add_annotations(doc_page, word_index, selected_rect, extracted_text, entry["exact"], HIGHLIGHT_COLOR, entry["subject"], entry["username"], highlight_mode)
+            else:
+                logger.warning("No suitable rect found for annotation.")
+
+
+def get_position_rect(offset_index, page_num, text_start, text_end, exact):
+    """
+    Looks up the rectangle of a TextPositionSelector span directly in the document character offsets.
+    Args:
+        offset_index: OffsetIndex of the document.
+        page_num: Zero-based page number from the PagePositionSelector.
+        text_start: Start offset from the TextPositionSelector.
+        text_end: End offset from the TextPositionSelector.
+        exact: The exact string of the TextQuoteSelector, used to confirm the span.
+    Returns:
+        The rectangle of the first line of the span, or None if the offsets disagree with the page or the quote.
+    """
+    located = offset_index.locate(text_start, text_end)
+    if located is None or located[0] != page_num:
+        return None
+    _, anchor_index, start, end = located
+    if not exact or normalize("".join(anchor_index.chars[start:end])) != normalize(exact):
+        return None
+    rects = anchor_index.char_rects(start, end)
+    return rects[0] if rects else None
+
+
+def get_best_exact_rect(anchor_index, exact, prefix=None, suffix=None):
+    """
+    Finds the rectangle of the 'exact' string that is closest to the given prefix and suffix on the page.
+    Args:
+        anchor_index: AnchorIndex of the PDF page.
+        exact: The exact string to find.
+        prefix: Optional prefix string.
+        suffix: Optional suffix string.
+    Returns:
+        The best matching rectangle or None if not found.
+    """
+    def rect_midpoint(rect):
+        return ((rect.x0 + rect.x1) / 2, (rect.y0 + rect.y1) / 2)
+
+    def distance(p1, p2):
+        return math.sqrt((p1[0] - p2[0])**2 + (p1[1] - p2[1])**2)
+
+    prefix_rects = anchor_index.search(prefix) if prefix else []
+    exact_rects = anchor_index.search(exact)
+    suffix_rects = anchor_index.search(suffix) if suffix else []
+
+    best_rect = None
+    best_score = float('inf')
+
+    for exact_rect in exact_rects:
+        exact_mid = rect_midpoint(exact_rect)
+        prefix_dist = min((distance(rect_midpoint(p), exact_mid) for p in prefix_rects), default=0)
+        suffix_dist = min((distance(rect_midpoint(s), exact_mid) for s in suffix_rects), default=0)
+        score = prefix_dist + suffix_dist
+        if score < best_score:
+            best_score = score
+            best_rect = exact_rect
+
+    return best_rect
+
+
+def add_highlight(doc_page, quads, color, subject, name):
+    """
+    Adds a single highlight annotation, titled with the user name and grouped by subject.
+    Args:
+        quads: A rectangle, or a list of rectangles/quads that all become part of the one annotation.
+    """
+    annot = doc_page.add_highlight_annot(quads=quads)
+    annot.set_colors(stroke=color)
+    annot.set_info({"title": name, "subject": subject})
+    annot.update()
+    return annot
+
+
+def add_annotations(doc_page, word_index, selected_rect, extracted_text, original_text, color, subject, name, highlight_mode="annotation"):
+    """
+    Expands the selected rectangle forward word by word and stops after as many words as in the original_text.
+    The words are highlighted with a single annotation carrying one quad per word, or with one annotation per word in "word" mode.
+    Args:
+        doc_page: The PDF page object.
+        word_index: WordIndex over the words of the page.
+        selected_rect: The initial rectangle to start highlighting from.
+        extracted_text: The text extracted from the selected rectangle.
+        original_text: The full text to highlight.
+        color: RGB tuple for the highlight color.
+        highlight_mode: "annotation" or "word".
+    Returns:
+        A new rectangle covering the highlighted area.
+    """
+    # First, check if the selected_rect's text matches the original_text
+    if extracted_text.strip() == original_text.strip():
+        add_highlight(doc_page, selected_rect, color, subject, name)
+        return selected_rect
+
+    # The start word is the first word in reading order intersecting the selected rect
+    start = word_index.first_intersecting(selected_rect)
+    if start is None:
+        logger.warning("No additional words highlighted, returning selected_rect")
+        return selected_rect
+
+    original_text_length = len(original_text.strip().split(" ")) if original_text else 0
+    word_rects = word_index.rects[start:start + max(original_text_length, 1)]
+    if highlight_mode == "word":
+        for word_rect in word_rects:
+            # Highlight this word
+            add_highlight(doc_page, word_rect, color, subject, name)
+    else:
+        add_highlight(doc_page, word_rects, color, subject, name)
+
+    rects = [selected_rect] + word_rects
+
+    # Return the union of all collected rects
+    union_rect = rects[0]
+    for r in rects[1:]:
+        union_rect |= r
+    return union_rect
+
+
+def add_comment(doc_page, position, comments, color, textType, subject, name):
+    """
+    Adds text annotations (comments) to the PDF page at the given position.
+    Args:
+        doc_page: The PDF page object.
+        position: The (x, y) tuple or point where the comment should be placed.
+        comments: List of comment dicts, each with a 'text' key.
+        color: RGB tuple for the annotation color.
+    """
+    for comment in comments:
+        if "text" in comment:
+            if comment["text"] is not None:
+                annot_text_obj = doc_page.add_text_annot(
+                    position, textType + ": " + comment["text"],
+                    icon="Comment"  # Use a comment icon for text annotations
+                )
+                annot_text_obj.set_info({"title": name, "subject": subject})
+                annot_text_obj.set_colors(stroke=color)  # Set the color of the text annotation
+                annot_text_obj.update()  # Apply the color change
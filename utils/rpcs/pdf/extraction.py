@@ -0,0 +1,368 @@
+import logging
+import math
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context, shared_memory
+
+import pymupdf
+
+from Cancellation import attach_shared_memory, cancellation, check_cancelled
+from DocumentText import DocumentText
+from Trace import span
+from WordIndex import WordIndex
+
+logger = logging.getLogger('gunicorn.error')
+
+# Documents with at least this many pages are extracted page-sharded across worker processes
+PARALLEL_MIN_PAGES = int(os.environ.get("PDF_PARALLEL_MIN_PAGES", 100))
+# Number of worker processes for page-sharded extraction (1 disables it) and for the requests of the ASGI app
+PARALLEL_WORKERS = int(os.environ.get("PDF_PARALLEL_WORKERS", os.cpu_count() or 1))
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """
+    Returns the process pool shared by all requests, created on first use.
+    Workers are spawned instead of forked, as the server process runs many threads.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=PARALLEL_WORKERS, mp_context=get_context("spawn"))
+        return _executor
+
+
+def is_care_subject(subject):
+    """
+    Annotations created by CARE carry a subject starting with $$, all parts of one CARE annotation share it.
+    """
+    return bool(subject and subject.strip().startswith("$$"))
+
+
+def extract_comment(comment):
+    """
+    Extracts the comment text from the annotation info and removes specific prefixes.
+    Args:
+        comment: The comment string from the annotation info.
+    Returns:
+        The cleaned comment string with prefixes removed.
+    """
+    if not comment:
+        return ""
+
+    # Clean up the comment by removing extra spaces and newlines
+    cleaned_comment = ' '.join(comment.split())
+
+    # Remove specific prefixes
+    prefixes_to_remove = ["Highlight:", "Strength:", "Weakness:", "Other:"]
+
+    for prefix in prefixes_to_remove:
+        if cleaned_comment.startswith(prefix):
+            # Remove the prefix and any following whitespace
+            cleaned_comment = cleaned_comment[len(prefix):].strip()
+            break
+
+    return cleaned_comment
+
+
+def extract_annot(annot, word_index):
+    """
+    Extracts the words in a given highlight annotation.
+    Args:
+        annot: The annotation object.
+        word_index: WordIndex over the words on the page.
+    Returns:
+        String of words in the entire highlight.
+    """
+    quad_points = annot.vertices
+    if not quad_points:
+        logger.warning(f"no quad points")
+        return []
+    quad_count = int(len(quad_points) / 4)
+    quads = [quad_points[i * 4: i * 4 + 4] for i in range(quad_count)]
+    sentences = [' '.join(w[4] for w in words) for words in word_index.words_in_quads(quads)]
+    sentence = ' '.join(sentences)
+
+    return sentence
+
+
+def extract_page(page):
+    """
+    Reads the text and all annotations of a single page.
+    Args:
+        page: The pymupdf page.
+    Returns:
+        Tuple (page_text, records) with one plain dict per annotation, in page order.
+    """
+    with span("text"):
+        page_text = page.get_text()
+    records = []
+
+    annots = list(page.annots() or [])
+    # one spatial index per page, queried for every quad of every annotation
+    with span("word index"):
+        word_index = WordIndex(page.get_text("words")) if annots else None
+
+    for annot in annots:
+        check_cancelled()
+        subject = annot.info.get("subject", "default")
+        with span("annotations"):
+            record = {
+                "page": page.number,
+                "subject": subject,
+                "comment": extract_comment(annot.info.get("content", "")),
+                "text": extract_annot(annot, word_index) or "",
+            }
+        if record["text"]:
+            record.update({
+                "type": annot.type[1] if isinstance(annot.type, tuple) else annot.type,
+                "rect": list(annot.rect),
+                "color": annot.colors,
+                "annot_text": annot.get_text("text"),
+            })
+        records.append(record)
+
+    return page_text, records
+
+
+def extract_pages(doc, start=0, stop=None):
+    """
+    Runs extract_page for a range of pages.
+    Args:
+        doc: The pymupdf document.
+        start: First page number.
+        stop: Page number after the last page, defaults to the page count.
+    Returns:
+        Tuple (page_texts, records) for the whole range, in page order.
+    """
+    page_texts = []
+    records = []
+    for page_num in range(start, len(doc) if stop is None else stop):
+        check_cancelled()
+        page_text, page_records = extract_page(doc[page_num])
+        page_texts.append(page_text)
+        records.extend(page_records)
+    return page_texts, records
+
+
+def group_annotations(records, doc_text):
+    """
+    Builds the annotation list from the extracted records, grouping all records of a CARE annotation by subject.
+    Args:
+        records: Annotation records of all pages, in page order (see extract_page).
+        doc_text: DocumentText of the whole document.
+    Returns:
+        List of annotations, foreign annotations first, then the grouped CARE annotations.
+    """
+    grouped_annotations = {}
+    annotations_order = []
+    annotations = []
+
+    for record in records:
+        subject = record["subject"]
+        comment = record["comment"]
+        highlighted_text = record["text"]
+        # Skip comment annotations and add comment to grouped annotations
+        if len(highlighted_text) == 0:
+            # If this is a care annotation, try to add comment to existing group
+            if is_care_subject(subject) and comment:
+                if subject in grouped_annotations:
+                    grouped_annotations[subject]["comment"] += f"{comment} "
+            continue
+
+        rect = record["rect"]
+        # offsets in the whole document text, so prefix/suffix are taken around the right page
+        start_idx, end_idx = doc_text.find(record["page"], record["annot_text"])
+
+        text_start = start_idx if start_idx != -1 else 0
+        text_end = end_idx if end_idx != -1 else 0
+        prefix, suffix = doc_text.context(text_start, text_end)
+
+        # If annotation is not made by care (no grouping subject),
+        if not is_care_subject(subject):
+            annotations.append({
+                "page": record["page"],
+                "type": record["type"],
+                "rects": [rect],
+                "comment": comment.strip(),
+                "texts": [highlighted_text],
+                "color": record["color"],
+                "prefix": prefix,
+                "suffix": suffix,
+                "subject": subject,
+                "text": highlighted_text,
+            })
+            continue
+
+        # Grouped annotation logic
+        if subject not in grouped_annotations:
+            grouped_annotations[subject] = {
+                "page": record["page"],
+                "type": record["type"],
+                "rects": [],
+                "comment": "",
+                "texts": [],
+                "color": record["color"],
+                "text_start": None,
+                "text_end": None,
+            }
+            annotations_order.append(subject)
+
+        grouped = grouped_annotations[subject]
+
+        grouped["texts"].append(highlighted_text)
+        grouped["rects"].append(rect)
+
+        if start_idx != -1:
+            if grouped["text_start"] is None or start_idx < grouped["text_start"]:
+                grouped["text_start"] = start_idx
+            if grouped["text_end"] is None or end_idx > grouped["text_end"]:
+                grouped["text_end"] = end_idx
+
+    # Add grouped annotations to the result
+    for subject in annotations_order:
+        group = grouped_annotations[subject]
+        texts = group.get("texts") or []
+        full_text = " ".join(texts).strip() if len(texts) != 0 else ""
+        text_start = group.get("text_start") or 0
+        text_end = group.get("text_end") or 0
+        prefix, suffix = doc_text.context(text_start, text_end)
+
+        annotations.append({
+            "page": group["page"],
+            "type": group["type"],
+            "rects": group["rects"],
+            "comment": group["comment"].strip(),
+            "text": full_text,
+            "color": group["color"],
+            "prefix": prefix,
+            "suffix": suffix,
+            "subject": subject,
+        })
+
+    return annotations
+
+
+def extract_annotations(doc):
+    """
+    Extracts and groups the annotations of a document page by page in the current thread.
+    Args:
+        doc: The pymupdf document.
+    Returns:
+        List of annotations (see group_annotations).
+    """
+    with span("extract pages"):
+        page_texts, records = extract_pages(doc)
+    with span("group"):
+        return group_annotations(records, DocumentText(page_texts))
+
+
+def use_parallel(page_count):
+    """
+    Whether a document with the given page count is extracted page-sharded across worker processes.
+    """
+    return PARALLEL_WORKERS > 1 and page_count >= PARALLEL_MIN_PAGES
+
+
+def page_ranges(page_count, shards):
+    """
+    Splits the pages into at most the given number of contiguous (start, stop) ranges.
+    """
+    size = max(1, math.ceil(page_count / max(1, shards)))
+    return [(start, min(start + size, page_count)) for start in range(0, page_count, size)]
+
+
+def _extract_shared_range(shm_name, size, start, stop, token=None):
+    """
+    Worker entry point: opens the PDF bytes from shared memory and extracts a range of pages.
+    Args:
+        shm_name: Name of the shared memory block holding the PDF file.
+        size: Size of the PDF file in bytes.
+        start: First page number.
+        stop: Page number after the last page.
+        token: CancelToken of the request (optional).
+    Returns:
+        Tuple (page_texts, records), see extract_pages.
+    """
+    shm = attach_shared_memory(shm_name)
+    try:
+        doc = pymupdf.open(stream=bytes(shm.buf[:size]))
+    finally:
+        shm.close()
+    try:
+        with cancellation(token):
+            return extract_pages(doc, start, stop)
+    finally:
+        doc.close()
+
+
+def _extract_file_range(path, start, stop, token=None):
+    """
+    Worker entry point: opens the PDF file from disk and extracts a range of pages.
+    Args:
+        path: Path of the PDF file.
+        start: First page number.
+        stop: Page number after the last page.
+        token: CancelToken of the request (optional).
+    Returns:
+        Tuple (page_texts, records), see extract_pages.
+    """
+    doc = pymupdf.open(path)
+    try:
+        with cancellation(token):
+            return extract_pages(doc, start, stop)
+    finally:
+        doc.close()
+
+
+def extract_annotations_parallel(file, page_count, token=None):
+    """
+    Extracts and groups the annotations of a document with page ranges spread over the worker processes.
+    The file is placed in shared memory once instead of being pickled to every worker (a file on disk is opened
+    by every worker directly), and the results are merged in page order before grouping, so the output equals extract_annotations.
+    Args:
+        file: The PDF file as bytes, or the path of the PDF file.
+        page_count: Number of pages of the document.
+        token: CancelToken of the request, checked by the workers and between their results (optional).
+    Returns:
+        List of annotations (see group_annotations).
+    """
+    if token is not None:
+        token.share()
+    shm = None
+    if isinstance(file, str):
+        task, args = _extract_file_range, (file,)
+    else:
+        size = len(file)
+        shm = shared_memory.SharedMemory(create=True, size=size)
+        shm.buf[:size] = file
+        task, args = _extract_shared_range, (shm.name, size)
+    try:
+        with span("extract pages (parallel)"):
+            executor = get_executor()
+            # a few more shards than workers, so uneven pages don't leave workers idle
+            futures = [
+                executor.submit(task, *args, start, stop, token)
+                for start, stop in page_ranges(page_count, PARALLEL_WORKERS * 2)
+            ]
+            page_texts = []
+            records = []
+            try:
+                for future in futures:
+                    range_texts, range_records = future.result()
+                    page_texts.extend(range_texts)
+                    records.extend(range_records)
+            finally:
+                # ranges not started yet once one failed or was cancelled
+                for future in futures:
+                    future.cancel()
+    finally:
+        if shm is not None:
+            shm.close()
+            shm.unlink()
+
+    with span("group"):
+        return group_annotations(records, DocumentText(page_texts))
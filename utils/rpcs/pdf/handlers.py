@@ -0,0 +1,277 @@
+import functools
+import hashlib
+from contextlib import nullcontext
+
+import pymupdf
+
+import embedding
+import extraction
+from Cancellation import Cancelled, cancellation, check_cancelled, current_token
+from PdfDocument import PdfDocument
+from SharedFile import SharedFile
+from Trace import profiling, span, tracing
+
+# Request options of a batch that apply to all of its items
+BATCH_OPTIONS = ("outputMode", "highlightMode", "timings")
+
+
+def traced(handler):
+    """
+    Records the stage timings of a handler, returned under "timings" if the request sets "timings",
+    and runs it under the profiler if the request sets "profile" (see Trace.profiling).
+    """
+    @functools.wraps(handler)
+    def wrapper(data, *args, **kwargs):
+        profile = profiling() if data.get("profile") else nullcontext()
+        with tracing() as trace, profile as profile_summary:
+            response = handler(data, *args, **kwargs)
+        if data.get("timings"):
+            response["timings"] = trace.to_dict()
+        if profile_summary is not None:
+            response["profile"] = profile_summary
+        return response
+    return wrapper
+
+
+def cancellable(handler):
+    """
+    Runs a handler under the CancelToken passed as keyword argument "token" (optional),
+    which the page and annotation loops check to stop early (see Cancellation.check_cancelled).
+    """
+    @functools.wraps(handler)
+    def wrapper(data, *args, token=None, **kwargs):
+        with cancellation(token):
+            return handler(data, *args, **kwargs)
+    return wrapper
+
+
+@traced
+@cancellable
+def extract_annotations(data, parallel=True):
+    """
+    Extracts all annotations from a PDF and groups them by subject (unless title is empty).
+    Args:
+        data: Contains the PDF file, or a "fileRef" to it on the shared volume, or the "uploadId" of a chunked upload.
+        parallel: Whether large documents are page-sharded across the worker processes,
+            disabled when the call already runs in one of them; profiled requests are never sharded,
+            as the profiler only records the calling thread.
+    Returns:
+        The response of the annotationsExtract event.
+    """
+    with span("open"):
+        shared_file = SharedFile.from_request(data)
+        if shared_file is not None:
+            shared_file.verify()
+            source = shared_file.path
+            doc = pymupdf.open(source)
+        else:
+            source = data["file"]
+            doc = pymupdf.open(stream=source)
+    try:
+        page_count = len(doc)
+        if parallel and not data.get("profile") and extraction.use_parallel(len(doc)):
+            annotations = extraction.extract_annotations_parallel(source, len(doc), current_token())
+        else:
+            annotations = extraction.extract_annotations(doc)
+    finally:
+        doc.close()
+
+    return {
+        "success": True,
+        "message": "Annotations extracted successfully.",
+        "data": {
+            "annotations": annotations,
+        },
+        "pageCount": page_count,
+    }
+
+
+@traced
+@cancellable
+def embed_annotations(data):
+    """
+    Embeds new annotations and comments into a PDF file based on provided annotation data.
+    Args:
+        data: Contains the PDF file (or a "fileRef"/"uploadId" naming it), annotation details, an optional outputMode and an optional highlightMode.
+    Returns:
+        The response of the embedAnnotations event, with the reference of the result file as "data" for a "fileRef"/"uploadId" request.
+    """
+    annotations = data.get("annotations", [])
+    if not annotations:
+        shared_file = SharedFile.from_request(data)
+        if shared_file is not None:
+            shared_file.verify()
+            return {"success": True, "message": "No annotations provided.", "data": shared_file.ref(), "outputMode": "full"}
+        output_buffer, output_info = PdfDocument.unchanged(data["file"], data.get("outputMode", "full"))
+        return {"success": True, "message": "No annotations provided.", "data": output_buffer, **output_info}
+
+    # Open the PDF directly from memory (or from a temporary file for incremental output)
+    with span("open"):
+        pdf = PdfDocument.from_request(data)
+    with pdf:
+        with span("embed"):
+            embedding.embed_annotations(pdf.doc, annotations, data.get("highlightMode", "annotation"))
+
+        # Save the modified PDF to memory
+        with span("write"):
+            output_buffer, output_info = pdf.write()
+        page_count = len(pdf.doc)
+    return {"success": True, "message": "PDF with annotations saved successfully", "data": output_buffer, "pageCount": page_count, **output_info}
+
+
+@traced
+@cancellable
+def delete_all_annotations(data):
+    """
+    Removes all annotations from a PDF file.
+    Args:
+        data: Contains the PDF file (or a "fileRef"/"uploadId" naming it) and an optional outputMode.
+    Returns:
+        The response of the deleteAllAnnotations event, with the reference of the result file as "file" for a "fileRef"/"uploadId" request.
+    """
+    with span("open"):
+        pdf = PdfDocument.from_request(data)
+    with pdf:
+        # Remove all annotations from all pages
+        with span("delete annotations"):
+            for page in pdf.doc:
+                check_cancelled()
+                annots = [a for a in page.annots()]
+                for annot in annots:
+                    page.delete_annot(annot)
+        # Get the modified PDF as a buffer
+        with span("write"):
+            output_buffer, output_info = pdf.write()
+        page_count = len(pdf.doc)
+    return {
+        "success": True,
+        "message": "All annotations deleted successfully.",
+        "data": {
+            "file": output_buffer
+        },
+        "pageCount": page_count,
+        **output_info
+    }
+
+
+def page_count(data):
+    """
+    Returns the number of pages of the PDF file of a request, without reading its pages.
+    Args:
+        data: Request data.
+    """
+    shared_file = SharedFile.from_request(data)
+    doc = pymupdf.open(shared_file.path) if shared_file is not None else pymupdf.open(stream=data["file"])
+    try:
+        return len(doc)
+    finally:
+        doc.close()
+
+
+def content_hash(data):
+    """
+    Returns the SHA-256 hex digest of the PDF file of a request.
+    A "fileRef" is verified against its hash, so a changed file never hits the result of its former content.
+    Args:
+        data: Request data.
+    """
+    shared_file = SharedFile.from_request(data)
+    if shared_file is not None:
+        return shared_file.verify()
+    return hashlib.sha256(data["file"]).hexdigest()
+
+
+def cache_params(event, data):
+    """
+    Returns the request parameters that, besides the file, determine the response of an event.
+    Args:
+        event: Name of the Socket.IO event.
+        data: Request data.
+    Returns:
+        JSON-serializable parameters for the cache key, or None if the response is not worth caching.
+    """
+    # diagnostic runs are never answered from the cache
+    if data.get("timings") or data.get("profile"):
+        return None
+    match event:
+        case "annotationsExtract":
+            return {}
+        case "embedAnnotations":
+            # results on the shared volume or in the spool are files the backend may move or delete, they are not cached
+            if not data.get("annotations") or data.get("fileRef") or data.get("uploadId"):
+                return None
+            return {
+                "annotations": data["annotations"],
+                "outputMode": data.get("outputMode", "full"),
+                "highlightMode": data.get("highlightMode", "annotation"),
+            }
+        case "deleteAllAnnotations":
+            if data.get("fileRef") or data.get("uploadId"):
+                return None
+            return {"outputMode": data.get("outputMode", "full")}
+    return None
+
+
+def batch_items(data):
+    """
+    Returns the request data of every document of a batch event.
+    Args:
+        data: Contains the "items", each with the data of a single request ("file", "fileRef" or "uploadId",
+            "annotations" for embedding, and an optional "id"), and options applying to all items (see BATCH_OPTIONS).
+    Returns:
+        List of request dicts, item keys taking precedence over the batch options.
+    Raises:
+        ValueError if there are no items.
+    """
+    items = data.get("items")
+    if not isinstance(items, list) or not items:
+        raise ValueError("A batch needs a non-empty list of items")
+    options = {key: data[key] for key in BATCH_OPTIONS if key in data}
+    return [{**options, **item} for item in items]
+
+
+def batch_progress(data, index, item, response, done, total):
+    """
+    Builds the batchProgress message of a finished batch item.
+    Args:
+        data: Request data of the batch.
+        index: Position of the item in the batch.
+        item: Request data of the item.
+        response: Response of the item's handler, or the exception it raised (Cancelled for items dropped with the batch).
+        done: Number of finished items, including this one.
+        total: Number of items of the batch.
+    """
+    if isinstance(response, Cancelled):
+        response = response.response()
+    elif isinstance(response, Exception):
+        response = {"success": False, "message": "error: " + str(response)}
+    return {
+        "batchId": data.get("batchId"),
+        "index": index,
+        "id": item.get("id", index),
+        "done": done,
+        "total": total,
+        **response,
+    }
+
+
+def batch_summary(data, progress):
+    """
+    Builds the response of a batch event from the progress messages of its items.
+    Per-item errors do not fail the batch, they are listed with the items.
+    Args:
+        data: Request data of the batch.
+        progress: batchProgress messages of all items.
+    """
+    failed = sum(1 for message in progress if not message.get("success"))
+    return {
+        "success": True,
+        "message": f"Processed {len(progress)} documents, {failed} failed.",
+        "data": {
+            "batchId": data.get("batchId"),
+            "total": len(progress),
+            "failed": failed,
+            "items": [{key: message[key] for key in ("index", "id", "success", "message") if key in message}
+                      for message in sorted(progress, key=lambda message: message["index"])],
+        },
+    }
@@ -0,0 +1,43 @@
+"""
+Generated documents and a recording Socket.IO server shared by the tests of the PDF service.
+"""
+import asyncio
+
+from benchmarks.corpus import generate
+
+
+def documents(pages=2, words=120, density=0.1, multiline=False, grouping="care", seed=0):
+    """
+    Generates a document of the benchmark corpus (see benchmarks.corpus.generate).
+    Returns:
+        Dict with the "plain" and the "annotated" PDF and the "annotations" as the backend sends them.
+    """
+    return generate({"pages": pages, "words": words, "density": density, "multiline": multiline,
+                     "grouping": grouping, "seed": seed})
+
+
+class Recorder:
+    """
+    Records the events a Socket.IO server emits, instead of sending them to a client.
+    """
+
+    def __init__(self, sio):
+        self.sio = sio
+        self.emitted = []
+        # the ASGI server awaits its emits
+        sio.emit = self.async_emit if asyncio.iscoroutinefunction(sio.emit) else self.emit
+
+    def emit(self, event, data=None, to=None, **kwargs):
+        self.emitted.append((event, data, to))
+
+    async def async_emit(self, event, data=None, to=None, **kwargs):
+        self.emitted.append((event, data, to))
+
+    def events(self, name):
+        return [data for event, data, _ in self.emitted if event == name]
+
+    def handler(self, event):
+        """
+        Returns the handler registered for an event, called with (sid, data) as the server does.
+        """
+        return self.sio.handlers["/"][event]
@@ -0,0 +1,145 @@
+import pymupdf
+import pytest
+
+from AnchorIndex import AnchorIndex, OffsetIndex, normalize, page_length
+
+LINES = ["we ﬁnd the efﬁcient", "a hyphen-", "ated word and", "another word"]
+
+
+@pytest.fixture(scope="module")
+def page():
+    """
+    A page with ligatures (ﬁ) on the first line, a word hyphenated at the end of the second line
+    and "word" on two lines.
+    """
+    doc = pymupdf.open()
+    page = doc.new_page()
+    writer = pymupdf.TextWriter(page.rect)
+    font = pymupdf.Font("cjk")  # has the ligature glyphs
+    for i, line in enumerate(LINES):
+        writer.append((72, 100 + 14 * i), line, font=font, fontsize=11)
+    writer.write_text(page)
+    doc = pymupdf.open(stream=doc.tobytes())
+    yield doc[0]
+    doc.close()
+
+
+@pytest.fixture(scope="module")
+def index(page):
+    return AnchorIndex(page)
+
+
+def union(index, start, end):
+    """
+    The box of the raw characters start..end (exclusive), which lie on one line.
+    """
+    rect = pymupdf.Rect(index.boxes[start])
+    for box in index.boxes[start + 1:end]:
+        rect |= box
+    return rect
+
+
+def raw_span(index, text, line=0):
+    """
+    The raw character range of a text on a line.
+    """
+    line_start = index.lines.index(line)
+    start = "".join(index.chars[line_start:]).index(text) + line_start
+    return start, start + len(text)
+
+
+def test_normalize():
+    assert normalize("  Eﬃcient\n\tWORK ") == "efficient work"
+    assert normalize("") == ""
+
+
+def test_stream_decomposes_ligatures_and_joins_hyphenated_lines(index):
+    assert index.text == "we find the efficient a hyphenated word and another word "
+    assert "ﬁ" in index.chars
+
+
+def test_ligatures(index):
+    start, end = raw_span(index, "efﬁcient")
+    assert index.search("efficient") == [union(index, start, end)]
+    assert index.search("EFFICIENT") == index.search("efficient")
+    start, end = raw_span(index, "ﬁnd")
+    assert index.search("find") == [union(index, start, end)]
+    # the query may use the ligature as well
+    assert index.search("ﬁnd") == index.search("find")
+
+
+def test_hyphenation_at_line_end(index):
+    hyphen_start, hyphen_end = raw_span(index, "hyphen-", line=1)
+    rest_start, rest_end = raw_span(index, "ated word", line=2)
+    # the hyphen itself is not part of the word
+    assert index.search("hyphenated word") == [union(index, hyphen_start, hyphen_end - 1), union(index, rest_start, rest_end)]
+
+
+def test_multi_line_hit(index):
+    first_start, first_end = raw_span(index, "efﬁcient")
+    second_start, _ = raw_span(index, "a hyphen-", line=1)
+    rects = index.search("the efficient a")
+    assert len(rects) == 2
+    assert rects[0].contains(union(index, first_start, first_end))
+    assert rects[1] == union(index, second_start, second_start + 1)
+
+
+def test_every_occurrence(index):
+    rects = index.search("word")
+    assert rects == [union(index, *raw_span(index, "word", line=2)), union(index, *raw_span(index, "word", line=3))]
+
+
+def test_partial_prefix_fallback(index):
+    query = normalize("hyphenated words elsewhere")
+    assert index.longest_prefix(query) == len("hyphenated word")
+    assert index.search("hyphenated words elsewhere") == index.search("hyphenated word")
+    assert index.longest_prefix("another word ") == len("another word ")
+    assert index.longest_prefix("xyz") == 0
+    assert index.search("xyz") == []
+    assert index.search("") == [] and index.search(None) == []
+
+
+def test_char_rects_and_textbox(index):
+    start, _ = raw_span(index, "efﬁcient")
+    end = raw_span(index, "a hyphen-", line=1)[0] + 1
+    rects = index.char_rects(start, end)
+    assert len(rects) == 2
+    assert index.textbox(rects[0]) == "efﬁcient"
+
+
+def offsets_document():
+    """
+    Three pages with "word" twice on the last one; the document text of the frontend
+    is the concatenation of the raw characters of all pages.
+    """
+    doc = pymupdf.open()
+    for lines in (["alpha beta", "gamma"], ["delta epsilon"], ["first word here", "second word there"]):
+        page = doc.new_page()
+        for i, line in enumerate(lines):
+            page.insert_text((72, 100 + 24 * i), line, fontname="helv", fontsize=11)
+    return pymupdf.open(stream=doc.tobytes())
+
+
+def test_page_length_counts_the_raw_characters(page):
+    assert page_length(page) == len(AnchorIndex(page).chars)
+    doc = offsets_document()
+    assert [page_length(p) for p in doc] == [len(AnchorIndex(p).chars) for p in doc]
+
+
+def test_offsets_only_index_the_target_page():
+    doc = offsets_document()
+    pages = ["".join(AnchorIndex(p).chars) for p in doc]
+    start = len(pages[0]) + len(pages[1]) + pages[2].rindex("word")
+    offset_index = OffsetIndex(doc)
+
+    page_num, index, page_start, page_end = offset_index.locate(start, start + 4)
+    assert (page_num, page_start) == (2, pages[2].rindex("word"))
+    assert "".join(index.chars[page_start:page_end]) == "word"
+    # the pages before it are only counted
+    assert list(offset_index.indexes) == [2]
+    assert offset_index.page_offsets == [0, len(pages[0]), len(pages[0]) + len(pages[1])]
+
+    # a span across a page boundary, beyond the document or invalid
+    assert offset_index.locate(len(pages[0]) - 2, len(pages[0]) + 2) is None
+    assert offset_index.locate(sum(map(len, pages)), sum(map(len, pages)) + 1) is None
+    assert offset_index.locate(5, 5) is None and offset_index.locate("5", 6) is None
@@ -0,0 +1,170 @@
+import asyncio
+import json
+import threading
+
+import pytest
+
+import SharedFile
+import extraction
+import handlers
+import main
+from samples import Recorder, documents
+
+
+async def asgi_request(app, method, path, query="", body=b""):
+    """
+    Sends one HTTP request to an ASGI app in process.
+    Returns:
+        Tuple (status, body).
+    """
+    scope = {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": method, "scheme": "http",
+             "path": path, "raw_path": path.encode(), "root_path": "", "query_string": query.encode(),
+             "headers": [(b"host", b"localhost"), (b"content-type", b"text/plain;charset=UTF-8"),
+                         (b"content-length", str(len(body)).encode())],
+             "client": ("127.0.0.1", 50000), "server": ("localhost", 8082)}
+    received = False
+    response = {"status": None, "body": b""}
+
+    async def receive():
+        nonlocal received
+        if not received:
+            received = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        # the client stays connected
+        await asyncio.Event().wait()
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+        elif message["type"] == "http.response.body":
+            response["body"] += message.get("body", b"")
+
+    await app(scope, receive, send)
+    return response["status"], response["body"]
+
+
+class PollingClient:
+    """
+    Socket.IO client over the Engine.IO long-polling transport, talking to the ASGI app in process.
+    Only text packets are used, so files are passed by reference.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.sid = None
+        self.ack_id = 0
+
+    async def request(self, method, body=b""):
+        query = "EIO=4&transport=polling" + (f"&sid={self.sid}" if self.sid else "")
+        status, response = await asgi_request(self.app, method, "/socket.io/", query, body)
+        assert status == 200, response
+        return response.decode()
+
+    async def connect(self):
+        opened = await self.request("GET")
+        assert opened.startswith("0")
+        self.sid = json.loads(opened[1:])["sid"]
+        await self.request("POST", b"40")
+        assert (await self.request("GET")).startswith("40")
+
+    async def call(self, event, data):
+        """
+        Emits an event and waits for its acknowledgement.
+        """
+        ack_id = self.ack_id
+        self.ack_id += 1
+        await self.request("POST", f"42{ack_id}{json.dumps([event, data])}".encode())
+        while True:
+            for packet in (await self.request("GET")).split("\x1e"):
+                if packet.startswith(f"43{ack_id}["):
+                    return json.loads(packet[len(f"43{ack_id}"):])[0]
+
+
+@pytest.fixture
+def shared_dir(tmp_path, monkeypatch):
+    """
+    Shared volume of the test, also seen by the worker processes, which are spawned anew for it.
+    """
+    monkeypatch.setenv("PDF_SHARED_DIR", str(tmp_path))
+    monkeypatch.setattr(SharedFile, "SHARED_DIR", str(tmp_path))
+    monkeypatch.setattr(extraction, "_executor", None)
+    yield tmp_path
+    if extraction._executor is not None:
+        extraction._executor.shutdown()
+
+
+@pytest.fixture
+def dispatch(monkeypatch):
+    """
+    Records whether the requests ran in the process pool or page-sharded in a thread.
+    """
+    calls = {"pool": 0, "sharded": []}
+    get_executor = extraction.get_executor
+    extract_annotations_parallel = extraction.extract_annotations_parallel
+
+    def counting_get_executor():
+        calls["pool"] += 1
+        return get_executor()
+
+    def recording_extract_annotations_parallel(*args, **kwargs):
+        calls["sharded"].append(threading.current_thread())
+        return extract_annotations_parallel(*args, **kwargs)
+
+    monkeypatch.setattr(extraction, "get_executor", counting_get_executor)
+    monkeypatch.setattr(extraction, "extract_annotations_parallel", recording_extract_annotations_parallel)
+    return calls
+
+
+def test_extraction_runs_in_the_process_pool(shared_dir, dispatch):
+    document = documents(pages=3, seed=5)
+    (shared_dir / "doc.pdf").write_bytes(document["annotated"])
+    expected = handlers.extract_annotations({"file": document["annotated"]}, parallel=False)
+
+    async def run():
+        client = PollingClient(main.create_asgi_app())
+        await client.connect()
+        return await client.call("annotationsExtract", {"fileRef": {"path": "doc.pdf"}})
+
+    response = asyncio.run(run())
+    assert response["success"], response
+    assert json.loads(json.dumps(expected["data"])) == response["data"]
+    assert dispatch["pool"] == 1 and dispatch["sharded"] == []
+
+
+def test_large_extraction_is_page_sharded_off_the_event_loop(dispatch, monkeypatch):
+    monkeypatch.setattr(extraction, "PARALLEL_WORKERS", 2)
+    monkeypatch.setattr(extraction, "PARALLEL_MIN_PAGES", 4)
+    document = documents(pages=6, seed=6)
+    expected = handlers.extract_annotations({"file": document["annotated"]}, parallel=False)
+    server = Recorder(main.create_asgi_app().engineio_server)
+
+    response = asyncio.run(server.handler("annotationsExtract")("sid", {"file": document["annotated"]}))
+    assert response["success"], response
+    assert response["data"] == expected["data"]
+    [thread] = dispatch["sharded"]
+    assert thread is not threading.main_thread()
+    # the sharding thread spreads the page ranges over the pool, the request itself is not sent to it
+    assert dispatch["pool"] == 1
+
+
+def test_small_document_is_not_sharded(dispatch, monkeypatch):
+    monkeypatch.setattr(extraction, "PARALLEL_WORKERS", 2)
+    monkeypatch.setattr(extraction, "PARALLEL_MIN_PAGES", 4)
+    document = documents(pages=2, seed=7)
+    server = Recorder(main.create_asgi_app().engineio_server)
+    response = asyncio.run(server.handler("annotationsExtract")("sid", {"file": document["annotated"]}))
+    assert response["success"] and dispatch["sharded"] == [] and dispatch["pool"] == 1
+
+
+def test_asgi_batch_reports_every_document():
+    first, second = documents(seed=8), documents(seed=9)
+    server = Recorder(main.create_asgi_app().engineio_server)
+    data = {"batchId": "asgi", "items": [{"id": "first", "file": first["annotated"]}, {"id": "second", "file": second["annotated"]}]}
+    response = asyncio.run(server.handler("annotationsExtractBatch")("sid", data))
+    assert response["data"]["total"] == 2 and response["data"]["failed"] == 0
+    assert sorted(message["id"] for message in server.events("batchProgress")) == ["first", "second"]
+
+
+def test_asgi_app_serves_the_metrics():
+    status, body = asyncio.run(asgi_request(main.create_asgi_app(), "GET", "/metrics"))
+    assert status == 200 and b"# TYPE rpc_requests_total counter" in body
@@ -0,0 +1,77 @@
+import pymupdf
+import pytest
+
+import handlers
+import main
+from samples import Recorder, documents
+
+
+@pytest.fixture(scope="module")
+def app():
+    return main.create_app()
+
+
+@pytest.fixture
+def server(app):
+    return Recorder(app.engineio_app)
+
+
+def test_batch_items_take_the_batch_options():
+    items = handlers.batch_items({"items": [{"file": b"a"}, {"file": b"b", "outputMode": "full"}], "outputMode": "incremental",
+                                  "batchId": "b1"})
+    assert items == [{"file": b"a", "outputMode": "incremental"}, {"file": b"b", "outputMode": "full"}]
+    with pytest.raises(ValueError):
+        handlers.batch_items({"items": []})
+
+
+def test_extract_batch_reports_every_document(server):
+    first, second = documents(seed=1), documents(seed=2)
+    data = {"batchId": "extract", "items": [
+        {"id": "first", "file": first["annotated"]},
+        {"id": "broken", "file": b"not a pdf"},
+        {"id": "second", "file": second["annotated"]},
+    ]}
+    response = server.handler("annotationsExtractBatch")("sid", data)
+
+    assert response["success"] and response["data"]["total"] == 3 and response["data"]["failed"] == 1
+    assert [(item["id"], item["success"]) for item in response["data"]["items"]] == \
+        [("first", True), ("broken", False), ("second", True)]
+    progress = server.events("batchProgress")
+    assert sorted(message["done"] for message in progress) == [1, 2, 3]
+    assert {message["batchId"] for message in progress} == {"extract"}
+    by_id = {message["id"]: message for message in progress}
+    assert by_id["broken"]["message"].startswith("error: ")
+    for name, document in (("first", first), ("second", second)):
+        single = handlers.extract_annotations({"file": document["annotated"]}, parallel=False)
+        assert by_id[name]["data"] == single["data"]
+
+
+def test_repeated_batch_is_answered_from_the_cache(server):
+    document = documents(seed=3)
+    data = {"batchId": "cached", "items": [{"file": document["annotated"]}]}
+    server.handler("annotationsExtractBatch")("sid", data)
+    hits = server.handler("cacheStats")("sid")["data"]["events"]["annotationsExtract"]["hits"]
+    response = server.handler("annotationsExtractBatch")("sid", data)
+    assert response["data"]["failed"] == 0
+    assert server.handler("cacheStats")("sid")["data"]["events"]["annotationsExtract"]["hits"] == hits + 1
+
+
+def test_embed_batch_applies_the_batch_options(server):
+    document = documents(seed=4, grouping="foreign")
+    data = {"batchId": "embed", "highlightMode": "word", "items": [
+        {"id": 7, "file": document["plain"], "annotations": document["annotations"]},
+    ]}
+    response = server.handler("embedAnnotationsBatch")("sid", data)
+    assert response["data"]["items"] == [{"index": 0, "id": 7, "success": True, "message": "PDF with annotations saved successfully"}]
+    [message] = server.events("batchProgress")
+    assert message["outputMode"] == "full"
+    single = handlers.embed_annotations({"file": document["plain"], "annotations": document["annotations"], "highlightMode": "word"})
+    assert message["pageCount"] == single["pageCount"]
+    with pymupdf.open(stream=message["data"]) as batch_doc, pymupdf.open(stream=single["data"]) as single_doc:
+        assert [len(list(page.annots())) for page in batch_doc] == [len(list(page.annots())) for page in single_doc]
+        assert sum(len(list(page.annots())) for page in batch_doc) > 0
+
+
+def test_batch_without_items_fails(server):
+    response = server.handler("embedAnnotationsBatch")("sid", {"items": []})
+    assert response["success"] is False and "non-empty list" in response["message"]
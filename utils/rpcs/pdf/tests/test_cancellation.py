@@ -0,0 +1,82 @@
+import pickle
+import tempfile
+import time
+
+import pymupdf
+import pytest
+
+import extraction
+import main
+from Cancellation import CancelRegistry, CancelToken, Cancelled, cancellation, check_cancelled
+from samples import Recorder, documents
+
+
+def test_token_expires_with_its_response_deadline():
+    assert CancelToken.from_request({"responseDeadline": (time.time() + 60) * 1000}).error() is None
+    token = CancelToken.from_request({"responseDeadline": (time.time() - 1) * 1000})
+    with pytest.raises(Cancelled, match="response deadline exceeded"):
+        token.check()
+    assert CancelToken.from_request({}).error() is None
+
+
+def test_check_cancelled_raises_only_under_a_cancelled_token():
+    check_cancelled()
+    token = CancelToken()
+    with cancellation(token):
+        check_cancelled()
+        token.cancel("stop")
+        with pytest.raises(Cancelled, match="stop"):
+            check_cancelled()
+    check_cancelled()
+
+
+def test_page_loop_stops_once_cancelled():
+    token = CancelToken()
+    token.cancel()
+    with pymupdf.open(stream=documents(pages=3)["annotated"]) as doc, cancellation(token):
+        with pytest.raises(Cancelled):
+            extraction.extract_pages(doc)
+
+
+def test_shared_token_sees_a_later_cancel():
+    token = CancelToken().share()
+    try:
+        # as pickled into a worker process before the client disconnected
+        copy = pickle.loads(pickle.dumps(token))
+        assert copy.error() is None
+        token.cancel("client disconnected")
+        assert isinstance(copy.error(), Cancelled)
+        copy.close()
+    finally:
+        token.close()
+
+
+def test_cancelled_token_stops_the_worker_process():
+    token = CancelToken().share()
+    token.cancel()
+    try:
+        with tempfile.NamedTemporaryFile(suffix=".pdf") as f:
+            f.write(documents(pages=2)["annotated"])
+            f.flush()
+            future = extraction.get_executor().submit(extraction._extract_file_range, f.name, 0, 2, token)
+            with pytest.raises(Cancelled):
+                future.result(timeout=60)
+    finally:
+        token.close()
+
+
+def test_disconnect_cancels_the_requests_of_the_session():
+    registry = CancelRegistry()
+    with registry.track("a", {}) as token, registry.track("b", {}) as other:
+        assert registry.cancel("a") == 1
+        assert token.error() is not None and "client disconnected" in str(token.error())
+        assert other.error() is None
+    assert registry.tokens == {}
+
+
+def test_request_past_its_deadline_gets_the_cancelled_response():
+    server = Recorder(main.create_app().engineio_app)
+    data = {"file": documents(pages=1)["annotated"], "responseDeadline": (time.time() - 1) * 1000}
+    response = server.handler("annotationsExtract")("sid", data)
+    assert response["success"] is False and response["cancelled"] is True
+    assert "deadline" in response["message"]
@@ -0,0 +1,44 @@
+import pymupdf
+
+import extraction
+from DocumentText import DocumentText
+
+PAGES = ["alpha beta gamma delta epsilon zeta", "eta theta iota kappa lambda mu nu xi"]
+
+
+def two_page_document(highlight="kappa"):
+    """
+    A document with one line of text per page and a foreign highlight of a word on the second page.
+    """
+    doc = pymupdf.open()
+    for text in PAGES:
+        doc.new_page().insert_text((72, 100), text, fontname="helv", fontsize=11)
+    page = doc[1]
+    annot = page.add_highlight_annot(quads=page.search_for(highlight, quads=True))
+    annot.set_info({"title": "reviewer", "subject": "Highlight", "content": "a note"})
+    annot.update()
+    return pymupdf.open(stream=doc.tobytes())
+
+
+def test_page_offsets_resolve_to_the_whole_text():
+    text = DocumentText(["first page\n", "second page\n", "third\n"])
+    assert text.page_offsets == [0, 11, 23]
+    assert text.text == "first page\nsecond page\nthird\n"
+    assert text.find(1, "page") == (18, 22)
+    assert text.text[18:22] == "page"
+    assert text.find(2, "page") == (-1, -1)
+    assert text.context(18, 22, length=10) == ("ge\nsecond ", "\nthird\n")
+    assert text.context(2, 4, length=10) == ("fi", "t page\nsec")
+
+
+def test_context_of_a_highlight_on_a_later_page():
+    doc = two_page_document()
+    page_texts = [page.get_text() for page in doc]
+    [annotation] = extraction.extract_annotations(doc)
+    assert annotation["page"] == 1 and annotation["text"] == "kappa"
+
+    # a highlight has no text of its own, its context is taken at the start of its page,
+    # which lies after the whole text of the first page
+    assert annotation["prefix"] == page_texts[0][-30:]
+    assert annotation["suffix"] == page_texts[1][:30]
+    assert annotation["suffix"].startswith("eta theta iota kappa")
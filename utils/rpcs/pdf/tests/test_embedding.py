@@ -0,0 +1,113 @@
+import pymupdf
+import pytest
+
+import embedding
+import extraction
+from AnchorIndex import AnchorIndex
+from samples import documents
+from test_anchor_index import offsets_document
+
+
+def position_annotation(start, end, exact="word"):
+    return {
+        "selectors": {"target": [{"selector": [
+            {"type": "PagePositionSelector", "number": 3},
+            {"type": "TextPositionSelector", "start": start, "end": end},
+            {"type": "TextQuoteSelector", "exact": exact, "prefix": "", "suffix": ""},
+        ]}]},
+        "username": "tester",
+        "tag": "Highlight",
+        "comments": [],
+    }
+
+
+def highlighted(page):
+    return [annot.rect for annot in page.annots() if annot.type[0] == pymupdf.PDF_ANNOT_HIGHLIGHT]
+
+
+def test_text_position_selector_places_the_highlight():
+    doc = offsets_document()
+    pages = ["".join(AnchorIndex(p).chars) for p in doc]
+    page = doc[2]
+    first, second = page.search_for("word")
+    start = len(pages[0]) + len(pages[1]) + pages[2].rindex("word")
+
+    # the quote alone matches the first occurrence, the position selects the second
+    embedding.embed_annotations(doc, [position_annotation(start, start + 4)])
+    [rect] = highlighted(page)
+    assert rect.intersects(second) and not rect.intersects(first)
+
+
+def test_quote_search_when_the_position_disagrees():
+    doc = offsets_document()
+    pages = ["".join(AnchorIndex(p).chars) for p in doc]
+    start = len(pages[0]) + len(pages[1]) + pages[2].index("here")
+    page = doc[2]
+    first, _ = page.search_for("word")
+    embedding.embed_annotations(doc, [position_annotation(start, start + 4)])
+    [rect] = highlighted(page)
+    assert rect.intersects(first)
+
+
+def embed(sample, highlight_mode):
+    """
+    Embeds the annotations of a generated document and reads the result back.
+    Returns:
+        Tuple (highlights, comments, extracted annotations by subject).
+    """
+    doc = pymupdf.open(stream=sample["plain"])
+    embedding.embed_annotations(doc, sample["annotations"], highlight_mode)
+    doc = pymupdf.open(stream=doc.tobytes())
+    highlights, comments = [], []
+    for page in doc:
+        for annot in page.annots():
+            if annot.type[0] == pymupdf.PDF_ANNOT_HIGHLIGHT:
+                highlights.append((annot.info["subject"], len(annot.vertices) // 4))
+            elif annot.type[0] == pymupdf.PDF_ANNOT_TEXT:
+                comments.append((annot.info["subject"], annot.info["content"]))
+    extracted = {annotation["subject"]: annotation for annotation in extraction.extract_annotations(doc)}
+    return highlights, comments, extracted
+
+
+def exacts(sample):
+    return [annotation["selectors"]["target"][0]["selector"][1]["exact"] for annotation in sample["annotations"]]
+
+
+@pytest.mark.parametrize("highlight_mode", ["annotation", "word"])
+@pytest.mark.parametrize("multiline", [False, True])
+def test_highlight_modes_cover_the_quotes(highlight_mode, multiline):
+    sample = documents(pages=2, words=150, density=0.1, multiline=multiline)
+    highlights, comments, extracted = embed(sample, highlight_mode)
+    subjects = [f"$$care{i}" for i in range(len(sample["annotations"]))]
+    assert comments == [(subject, "Highlight: " + annotation["comments"][0]["text"])
+                        for subject, annotation in zip(subjects, sample["annotations"])]
+    # the highlighted words, read back by the extraction, are the quotes
+    assert {subject: extracted[subject]["text"] for subject in subjects} == dict(zip(subjects, exacts(sample)))
+
+
+def test_annotation_mode_adds_one_highlight_per_annotation():
+    sample = documents(pages=2, words=150, density=0.1, multiline=True)
+    highlights, _, _ = embed(sample, "annotation")
+    assert [subject for subject, _ in highlights] == [f"$$care{i}" for i in range(len(sample["annotations"]))]
+    # one quad per word of a quote across lines
+    assert [quads for _, quads in highlights] == [len(exact.split()) for exact in exacts(sample)]
+
+
+def test_word_mode_adds_one_highlight_per_word():
+    sample = documents(pages=2, words=150, density=0.1, multiline=True)
+    highlights, _, _ = embed(sample, "word")
+    assert len(highlights) == sum(len(exact.split()) for exact in exacts(sample))
+    assert all(quads == 1 for _, quads in highlights)
+    for i, exact in enumerate(exacts(sample)):
+        assert sum(1 for subject, _ in highlights if subject == f"$$care{i}") == len(exact.split())
+
+
+def test_single_line_quotes_get_one_highlight_in_both_modes():
+    sample = documents(pages=2, words=150, density=0.1)
+    assert [subject for subject, _ in embed(sample, "word")[0]] == [subject for subject, _ in embed(sample, "annotation")[0]]
+
+
+def test_unknown_highlight_mode():
+    sample = documents(pages=1)
+    with pytest.raises(ValueError, match="Unknown highlight mode"):
+        embedding.embed_annotations(pymupdf.open(stream=sample["plain"]), sample["annotations"], "sentence")
@@ -0,0 +1,65 @@
+import pymupdf
+import pytest
+
+import extraction
+import handlers
+from DocumentText import DocumentText
+from samples import documents
+
+
+@pytest.fixture
+def parallel(monkeypatch):
+    """
+    Page-shards documents from 3 pages on over two worker processes.
+    """
+    monkeypatch.setattr(extraction, "PARALLEL_WORKERS", 2)
+    monkeypatch.setattr(extraction, "PARALLEL_MIN_PAGES", 3)
+
+
+def test_page_ranges():
+    assert extraction.page_ranges(10, 4) == [(0, 3), (3, 6), (6, 9), (9, 10)]
+    assert extraction.page_ranges(3, 8) == [(0, 1), (1, 2), (2, 3)]
+    assert extraction.page_ranges(1, 0) == [(0, 1)]
+
+
+def test_use_parallel(parallel, monkeypatch):
+    assert not extraction.use_parallel(2) and extraction.use_parallel(3)
+    monkeypatch.setattr(extraction, "PARALLEL_WORKERS", 1)
+    assert not extraction.use_parallel(1000)
+
+
+@pytest.mark.parametrize("grouping", ["care", "foreign"])
+@pytest.mark.parametrize("multiline", [False, True])
+def test_parallel_equals_sequential(parallel, grouping, multiline):
+    file = documents(pages=7, words=150, density=0.15, multiline=multiline, grouping=grouping)["annotated"]
+    doc = pymupdf.open(stream=file)
+    page_texts, records = extraction.extract_pages(doc)
+    expected = extraction.group_annotations(records, DocumentText(page_texts))
+    assert expected and {annotation["page"] for annotation in expected} == set(range(7))
+    assert extraction.extract_annotations(doc) == expected
+
+    # the bytes through shared memory
+    assert extraction.extract_annotations_parallel(file, len(doc)) == expected
+
+
+def test_parallel_from_a_file(parallel, tmp_path):
+    file = documents(pages=5, grouping="foreign", seed=3)["annotated"]
+    path = tmp_path / "doc.pdf"
+    path.write_bytes(file)
+    expected = extraction.extract_annotations(pymupdf.open(stream=file))
+    assert extraction.extract_annotations_parallel(str(path), 5) == expected
+
+
+def test_handler_shards_large_documents(parallel, monkeypatch):
+    file = documents(pages=4, seed=4)["annotated"]
+    sharded = []
+    extract_annotations_parallel = extraction.extract_annotations_parallel
+
+    def recording_extract_annotations_parallel(*args, **kwargs):
+        sharded.append(args[1])
+        return extract_annotations_parallel(*args, **kwargs)
+
+    monkeypatch.setattr(extraction, "extract_annotations_parallel", recording_extract_annotations_parallel)
+    response = handlers.extract_annotations({"file": file})
+    assert sharded == [4]
+    assert response == handlers.extract_annotations({"file": file}, parallel=False)
@@ -0,0 +1,98 @@
+import os
+import re
+
+import pymupdf
+import pytest
+
+import handlers
+from PdfDocument import PdfDocument
+from samples import documents
+
+
+def annotations_of(file):
+    """
+    The annotations of every page of a PDF file, comparable across saves.
+    """
+    doc = pymupdf.open(stream=file)
+    try:
+        return [
+            (page.number, annot.type[1], [round(c, 2) for c in annot.rect], annot.info["title"], annot.info["subject"], annot.info["content"])
+            for page in doc for annot in page.annots()
+        ]
+    finally:
+        doc.close()
+
+
+def broken_xref(file):
+    """
+    The file with a wrong startxref offset, which mupdf repairs when opening it, so it cannot be saved incrementally.
+    """
+    return re.sub(rb"startxref\s+\d+", b"startxref\n1", file)
+
+
+@pytest.fixture(scope="module")
+def sample():
+    return documents(pages=3, seed=11)
+
+
+def test_incremental_update_appends_to_the_original(sample):
+    file = sample["plain"]
+    data = {"file": file, "annotations": sample["annotations"]}
+    full = handlers.embed_annotations({**data, "outputMode": "full"})
+    incremental = handlers.embed_annotations({**data, "outputMode": "incremental"})
+
+    assert full["outputMode"] == "full" and "baseSize" not in full
+    assert incremental["outputMode"] == "incremental" and incremental["baseSize"] == len(file)
+    update = incremental["data"]
+    assert 0 < len(update) < len(full["data"])
+    assert update.rstrip().endswith(b"%%EOF")
+
+    result = file + update
+    assert annotations_of(result) == annotations_of(full["data"])
+    assert len(annotations_of(result)) >= len(sample["annotations"])
+    doc = pymupdf.open(stream=result)
+    assert not doc.is_repaired and len(doc) == 3
+    doc.close()
+    assert handlers.extract_annotations({"file": result}, parallel=False) == handlers.extract_annotations({"file": full["data"]}, parallel=False)
+
+
+def test_incremental_delete(sample):
+    file = sample["annotated"]
+    assert annotations_of(file)
+    response = handlers.delete_all_annotations({"file": file, "outputMode": "incremental"})
+    assert response["outputMode"] == "incremental" and response["baseSize"] == len(file)
+    assert annotations_of(file + response["data"]["file"]) == []
+
+
+def test_full_output_for_files_that_cannot_be_saved_incrementally(sample):
+    file = broken_xref(sample["plain"])
+    with PdfDocument(file, "incremental") as pdf:
+        assert pdf.doc.is_repaired and not pdf.doc.can_save_incrementally()
+
+    response = handlers.embed_annotations({"file": file, "annotations": sample["annotations"], "outputMode": "incremental"})
+    assert response["success"] and response["outputMode"] == "full" and "baseSize" not in response
+    # the complete file, not an update to append
+    assert response["data"].startswith(b"%PDF")
+    expected = handlers.embed_annotations({"file": sample["plain"], "annotations": sample["annotations"]})
+    assert annotations_of(response["data"]) == annotations_of(expected["data"])
+
+
+def test_unchanged_documents():
+    assert PdfDocument.unchanged(b"%PDF-1.7 data", "incremental") == (b"", {"outputMode": "incremental", "baseSize": 13})
+    assert PdfDocument.unchanged(b"%PDF-1.7 data") == (b"%PDF-1.7 data", {"outputMode": "full"})
+    response = handlers.embed_annotations({"file": b"%PDF-1.7 data", "annotations": [], "outputMode": "incremental"})
+    assert response["data"] == b"" and response["baseSize"] == 13
+
+
+def test_temporary_file_is_removed(sample):
+    pdf = PdfDocument(sample["plain"], "incremental")
+    path = pdf.path
+    assert os.path.exists(path)
+    with pdf:
+        pdf.write()
+    assert not os.path.exists(path) and pdf.path is None
+
+
+def test_unknown_output_mode(sample):
+    with pytest.raises(ValueError, match="Unknown output mode"):
+        PdfDocument(sample["plain"], "partial")
@@ -0,0 +1,62 @@
+import hashlib
+
+import pytest
+
+import SharedFile
+import handlers
+from ResultCache import ResultCache
+
+
+@pytest.fixture
+def shared_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(SharedFile, "SHARED_DIR", str(tmp_path))
+    return tmp_path
+
+
+def cache_key(event, data):
+    return ResultCache.key(event, handlers.content_hash(data), handlers.cache_params(event, data))
+
+
+def test_changed_file_reference_misses_the_cache(shared_dir):
+    cache = ResultCache(max_bytes=1024 * 1024)
+    (shared_dir / "doc.pdf").write_bytes(b"first content")
+    data = {"fileRef": {"path": "doc.pdf"}}
+    key = cache_key("annotationsExtract", data)
+    cache.put(key, {"success": True, "data": "first"})
+    assert cache.get("annotationsExtract", cache_key("annotationsExtract", data)) == {"success": True, "data": "first"}
+
+    (shared_dir / "doc.pdf").write_bytes(b"second content")
+    changed_key = cache_key("annotationsExtract", data)
+    assert changed_key != key
+    assert cache.get("annotationsExtract", changed_key) is None
+    assert cache.get_stats()["events"]["annotationsExtract"] == {"hits": 1, "misses": 1}
+
+
+def test_file_reference_with_stale_hash_is_rejected(shared_dir):
+    (shared_dir / "doc.pdf").write_bytes(b"first content")
+    stale_hash = hashlib.sha256(b"first content").hexdigest()
+    (shared_dir / "doc.pdf").write_bytes(b"second content")
+    with pytest.raises(ValueError, match="hash does not match"):
+        handlers.content_hash({"fileRef": {"path": "doc.pdf", "hash": stale_hash}})
+
+
+def test_inline_file_key_follows_its_bytes():
+    params = handlers.cache_params("deleteAllAnnotations", {"file": b"a"})
+    assert ResultCache.key("deleteAllAnnotations", handlers.content_hash({"file": b"a"}), params) != \
+        ResultCache.key("deleteAllAnnotations", handlers.content_hash({"file": b"b"}), params)
+
+
+def test_key_depends_on_event_and_parameters():
+    file_hash = hashlib.sha256(b"content").hexdigest()
+    full = ResultCache.key("deleteAllAnnotations", file_hash, {"outputMode": "full"})
+    assert full != ResultCache.key("deleteAllAnnotations", file_hash, {"outputMode": "incremental"})
+    assert full != ResultCache.key("embedAnnotations", file_hash, {"outputMode": "full"})
+    assert full == ResultCache.key("deleteAllAnnotations", file_hash, {"outputMode": "full"})
+
+
+def test_evicted_entry_is_served_from_the_spill_directory(tmp_path):
+    cache = ResultCache(max_bytes=200, spill_dir=str(tmp_path / "spill"), spill_max_bytes=1024 * 1024)
+    cache.put("a", "x" * 150)
+    cache.put("b", "y" * 150)
+    assert cache.get_stats()["spilledEntries"] == 1
+    assert cache.get("annotationsExtract", "a") == "x" * 150
@@ -0,0 +1,86 @@
+import os
+
+import pymupdf
+import pytest
+
+import SharedFile as shared_file_module
+from PdfDocument import PdfDocument
+from SharedFile import SharedFile
+
+
+@pytest.fixture
+def shared_dir(tmp_path, monkeypatch):
+    directory = tmp_path / "shared"
+    directory.mkdir()
+    monkeypatch.setattr(shared_file_module, "SHARED_DIR", str(directory))
+    return directory
+
+
+def write_pdf(path, text="content"):
+    doc = pymupdf.open()
+    doc.new_page().insert_text((72, 72), text)
+    doc.save(str(path))
+    doc.close()
+
+
+@pytest.mark.parametrize("path", ["../secret.pdf", "docs/../../secret.pdf", "/etc/passwd", "", ".", "docs/.."])
+def test_resolve_rejects_paths_outside_the_shared_directory(shared_dir, path):
+    (shared_dir / "docs").mkdir()
+    with pytest.raises(ValueError):
+        SharedFile(path)
+
+
+def test_resolve_rejects_symlinks_outside_the_shared_directory(shared_dir, tmp_path):
+    (tmp_path / "secret.pdf").write_bytes(b"secret")
+    os.symlink(tmp_path / "secret.pdf", shared_dir / "link.pdf")
+    os.symlink(tmp_path, shared_dir / "outside")
+    with pytest.raises(ValueError, match="outside of the shared directory"):
+        SharedFile("link.pdf")
+    with pytest.raises(ValueError, match="outside of the shared directory"):
+        SharedFile("outside/secret.pdf")
+
+
+def test_resolve_accepts_paths_inside_the_shared_directory(shared_dir):
+    (shared_dir / "docs").mkdir()
+    os.symlink(shared_dir / "docs", shared_dir / "alias")
+    assert SharedFile("docs/a.pdf").path == str(shared_dir / "docs" / "a.pdf")
+    assert SharedFile("alias/../docs/./a.pdf").path == str(shared_dir / "docs" / "a.pdf")
+
+
+def test_output_path_protects_the_input_and_existing_files(shared_dir):
+    (shared_dir / "in.pdf").write_bytes(b"input")
+    (shared_dir / "out.pdf").write_bytes(b"output")
+    shared_file = SharedFile("in.pdf")
+    with pytest.raises(ValueError, match="cannot be the input file"):
+        shared_file.output_path("in.pdf", overwrite=True)
+    with pytest.raises(ValueError, match="already exists"):
+        shared_file.output_path("out.pdf")
+    with pytest.raises(ValueError):
+        shared_file.output_path("../out.pdf")
+    assert shared_file.output_path("out.pdf", overwrite=True) == str(shared_dir / "out.pdf")
+    assert os.path.dirname(shared_file.output_path()) == str(shared_dir)
+
+
+def test_result_created_meanwhile_is_not_replaced(shared_dir):
+    write_pdf(shared_dir / "in.pdf")
+    with PdfDocument.from_request({"fileRef": {"path": "in.pdf", "output": "out.pdf"}}) as pdf:
+        (shared_dir / "out.pdf").write_bytes(b"written meanwhile")
+        with pytest.raises(ValueError, match="already exists"):
+            pdf.write()
+    assert (shared_dir / "out.pdf").read_bytes() == b"written meanwhile"
+    assert sorted(os.listdir(shared_dir)) == ["in.pdf", "out.pdf"]
+
+
+@pytest.mark.parametrize("output_mode", ["full", "incremental"])
+def test_result_is_written_without_touching_the_input(shared_dir, output_mode):
+    write_pdf(shared_dir / "in.pdf")
+    original = (shared_dir / "in.pdf").read_bytes()
+    data = {"fileRef": {"path": "in.pdf", "output": "out.pdf"}, "outputMode": output_mode}
+    with PdfDocument.from_request(data) as pdf:
+        pdf.doc[0].add_highlight_annot(pymupdf.Rect(72, 60, 150, 80))
+        ref, info = pdf.write()
+    assert ref["path"] == "out.pdf" and info == {"outputMode": "full"}
+    assert (shared_dir / "in.pdf").read_bytes() == original
+    assert sorted(os.listdir(shared_dir)) == ["in.pdf", "out.pdf"]
+    with pymupdf.open(str(shared_dir / "out.pdf")) as doc:
+        assert len(list(doc[0].annots())) == 1
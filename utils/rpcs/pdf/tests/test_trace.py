@@ -0,0 +1,61 @@
+import pytest
+
+import extraction
+import handlers
+import Trace
+from PdfService import PdfService
+from samples import documents
+
+
+@pytest.fixture
+def file():
+    return documents(pages=4, seed=5)["annotated"]
+
+
+@pytest.fixture
+def parallel(monkeypatch):
+    """
+    Page-shards documents from 3 pages on, and fails if an extraction is sharded.
+    """
+    monkeypatch.setattr(extraction, "PARALLEL_WORKERS", 2)
+    monkeypatch.setattr(extraction, "PARALLEL_MIN_PAGES", 3)
+
+    def extract_annotations_parallel(*args, **kwargs):
+        raise AssertionError("a profiled extraction was page-sharded")
+
+    monkeypatch.setattr(extraction, "extract_annotations_parallel", extract_annotations_parallel)
+
+
+def test_profiled_request_runs_in_the_calling_thread(file, parallel, monkeypatch):
+    monkeypatch.setattr(Trace, "PROFILING_ENABLED", True)
+    response = handlers.extract_annotations({"file": file, "timings": True, "profile": True})
+    assert response["success"] and response["data"]["annotations"]
+    assert response["timings"]["totalMs"] > 0
+    assert [stage["stage"] for stage in response["timings"]["stages"]][0] == "open"
+
+    profile = response["profile"]
+    assert "error" not in profile
+    assert profile["scope"] == "calling thread; peak memory of the whole process"
+    assert profile["peakMemoryBytes"] > 0
+    assert 0 < len(profile["functions"]) <= Trace.PROFILE_TOP
+    # the page extraction ran in the profiled thread
+    assert any("extraction.py" in function["function"] and "extract_pages" in function["function"]
+               for function in profile["functions"])
+    # and would have been sharded without the profile
+    assert extraction.use_parallel(response["pageCount"])
+
+
+def test_no_profile_when_profiling_is_disabled(file, monkeypatch):
+    monkeypatch.setattr(Trace, "PROFILING_ENABLED", False)
+    response = handlers.extract_annotations({"file": file, "timings": True, "profile": True})
+    assert response["success"] and "timings" in response
+    assert response["profile"] == {"error": "profiling is not enabled in this deployment"}
+
+    response = handlers.extract_annotations({"file": file, "timings": True})
+    assert "timings" in response and "profile" not in response
+
+
+def test_profiled_extraction_is_not_dispatched_sharded(file, parallel):
+    service = PdfService()
+    assert service.sharded("annotationsExtract", {"file": file})
+    assert not service.sharded("annotationsExtract", {"file": file, "profile": True})
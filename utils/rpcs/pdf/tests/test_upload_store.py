@@ -0,0 +1,95 @@
+import hashlib
+import os
+import time
+
+import pytest
+
+from UploadStore import UploadStore
+
+CONTENT = b"%PDF-1.7 " + bytes(range(256)) * 4
+
+
+@pytest.fixture
+def store(tmp_path):
+    return UploadStore(str(tmp_path), max_age=60, max_chunk=256)
+
+
+def digest(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def test_resumed_upload_continues_at_the_received_offset(store):
+    upload_id = store.begin(len(CONTENT), digest(CONTENT))["uploadId"]
+    store.chunk(upload_id, 0, CONTENT[:256])
+    store.chunk(upload_id, 256, CONTENT[256:512])
+
+    resumed = store.begin(len(CONTENT), digest(CONTENT).upper(), upload_id)
+    assert resumed == {"uploadId": upload_id, "received": 512, "committed": False}
+    # a chunk sent again after the reconnect overwrites the same bytes
+    store.chunk(upload_id, 256, CONTENT[256:512])
+    for offset in range(512, len(CONTENT), 256):
+        store.chunk(upload_id, offset, CONTENT[offset:offset + 256])
+
+    ref = store.commit(upload_id)
+    assert ref == {"uploadId": upload_id, "hash": digest(CONTENT), "size": len(CONTENT)}
+    assert store.begin(len(CONTENT), digest(CONTENT), upload_id)["committed"]
+    fetched = store.fetch(upload_id, 0, 256)["data"] + store.fetch(upload_id, 256, 10000)["data"]
+    assert fetched == CONTENT[:512]
+
+
+def test_resume_for_another_file_is_rejected(store):
+    upload_id = store.begin(len(CONTENT), digest(CONTENT))["uploadId"]
+    with pytest.raises(ValueError, match="different file"):
+        store.begin(len(CONTENT), digest(b"another file"), upload_id)
+    with pytest.raises(ValueError, match="different file"):
+        store.begin(len(CONTENT) + 1, digest(CONTENT), upload_id)
+
+
+def test_commit_rejects_a_hash_mismatch(store):
+    corrupted = CONTENT[:-1] + b"x"
+    upload_id = store.begin(len(CONTENT), digest(CONTENT))["uploadId"]
+    for offset in range(0, len(corrupted), 256):
+        store.chunk(upload_id, offset, corrupted[offset:offset + 256])
+    with pytest.raises(ValueError, match="does not match its hash"):
+        store.commit(upload_id)
+    with pytest.raises(ValueError, match="not committed"):
+        store.fetch(upload_id)
+
+
+def test_commit_rejects_an_incomplete_upload(store):
+    upload_id = store.begin(len(CONTENT), digest(CONTENT))["uploadId"]
+    store.chunk(upload_id, 0, CONTENT[:256])
+    with pytest.raises(ValueError, match="incomplete"):
+        store.commit(upload_id)
+
+
+@pytest.mark.parametrize("offset, size", [(512, 256), (0, 257), (len(CONTENT) - 100, 200), (-1, 1)])
+def test_invalid_chunks_are_rejected(store, offset, size):
+    upload_id = store.begin(len(CONTENT), digest(CONTENT))["uploadId"]
+    store.chunk(upload_id, 0, CONTENT[:256])
+    with pytest.raises(ValueError):
+        store.chunk(upload_id, offset, b"x" * size)
+
+
+@pytest.mark.parametrize("upload_id", ["../../etc/passwd", "0" * 31, "Z" * 32, 12345])
+def test_invalid_upload_ids_are_rejected(store, upload_id):
+    with pytest.raises(ValueError):
+        store.begin(len(CONTENT), digest(CONTENT), upload_id)
+
+
+def test_upload_expires_as_a_unit(store, tmp_path):
+    active = store.begin(len(CONTENT), digest(CONTENT))["uploadId"]
+    stale = store.begin(len(CONTENT), digest(CONTENT))["uploadId"]
+    result = "f" * 32
+    (tmp_path / f"{result}.pdf").write_bytes(b"result")
+    past = time.time() - 120
+    for name in os.listdir(tmp_path):
+        os.utime(tmp_path / name, (past, past))
+
+    # the chunk only writes the part file, the meta of the upload must stay
+    store.chunk(active, 0, CONTENT[:256])
+    store.expire()
+    assert sorted(os.listdir(tmp_path)) == [f"{active}.json", f"{active}.part"]
+    assert store.begin(len(CONTENT), digest(CONTENT), active)["received"] == 256
+    with pytest.raises(ValueError, match="Unknown upload"):
+        store.begin(len(CONTENT), digest(CONTENT), stale)
@@ -0,0 +1,84 @@
+import random
+
+import pymupdf
+import pytest
+
+import WordIndex as word_index_module
+from WordIndex import WordIndex, check_contain
+from samples import documents
+
+
+def baseline_words(words, points):
+    """
+    The words of a quad as found before the index: every word of the page checked with check_contain.
+    """
+    return [w for w in words if check_contain(pymupdf.Rect(w[:4]), points)]
+
+
+def page_quads(page, rng):
+    """
+    The quads of all highlights of a page, plus quads shifted by fractions of a word and ones covering
+    the whole page, a single point or nothing, which exercise the threshold and the scan of all words.
+    """
+    quads = []
+    for annot in page.annots():
+        vertices = annot.vertices or []
+        quads.extend(vertices[i * 4: i * 4 + 4] for i in range(len(vertices) // 4))
+    shifted = []
+    for points in quads:
+        dx, dy = rng.uniform(-8, 8), rng.uniform(-4, 4)
+        shifted.append([(x + dx, y + dy) for x, y in points])
+    rect = page.rect
+    extra = [
+        [rect.tl, rect.tr, rect.bl, rect.br],
+        [(100, 100)] * 4,
+        [(-20, -20), (-10, -20), (-20, -10), (-10, -10)],
+    ]
+    return quads + shifted + extra
+
+
+@pytest.fixture(params=["numpy", "fallback"])
+def engine(request, monkeypatch):
+    if request.param == "numpy":
+        pytest.importorskip("numpy")
+    else:
+        monkeypatch.setattr(word_index_module, "np", None)
+    return request.param
+
+
+@pytest.mark.parametrize("multiline", [False, True])
+def test_words_in_quads_equal_the_baseline(engine, multiline):
+    rng = random.Random(2)
+    doc = pymupdf.open(stream=documents(pages=2, words=200, density=0.1, multiline=multiline, grouping="foreign")["annotated"])
+    for page in doc:
+        words = page.get_text("words")
+        index = WordIndex(words)
+        assert (index.boxes is None) == (engine == "fallback")
+        quads = page_quads(page, rng)
+        assert len(quads) > 3
+        expected = [baseline_words(words, points) for points in quads]
+        assert index.words_in_quads(quads) == expected
+        assert [index.words_in_quad(points) for points in quads] == expected
+
+
+def test_candidates_contain_every_intersecting_word():
+    rng = random.Random(3)
+    doc = pymupdf.open(stream=documents(pages=1, words=400)["plain"])
+    words = doc[0].get_text("words")
+    # a small grid, so most queries only look at a few cells
+    index = WordIndex(words, cell_size=15)
+    for _ in range(200):
+        x, y = rng.uniform(0, 600), rng.uniform(0, 840)
+        rect = pymupdf.Rect(x, y, x + rng.uniform(1, 120), y + rng.uniform(1, 30))
+        candidates = index.candidates(rect)
+        assert candidates == sorted(candidates)
+        assert {i for i, w in enumerate(words) if pymupdf.Rect(w[:4]).intersects(rect)} <= set(candidates)
+
+
+def test_first_intersecting_is_in_reading_order():
+    doc = pymupdf.open(stream=documents(pages=1, words=100)["plain"])
+    words = doc[0].get_text("words")
+    index = WordIndex(words)
+    line = pymupdf.Rect(words[0][:4]) | pymupdf.Rect(words[3][:4])
+    assert index.first_intersecting(line) == 0
+    assert index.first_intersecting(pymupdf.Rect(-20, -20, -10, -10)) is None
@@ -1,6 +1,14 @@
 import logging
+import os
+import sys
 import socketio
 
+# the modules shared by all RPC services are copied next to this file in the Docker image,
+# from a checkout they are imported from utils/rpcs/common
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "common"))
+
+from Metrics import metrics
+
 
 def create_app():
 
@@ -21,6 +29,9 @@ def create_app():
         return "World!"
 
 
+    # request metrics of all events, served at /metrics beside the Socket.IO endpoint
+    metrics.instrument(sio)
+
     logger.info("Creating App...")
-    app = socketio.WSGIApp(sio)
+    app = socketio.WSGIApp(sio, metrics.wsgi_app)
     return app